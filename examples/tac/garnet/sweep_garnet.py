@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+"""Sweep the step sizes of the actor-critic learners on the garnet testbed.
+
+The testbed is loaded once by garnetproblem and shared with the workers of
+the sweep. The results are written to a csv table with one row per
+(configuration, seed).
+
+Sample Commands: (in top folder)
+./blaze run examples/tac/garnet/sweep_garnet.py lstd results/lstd_sweep.csv
+./blaze run examples/tac/garnet/sweep_garnet.py td results/td_sweep.csv
+--design lhs --number 50 --seeds 10
+"""
+import argparse
+import functools
+import scipy
+
+from librl.agents.actorcriticagent import ActorCriticAgent
+from librl.environments.garnet import *
+from librl.experiments import *
+from librl.learners import *
+from librl.learners.bsgl import *
+from librl.policies import *
+import garnetproblem as prob
+
+parser = argparse.ArgumentParser(description='sweep learner parameters')
+parser.add_argument('learner', choices=['td', 'lstd', 'hlstd', 'bsgl'])
+parser.add_argument('output_filename', help='path of the csv table')
+parser.add_argument('--design', choices=['grid', 'random', 'lhs'],
+                    default='grid')
+parser.add_argument('--number', type=int, default=20,
+                    help='# of configurations of random and lhs designs')
+parser.add_argument('--seeds', type=int, default=5, help='# of seeds')
+parser.add_argument('--sessionNumber', type=int, default=1000)
+parser.add_argument('--sessionSize', type=int, default=1000)
+parser.add_argument('--processes', type=int, default=None)
+
+####### parameters ##############
+# the dimensionality of parameters in our policy is equal to the
+# dimensionality of state feature vector.
+paramDim = prob.feaDim
+
+# Bound of parameters.
+bound = [(-100, 100)] * paramDim
+
+# temperature of boltzmann policy.
+T = 1
+
+# max norm of the critic parameter.
+maxcriticnorm = 100000
+
+# values for the grid design.
+GRID = {
+    'cssinitial': [0.01, 0.1, 1],
+    'cssdecay': [100, 1000],
+    'assinitial': [0.01, 0.1],
+    'assdecay': [100, 1000],
+    'rdecay': [0.8, 0.95],
+    'tracestepsize': [0.5, 0.9],
+}
+
+# ranges for the random designs.
+SPACE = {
+    'cssinitial': (1e-3, 1, 'log'),
+    'cssdecay': (10, 1e4, 'log'),
+    'assinitial': (1e-3, 1, 'log'),
+    'assdecay': (10, 1e4, 'log'),
+    'rdecay': (0.5, 1),
+    'tracestepsize': (0, 1),
+}
+
+# arguments that a learner doesn't take. bsgl method doesn't use traces.
+UNUSED = {
+    'bsgl': ['tracestepsize'],
+}
+
+#################################
+
+def getSpace(space, name):
+    """The part of space used by learner name"""
+    return dict((k, v) for k, v in space.iteritems()
+                if k not in UNUSED.get(name, []))
+
+def buildExperiment(name, config, seed):
+    prob.env.reset()
+    prob.env.random.seed(seed)
+    prob.env.uniforms.reset()
+    if name == 'bsgl':
+        task = GarnetLookForwardWithStateObsTask(prob.env, prob.sigma,
+                                                 seed=seed)
+        policy = GLFWSBoltzmanPolicy(prob.numActions, T=T,
+                                     theta=scipy.zeros((paramDim,)))
+        featureModule = GLFWSPolicyFeatureModule(policy, 'bsglpolicywrapper')
+        learner = BSGLAdvParamActorCriticLearner(module=featureModule,
+                                                 maxcriticnorm=maxcriticnorm,
+                                                 parambound=bound, **config)
+    else:
+        task = GarnetLookForwardTask(prob.env, prob.sigma, seed=seed)
+        policy = BoltzmanPolicy(prob.numActions, T=T,
+                                theta=scipy.zeros((paramDim,)))
+        featureModule = PolicyFeatureModule(policy, 'bsglpolicywrapper')
+        if name == 'hlstd':
+            learner = HessianLSTDLearner(hessianlearningrate=1,
+                                         module=featureModule,
+                                         maxcriticnorm=maxcriticnorm,
+                                         parambound=bound, **config)
+            learner.minHessianSampleNumber = 100
+            learner.actorUpdateThreshold = 1
+            learner.rewardRange = [0, 500]
+        else:
+            learnerClass = TDLearner if name == 'td' else LSTDLearner
+            learner = learnerClass(module=featureModule,
+                                   maxcriticnorm=maxcriticnorm,
+                                   parambound=bound, **config)
+
+    agent = ActorCriticAgent(learner, sdim=task.outdim, adim=1, batch=True)
+    return SessionExperiment(task, agent, policy=policy, batch=True)
+
+if __name__ == '__main__':
+    ARGS = parser.parse_args()
+    if ARGS.design == 'grid':
+        design = gridDesign(getSpace(GRID, ARGS.learner))
+    elif ARGS.design == 'random':
+        design = randomDesign(getSpace(SPACE, ARGS.learner), ARGS.number)
+    else:
+        design = latinHypercubeDesign(getSpace(SPACE, ARGS.learner),
+                                      ARGS.number)
+
+    # stop runs that diverge or fall far behind the best finished run.
+    stopper = EarlyStopper(minSessions=ARGS.sessionNumber // 10,
+                           window=ARGS.sessionNumber // 20 + 1,
+                           margin=0.5 * ARGS.sessionSize)
+    runSweep(functools.partial(buildExperiment, ARGS.learner), design,
+             range(ARGS.seeds), ARGS.sessionNumber, ARGS.sessionSize,
+             ARGS.output_filename, ARGS.processes, stopper)
@@ -1,6 +1,7 @@
 __author__ = 'Jing Conan Wang, wangjing@bu.edu'
 
 from pybrain.rl.agents.logging import LoggingAgent
+from .history import RingBufferHistory
 
 class ActorCriticAgent(LoggingAgent):
     """Agent for Actor Crictic algorithm
@@ -12,18 +13,26 @@ class ActorCriticAgent(LoggingAgent):
 
     the usage of Agent is to extract the feature for each state.
     store them together and call learner.
+
+    The history is a RingBufferHistory. In batch mode, it keeps all samples
+    of a session and grows if a session is longer than maxHistoryLength. In
+    incremental mode, it keeps the last maxHistoryLength samples and the
+    learner is called on the previous transition.
     """
 
     def __init__(self, learner, sdim, adim=1, maxHistoryLength=1000,
                  batch=False):
-        LoggingAgent.__init__(self, sdim, adim)
+        # LoggingAgent.__init__ is not called, because the ReinforcementDataSet
+        # it allocates would be replaced by the RingBufferHistory right away.
+        self.indim = sdim
+        self.outdim = adim
+        self.history = RingBufferHistory(sdim, adim, maxHistoryLength,
+                                         grow=batch)
         self.learner = learner
         self.policy = self.learner.module.policy
         self.lastaction = None
         self.learning = True
         self.batch = batch
-
-        self.currentDataIndex = 0
         self.maxHistoryLength = maxHistoryLength
 
     def getAction(self):
@@ -47,15 +56,9 @@ class ActorCriticAgent(LoggingAgent):
             self.history.clear()
             return
 
-        # learn incrementally
-        #  self.learner.learnOnDataSet(self.history)
-        historyLength = self.history.getLength()
+        # learn incrementally on the previous transition. The ring buffer
+        # drops old samples by itself, so it never needs to be cleared.
         if historyLength >= 2:
             self.learner.learnOnDataSet(self.history,
-                                        self.currentDataIndex,
-                                        self.currentDataIndex+1)
-            self.currentDataIndex += 1
-
-        if historyLength > self.maxHistoryLength:
-            self.history.clear()
-            self.currentDataIndex = 0
+                                        historyLength - 2,
+                                        historyLength - 1)
@@ -2,6 +2,7 @@ from __future__ import print_function, division, absolute_import
 import unittest
 import scipy
 from numpy.testing import assert_array_almost_equal
+from pybrain.rl.agents import logging
 from .actorcriticagent import ActorCriticAgent
 from ..testutil import MockPolicy, MockLearner
 
@@ -18,5 +19,28 @@ class TDLearnerTestCase(unittest.TestCase):
         self.agent.lastobs = 'obs_1'
         self.assertEqual('action_1', self.agent.getAction())
 
+    def testLearnIncrementally(self):
+        calls = []
+        def learnOnDataSet(dataset, startIndex, endIndex):
+            calls.append(dataset.getLinked(startIndex)[0][0])
+            self.assertEqual(startIndex + 1, endIndex)
+        self.learner.learnOnDataSet = learnOnDataSet
+        agent = ActorCriticAgent(self.learner, 1, 1, maxHistoryLength=3)
+        for i in xrange(6):
+            agent.history.addSample([i], [0], 0)
+            agent.learn()
+        # the previous transition is learned after each step.
+        self.assertEqual([0, 1, 2, 3, 4], calls)
+        self.assertEqual(3, agent.history.getLength())
+
+    def testNoDataSet(self):
+        def createDataSet(*args):
+            self.fail('the pybrain dataset should not be created')
+        self.addCleanup(setattr, logging, 'ReinforcementDataSet',
+                        logging.ReinforcementDataSet)
+        logging.ReinforcementDataSet = createDataSet
+        agent = ActorCriticAgent(self.learner, 2, 1)
+        self.assertEqual((2, 1), (agent.indim, agent.outdim))
+
 if __name__ == "__main__":
     unittest.main()
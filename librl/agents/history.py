@@ -0,0 +1,96 @@
+from __future__ import print_function, division, absolute_import
+import scipy
+
+class RingBufferHistory(object):
+    """History of (obs, action, reward) stored in preallocated arrays.
+
+    It provides the part of the ReinforcementDataSet interface used by the
+    agents and learners (addSample, getLength, getLinked, clear and
+    newSequence). getLinked returns views of the arrays instead of copies, so
+    they are only valid until the slot is overwritten. Negative indices count
+    from the newest sample, i.e., getLinked(-1) is the current transition and
+    getLinked(-2) is the previous one.
+
+    If grow is False, the capacity is fixed and the oldest sample is
+    overwritten when the buffer is full. Otherwise, the capacity is doubled
+    when the buffer is full. clear() never reallocates the arrays.
+    """
+    # attributes stored in checkpoints, see librl.experiments.checkpoint.
+    stateAttributes = ('capacity', 'obs', 'action', 'reward', 'start',
+                       'length')
+    # the buffers change their length when the history grows.
+    resizableAttributes = ('obs', 'action', 'reward')
+    def __init__(self, statedim, actiondim, capacity=1000, grow=False):
+        assert capacity >= 2, 'capacity should be at least 2'
+        self.statedim = statedim
+        self.actiondim = actiondim
+        self.grow = grow
+        self._allocate(capacity)
+        self.clear()
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.obs = scipy.zeros((capacity, self.statedim))
+        self.action = scipy.zeros((capacity, self.actiondim))
+        self.reward = scipy.zeros((capacity, 1))
+
+    def clear(self):
+        self.start = 0
+        self.length = 0
+
+    def newSequence(self):
+        """Sequences are not distinguished, the history is a single
+        sequence."""
+        pass
+
+    def getLength(self):
+        return self.length
+
+    def __len__(self):
+        return self.length
+
+    def _growCapacity(self):
+        # unroll the ring into the new arrays.
+        order = (self.start + scipy.arange(self.length)) % self.capacity
+        obs, action, reward = self.obs[order], self.action[order], \
+            self.reward[order]
+        self._allocate(2 * self.capacity)
+        self.obs[:self.length] = obs
+        self.action[:self.length] = action
+        self.reward[:self.length] = reward
+        self.start = 0
+
+    def addSample(self, obs, action, reward):
+        if self.length == self.capacity:
+            if self.grow:
+                self._growCapacity()
+            else:
+                # overwrite the oldest sample.
+                self.start = (self.start + 1) % self.capacity
+                self.length -= 1
+        pos = (self.start + self.length) % self.capacity
+        self.obs[pos] = obs
+        self.action[pos] = action
+        self.reward[pos] = reward
+        self.length += 1
+
+    def getLinked(self, index):
+        """Return views of (obs, action, reward) of the index-th oldest
+        sample"""
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('index %d is out of range' % index)
+        pos = (self.start + index) % self.capacity
+        return self.obs[pos], self.action[pos], self.reward[pos]
+
+    def getArrays(self):
+        """Return (obs, action, reward) arrays of all samples from the oldest
+        to the newest. They are views of the buffer unless the samples wrap
+        around the end of the ring."""
+        end = self.start + self.length
+        if end <= self.capacity:
+            return (self.obs[self.start:end], self.action[self.start:end],
+                    self.reward[self.start:end])
+        order = (self.start + scipy.arange(self.length)) % self.capacity
+        return self.obs[order], self.action[order], self.reward[order]
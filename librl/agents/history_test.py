@@ -0,0 +1,63 @@
+from __future__ import print_function, division, absolute_import
+import unittest
+import scipy
+from numpy.testing import assert_array_almost_equal
+from .history import RingBufferHistory
+
+class RingBufferHistoryTestCase(unittest.TestCase):
+    def addSamples(self, history, start, end):
+        for i in xrange(start, end):
+            history.addSample([i, -i], [i % 2], i / 10)
+
+    def assertSample(self, i, sample):
+        obs, action, reward = sample
+        assert_array_almost_equal([i, -i], obs)
+        assert_array_almost_equal([i % 2], action)
+        assert_array_almost_equal([i / 10], reward)
+
+    def testRing(self):
+        history = RingBufferHistory(2, 1, capacity=3)
+        self.addSamples(history, 0, 2)
+        self.assertEqual(2, history.getLength())
+        self.assertSample(0, history.getLinked(0))
+        self.assertSample(1, history.getLinked(-1))
+
+        self.addSamples(history, 2, 7)
+        self.assertEqual(3, history.getLength())
+        self.assertEqual(3, history.capacity)
+        for i in xrange(3):
+            self.assertSample(4 + i, history.getLinked(i))
+        self.assertSample(6, history.getLinked(-1))
+        self.assertSample(5, history.getLinked(-2))
+        self.assertRaises(IndexError, history.getLinked, 3)
+
+        obs, action, reward = history.getArrays()
+        assert_array_almost_equal([[4, -4], [5, -5], [6, -6]], obs)
+        assert_array_almost_equal([[0], [1], [0]], action)
+        assert_array_almost_equal([[0.4], [0.5], [0.6]], reward)
+
+        # the samples are views of the buffer.
+        obs, _, _ = history.getLinked(-1)
+        obs[0] = 100
+        self.assertEqual(100, history.getLinked(-1)[0][0])
+
+        buf = history.obs
+        history.clear()
+        self.assertEqual(0, history.getLength())
+        self.addSamples(history, 0, 1)
+        self.assertSample(0, history.getLinked(0))
+        self.assertTrue(buf is history.obs)
+
+    def testGrow(self):
+        history = RingBufferHistory(2, 1, capacity=2, grow=True)
+        self.addSamples(history, 0, 7)
+        self.assertEqual(7, history.getLength())
+        self.assertEqual(8, history.capacity)
+        for i in xrange(7):
+            self.assertSample(i, history.getLinked(i))
+        obs, _, _ = history.getArrays()
+        self.assertTrue(obs.base is history.obs)
+        assert_array_almost_equal(scipy.arange(7), obs[:, 0])
+
+if __name__ == "__main__":
+    unittest.main()
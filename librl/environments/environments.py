@@ -4,6 +4,10 @@ from pybrain.rl.environments.task import Task
 class StateObsWrapperTask(Task):
     """A wrapper task that adds state observations to tasks that only output
        state-action observations"""
+    # methods timed by librl.profiler.PhaseProfiler.
+    profiledPhases = {'getObservation': 'observation',
+                      'performAction': 'environment',
+                      'getReward': 'reward'}
     def __init__(self, task):
         self.task = task
         self.numActions = self.task.env.numActions
@@ -2,7 +2,9 @@ from __future__ import print_function, division, absolute_import
 import scipy
 from pybrain.rl.environments.environment import Environment
 from pybrain.rl.environments.task import Task
-from librl.util import zdump, zload
+from scipy.sparse import csr_matrix
+from librl.util import zdump, zload, zcache, adump, aload, createRandomState, \
+    RandomBuffer
 
 # FIXME(hbhzwj) add unittest for GarnetTask and GarnetEnvironment.
 class GarnetTask(Task):
@@ -11,7 +13,13 @@ class GarnetTask(Task):
     The expected reward for each transition is a normally distributed random
     variable with mean 0 and unit variance. The actual reward id selected
     randomly according to a normal distribution with mean equal to the
-    expected reward and standard deviation \sigma.
+    expected reward and standard deviation \sigma. The expected rewards are
+    generated by the environment (see GarnetEnvironment.expectedReward) and
+    the noise is drawn in blocks from a random generator seeded by *seed*.
+
+    If the environment runs in batch mode (numChains is not None), the task
+    takes an action for each chain, getReward returns a (numChains,) array and
+    getObservation returns a (numChains, outdim) array.
 
     The state-action observation is created based on pg. 29 of
     Bhatnagar, Shalabh, et al. "Natural actor-critic algorithms." Automatica
@@ -19,29 +27,47 @@ class GarnetTask(Task):
     phi(x, u) = (0...0, fs, 0...0)
                   u-1        m-i
     """
-    def __init__(self, environment, sigma):
+    # number of reward noise samples drawn at once.
+    noiseBlockSize = 4096
+    # attributes stored in checkpoints. The observation table is fixed.
+    stateAttributes = ('noise',)
+    # methods timed by librl.profiler.PhaseProfiler.
+    profiledPhases = {'getObservation': 'observation',
+                      'performAction': 'environment',
+                      'getReward': 'reward'}
+    def __init__(self, environment, sigma, obsTablePath=None, seed=None):
         super(GarnetTask, self).__init__(environment)
         self.sigma = sigma
-        self.rewardCache = dict()
+        self.noise = RandomBuffer(createRandomState(seed), 'standard_normal',
+                                  self.noiseBlockSize)
         self.numStates = self.env.numStates
         self.numActions = self.env.numActions
 
-    def _getExpectedReward(self, key):
-        expectedReward = self.rewardCache.get(key)
-        if expectedReward is not None:
-            return expectedReward
-        self.rewardCache[key] = scipy.random.randn()
-        return self.rewardCache[key]
+        # The observation only depends on the state, so observations of all
+        # states are calculated once. If obsTablePath is provided, the table
+        # is loaded from or saved to this file.
+        self.obsTable = zcache(obsTablePath, self._getObservationTable)
+        assert self.obsTable.shape == (self.numStates, self.outdim), \
+            'invalid observation table'
+        self.obsTable.setflags(write=False)
+
+    def _getExpectedReward(self):
+        """expected reward of the last transition"""
+        return self.env.expectedReward[
+            self.env.getActionIndex(self.env.lastAction),
+            self.env.prevState, self.env.lastBranch]
 
     def performAction(self, action):
         self.env.lastAction = action
         super(GarnetTask, self).performAction(action)
 
     def getReward(self):
-        key = (self.env.prevState, self.env.curState,
-               int(self.env.lastAction[0]))
-        expectedReward = self._getExpectedReward(key)
-        reward = self.sigma * scipy.random.randn() + expectedReward
+        expectedReward = self._getExpectedReward()
+        if self.env.numChains is None:
+            noise = self.noise.next()
+        else:
+            noise = self.noise.take(self.env.numChains)
+        reward = self.sigma * noise + expectedReward
         return reward
 
     @property
@@ -50,12 +76,33 @@ class GarnetTask(Task):
         return self.numActions * edim * self.numActions
 
     def getObservation(self):
-        sensors = self.env.getSensors()
-        fd = len(sensors)
-        feature = scipy.zeros((self.numActions, fd * self.numActions))
+        """Return a read-only view of the observation of the current state. In
+        batch mode, a (numChains, outdim) array is returned."""
+        return self.obsTable[self.env.curState]
+
+    def _getStateObsTable(self):
+        """sensors of all states, a (numStates, feaDim) array"""
+        return scipy.array([self.env.getSensors(s)
+                            for s in xrange(self.numStates)], dtype=float)
+
+    def _getObservationTable(self):
+        """observations of all states, a (numStates, outdim) array"""
+        sensors = self._getStateObsTable()
+        fd = sensors.shape[1]
+        feature = scipy.zeros((self.numStates, self.numActions,
+                               fd * self.numActions))
         for i in xrange(self.numActions):
-            feature[i, (i*fd):((i+1)*fd)] = sensors
-        return feature.reshape(-1)
+            feature[:, i, (i*fd):((i+1)*fd)] = sensors
+        return feature.reshape(self.numStates, -1)
+
+    def _getLookForwardFeature(self):
+        """E(fs|u) - fs of all states and actions, a (numStates, numActions,
+        feaDim) array"""
+        sensors = self._getStateObsTable()
+        # expected[s, u] = sum_b prob[u, s, b] * sensors[nextStates[u, s, b]]
+        expected = scipy.array([P.dot(sensors)
+                                for P in self.env.getTransitionMatrices()])
+        return expected.transpose(1, 0, 2) - sensors[:, None, :]
 
 class GarnetLookForwardTask(GarnetTask):
     """Garnet task whose feature is created by looking forward.
@@ -69,19 +116,8 @@ class GarnetLookForwardTask(GarnetTask):
         edim = self.env.outdim
         return self.numActions * edim
 
-    def getObservation(self):
-        sensors = self.env.getSensors()
-        fd = len(sensors)
-        feature = scipy.zeros((self.numActions, fd))
-        for i in xrange(self.numActions):
-            nextStates = self.env.transitionStates[i, self.env.curState, :]
-            prob = self.env.transitionProb[i, self.env.curState, :]
-            res = scipy.zeros((fd,))
-            for ss, p in zip(nextStates, prob):
-                obs = self.env.getSensors(int(ss))
-                res += scipy.array(obs)* p
-            feature[i, :] = res - scipy.array(sensors)
-        return feature.reshape(-1)
+    def _getObservationTable(self):
+        return self._getLookForwardFeature().reshape(self.numStates, -1)
 
 # TODO(hbhzwj): replace it with StateObsWrapperTask
 class GarnetLookForwardWithStateObsTask(GarnetTask):
@@ -91,21 +127,11 @@ class GarnetLookForwardWithStateObsTask(GarnetTask):
         edim = self.env.outdim
         return (self.numActions + 1) * edim
 
-    def getObservation(self):
-        sensors = self.env.getSensors()
-        fd = len(sensors)
-        feature = scipy.zeros((self.numActions + 1, fd))
-        for i in xrange(self.numActions):
-            nextStates = self.env.transitionStates[i, self.env.curState, :]
-            prob = self.env.transitionProb[i, self.env.curState, :]
-            res = scipy.zeros((fd,))
-            for ss, p in zip(nextStates, prob):
-                obs = self.env.getSensors(int(ss))
-                res += scipy.array(obs)* p
-            feature[i, :] = res - scipy.array(sensors)
-        feature[self.numActions, :] = scipy.array(sensors)
-
-        return feature.reshape(-1)
+    def _getObservationTable(self):
+        feature = scipy.concatenate((self._getLookForwardFeature(),
+                                     self._getStateObsTable()[:, None, :]),
+                                    axis=1)
+        return feature.reshape(self.numStates, -1)
 
 
 class GarnetEnvironment(Environment):
@@ -122,86 +148,309 @@ class GarnetEnvironment(Environment):
     feaDim, feaSum: int
         the feature for each state is a vector of {0, 1} whose length is feaDim
         and whose sum is feaSum.
+    seed : int
+        seed of the random number generator used to generate the testbed and
+        the transitions. If it is None, the seed is drawn from scipy.random,
+        so seeding scipy.random still makes the runs reproducible.
+    savePath, loadPath : str
+        path to store or load the testbed. Paths ending with testbedExt
+        ('.testbed') are directories of uncompressed arrays written by
+        librl.util.adump. They are memory-mapped when loaded, so parallel runs
+        on the same testbed share one copy of the tables. Other paths are gzip
+        compressed pickles.
+    numChains : int
+        if it is not None, the environment runs numChains independent chains
+        in lockstep (batch mode). curState is then an integer array of length
+        numChains, and performAction takes one action for each chain. All
+        chains share the transition tables and the random number generator.
+
+    The expected reward of each transition is stored in expectedReward, whose
+    layout is the same as transitionStates, i.e., expectedReward[u, i, j] is
+    the expected reward of the transition from state i to
+    transitionStates[u, i, j] under action u. There is no entry for
+    transitions that cannot happen, so the table stays small for large
+    numStates.
 
     """
     initState = 0
+    # number of uniform random numbers drawn at once for transitions.
+    uniformBlockSize = 4096
+    # the features are drawn by ranking if there are at most this many of
+    # them.
+    maxObsRank = 2**62
+    # extension of testbeds stored as memory-mappable arrays.
+    testbedExt = '.testbed'
+    # attributes stored in checkpoints. The tables are fixed, only the
+    # current state and the random number generator change.
+    stateAttributes = ('curState', 'prevState', 'lastBranch', 'lastAction',
+                       'random', 'uniforms')
     def __init__(self, numStates, numActions, branching, feaDim, feaSum,
-                 savePath=None, loadPath=None):
+                 savePath=None, loadPath=None, seed=None, numChains=None):
         self.numStates = numStates
         self.numActions = numActions
         self.branching = branching
         self.feaDim = feaDim
         self.feaSum = feaSum
+        self.numChains = numChains
+
+        self.random = createRandomState(seed)
+        self.uniforms = RandomBuffer(self.random, 'random_sample',
+                                     self.uniformBlockSize)
 
         if loadPath is not None:
             self._load(loadPath)
         else:
             self._genTransitionTable()
             self._genStateObs()
+            self._genExpectedReward()
 
         if savePath is not None:
             self._save(savePath)
 
-        self.curState = self.initState
+        self.reset()
         # null value for action
-        self.lastAction = scipy.array([-1])
+        self.lastAction = scipy.array([-1.0])
 
     @property
     def outdim(self):
         return self.feaDim
 
     def _save(self, savePath):
+        if savePath.endswith(self.testbedExt):
+            self._saveArrays(savePath)
+            return
         message = dict()
         message['transitionStates'] = self.transitionStates
         message['transitionProb'] = self.transitionProb
         message['stateObs'] = self.stateObs
+        message['expectedReward'] = self.expectedReward
         zdump(message, savePath)
 
     def _load(self, loadPath):
+        if loadPath.endswith(self.testbedExt):
+            self._loadArrays(loadPath)
+            return
         message = zload(loadPath)
         self.transitionStates = message['transitionStates']
         self.transitionProb = message['transitionProb']
         self.stateObs = message['stateObs']
+        self._buildSampler()
+        # testbeds created by earlier versions don't have expected rewards.
+        if 'expectedReward' in message:
+            self.expectedReward = message['expectedReward']
+        else:
+            self._genExpectedReward()
+
+    def _getTestbedHeader(self):
+        return dict(numStates=self.numStates, numActions=self.numActions,
+                    branching=self.branching, feaDim=self.feaDim,
+                    feaSum=self.feaSum)
+
+    def _saveArrays(self, savePath):
+        arrays = dict()
+        arrays['transitionStates'] = self.transitionStates
+        arrays['transitionProb'] = self.transitionProb
+        arrays['transitionCdf'] = self.transitionCdf
+        arrays['stateObs'] = scipy.array(self.stateObs, dtype=int)
+        arrays['expectedReward'] = self.expectedReward
+        adump(arrays, savePath, header=self._getTestbedHeader())
+
+    def _loadArrays(self, loadPath):
+        header, arrays = aload(loadPath)
+        for key, value in self._getTestbedHeader().iteritems():
+            if header[key] != value:
+                raise ValueError('testbed %s has %s=%s, but %s is expected' %
+                                 (loadPath, key, header[key], value))
+        self.transitionStates = arrays['transitionStates']
+        self.transitionProb = arrays['transitionProb']
+        # the cdf is stored as well so that it is shared instead of being
+        # recomputed by every process.
+        self.transitionCdf = arrays['transitionCdf']
+        self.stateObs = arrays['stateObs']
+        self.expectedReward = arrays['expectedReward']
+
+    def _genExpectedReward(self):
+        self.expectedReward = self.random.standard_normal(
+            (self.numActions, self.numStates, self.branching))
 
     def _genStateObs(self):
-        pos = range(self.feaDim)
-        stateObs = set()
-        while len(stateObs) < self.numStates:
-            obs = scipy.zeros((self.feaDim,), dtype=int)
-            ones = scipy.random.choice(pos, self.feaSum, False)
-            obs[ones] = 1
-            stateObs.add(tuple(obs.tolist()))
-        self.stateObs = list(stateObs)
+        """Generate distinct {0, 1} features of length feaDim whose sum is
+        feaSum for all states.
+
+        The features are drawn as distinct ranks in the lexicographic order of
+        all C(feaDim, feaSum) features and then unranked at once. If the ranks
+        don't fit in an int64, random features are drawn and the duplicates,
+        found by hashing the bit-packed features, are drawn again.
+        """
+        binom = _getBinomialTable(self.feaDim, self.feaSum)
+        total = binom[self.feaDim][self.feaSum]
+        if total < self.numStates:
+            raise ValueError('there are only %d features with feaDim=%d and '
+                             'feaSum=%d, which is less than numStates=%d' %
+                             (total, self.feaDim, self.feaSum, self.numStates))
+        if total <= self.maxObsRank:
+            ranks = self._sampleObsRanks(total)
+            self.stateObs = _unrankCombinations(ranks, self.feaDim,
+                                                self.feaSum, binom)
+        else:
+            self.stateObs = self._sampleObsByHashing()
+
+    def _sampleObsRanks(self, total):
+        """Draw numStates distinct integers in [0, total) in random order"""
+        if total <= 4 * self.numStates:
+            return self.random.permutation(total)[:self.numStates]
+        ranks = scipy.zeros((0,), dtype=int)
+        while len(ranks) < self.numStates:
+            more = self.random.randint(0, total,
+                                       size=self.numStates - len(ranks))
+            ranks = scipy.unique(scipy.concatenate((ranks, more)))
+        return self.random.permutation(ranks)
+
+    def _sampleObsByHashing(self):
+        stateObs = scipy.zeros((self.numStates, self.feaDim), dtype=int)
+        missing = scipy.arange(self.numStates)
+        while len(missing) > 0:
+            keys = self.random.random_sample((len(missing), self.feaDim))
+            ones = scipy.argsort(keys, axis=1)[:, :self.feaSum]
+            stateObs[missing] = 0
+            stateObs[missing[:, None], ones] = 1
+            packed = scipy.ascontiguousarray(
+                scipy.packbits(stateObs.astype(scipy.uint8), axis=1))
+            hashes = packed.view(scipy.dtype((scipy.void, packed.shape[1])))
+            _, first = scipy.unique(hashes.reshape(-1), return_index=True)
+            duplicated = scipy.ones((self.numStates,), dtype=bool)
+            duplicated[first] = False
+            missing = scipy.flatnonzero(duplicated)
+        return stateObs
 
     def _genTransitionTable(self):
-        # generate state that will be transited to and corresponding
-        # probabilities.
-        self.transitionStates = scipy.zeros((self.numActions, self.numStates, self.branching))
-        self.transitionProb = scipy.zeros((self.numActions, self.numStates, self.branching))
-        allStates = scipy.arange(self.numStates)
-        for u in xrange(self.numActions):
-            for i in xrange(self.numStates):
-                self.transitionStates[u, i, :] = scipy.random.choice(allStates,
-                                                                     size=self.branching,
-                                                                     replace=False)
-                # probabilities
-                cutPoints = scipy.random.rand(self.branching-1)
-                cutPoints = sorted(cutPoints.tolist() + [0, 1])
-                self.transitionProb[u, i, :] = scipy.diff(cutPoints)
+        """Generate the states that will be transited to and the corresponding
+        probabilities of all (action, state) pairs at once"""
+        shape = (self.numActions, self.numStates, self.branching)
+        if self.branching > self.numStates:
+            raise ValueError('branching=%d is larger than numStates=%d' %
+                             (self.branching, self.numStates))
+        self.transitionStates = self._sampleDistinct(
+            self.numActions * self.numStates, self.numStates,
+            self.branching).reshape(shape)
+        # probabilities are the gaps between sorted uniform cut points.
+        cutPoints = scipy.sort(self.random.random_sample(
+            (self.numActions, self.numStates, self.branching-1)), axis=2)
+        cutPoints = scipy.concatenate(
+            (scipy.zeros(shape[:2] + (1,)), cutPoints,
+             scipy.ones(shape[:2] + (1,))), axis=2)
+        self.transitionProb = scipy.diff(cutPoints, axis=2)
+        self._buildSampler()
+
+    def _sampleDistinct(self, rows, n, k):
+        """Draw k distinct integers in [0, n) for each of the rows"""
+        if 2 * k > n:
+            keys = self.random.random_sample((rows, n))
+            return scipy.argsort(keys, axis=1)[:, :k]
+        samples = self.random.randint(0, n, size=(rows, k))
+        while True:
+            sortedSamples = scipy.sort(samples, axis=1)
+            duplicated = scipy.any(sortedSamples[:, 1:] ==
+                                   sortedSamples[:, :-1], axis=1)
+            if not duplicated.any():
+                return samples
+            samples[duplicated] = self.random.randint(
+                0, n, size=(duplicated.sum(), k))
+
+    def getTransitionMatrices(self):
+        """Transition matrices of all actions as a list of
+        scipy.sparse.csr_matrix.
+
+        transitionStates and transitionProb are a CSR layout with branching
+        elements in each row, so the matrices are built without rearranging
+        the tables."""
+        indptr = scipy.arange(0, self.numStates * self.branching + 1,
+                              self.branching)
+        shape = (self.numStates, self.numStates)
+        return [csr_matrix((self.transitionProb[u].reshape(-1),
+                            self.transitionStates[u].reshape(-1), indptr),
+                           shape=shape)
+                for u in xrange(self.numActions)]
+
+    def _buildSampler(self):
+        """Prepare the tables used by performAction"""
+        self.transitionStates = scipy.asarray(self.transitionStates, dtype=int)
+        # cumulative probability of each (action, state) pair, normalized so
+        # that the last element is exactly 1.
+        self.transitionCdf = scipy.cumsum(self.transitionProb, axis=2)
+        self.transitionCdf /= self.transitionCdf[:, :, -1:]
 
     def getSensors(self, state=None):
+        """feature of the state, a row of stateObs"""
         if state is None:
             state = self.curState
         return self.stateObs[state]
 
+    def getActionIndex(self, action):
+        """Convert action to the index used by the transition tables, which is
+        an int, or an int array of length numChains in batch mode"""
+        if self.numChains is None:
+            return int(action[0])
+        return scipy.asarray(action, dtype=int).reshape(self.numChains)
+
     def performAction(self, action):
-        action = action[0]
-        states = self.transitionStates[action, self.curState, :]
-        prob = self.transitionProb[action, self.curState, :]
-        nextState = scipy.random.choice(states, size=1, p=prob)
-        nextState = int(nextState[0])
+        action = self.getActionIndex(action)
+        cdf = self.transitionCdf[action, self.curState]
+        if self.numChains is None:
+            nextIndex = cdf.searchsorted(self.uniforms.next(), side='right')
+        else:
+            # same as searchsorted with side='right' for each chain.
+            uniforms = self.uniforms.take(self.numChains)
+            nextIndex = (cdf <= uniforms[:, None]).sum(axis=1)
+        nextState = self.transitionStates[action, self.curState, nextIndex]
+        # index of the transition, used to look up the expected reward.
+        self.lastBranch = nextIndex
         self.prevState = self.curState
         self.curState = nextState
 
     def reset(self):
-        self.curState = self.initState
+        # there is no transition before the first step, so the expected reward
+        # is the one of branch 0 from the initial state.
+        if self.numChains is None:
+            self.curState = self.prevState = self.initState
+            self.lastBranch = 0
+        else:
+            self.curState = scipy.zeros((self.numChains,), dtype=int)
+            self.curState[:] = self.initState
+            self.prevState = self.curState.copy()
+            self.lastBranch = scipy.zeros((self.numChains,), dtype=int)
+
+
+def _getBinomialTable(n, k):
+    """binom[m][r] = C(m, r) for 0 <= m <= n and 0 <= r <= k, as python
+    integers"""
+    binom = [[0] * (k + 1) for _ in xrange(n + 1)]
+    for m in xrange(n + 1):
+        binom[m][0] = 1
+        for r in xrange(1, min(m, k) + 1):
+            binom[m][r] = binom[m-1][r-1] + binom[m-1][r]
+    return binom
+
+def _unrankCombinations(ranks, n, k, binom):
+    """Convert ranks in the lexicographic order of the {0, 1} vectors of
+    length n whose sum is k to the vectors, a (len(ranks), n) int array.
+
+    Vectors whose first element is 1 come first, so the first element of the
+    vector with rank r is 1 iff r < C(n-1, k-1). The elements are decided
+    from the left for all ranks at once."""
+    # The entries used are not larger than C(n, k), so larger ones are
+    # clipped to fit in an int64.
+    table = scipy.array([[min(v, 2**62) for v in row] for row in binom],
+                        dtype=scipy.int64)
+    ranks = scipy.array(ranks, dtype=scipy.int64)
+    vectors = scipy.zeros((len(ranks), n), dtype=int)
+    remaining = scipy.zeros((len(ranks),), dtype=int)
+    remaining[:] = k
+    for i in xrange(n):
+        count = table[n-1-i, scipy.maximum(remaining - 1, 0)]
+        active = remaining > 0
+        one = active & (ranks < count)
+        vectors[one, i] = 1
+        ranks -= scipy.where(active & ~one, count, 0)
+        remaining -= one
+    return vectors
@@ -1,16 +1,22 @@
 from __future__ import print_function, division, absolute_import
+import itertools
+import os
 import scipy
+import shutil
 import tempfile
 import unittest
 from numpy.testing import assert_array_almost_equal
 
-from .garnet import GarnetEnvironment, GarnetTask
-from librl.util import zdump
+from .garnet import GarnetEnvironment, GarnetTask, GarnetLookForwardTask, \
+    GarnetLookForwardWithStateObsTask, _getBinomialTable, _unrankCombinations
+from librl.experiments.checkpoint import getState
+from librl.util import zdump, RandomBuffer
 
 class GarnetEnvironmentTestCase(unittest.TestCase):
     def setUp(self):
         scipy.random.seed(0)
         self.testDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.testDir)
 
         self.numStates = 3
         self.numActions = 2
@@ -42,7 +48,7 @@ class GarnetEnvironmentTestCase(unittest.TestCase):
             'transitionProb': self.transitionProb,
             'stateObs': self.stateObs,
         }
-        self.loadPath = self.testDir + 'transition_model.pkz'
+        self.loadPath = os.path.join(self.testDir, 'transition_model.pkz')
         zdump(message, self.loadPath)
 
         self.env = GarnetEnvironment(numStates=self.numStates,
@@ -54,11 +60,34 @@ class GarnetEnvironmentTestCase(unittest.TestCase):
 
     def testGenStateObs(self):
         self.env._genStateObs()
-        self.assertEqual(self.numStates, len(set(self.stateObs)))
+        self.assertEqual(self.numStates,
+                         len(set(tuple(obs) for obs in self.env.stateObs)))
         p = scipy.sum(scipy.array(self.env.stateObs), axis=1)
         expected = self.feaSum * scipy.ones((self.numStates,))
         assert_array_almost_equal(expected, p)
 
+        # all the 10 features are used.
+        self.env.numStates = 10
+        for maxObsRank in [2**62, 0]:
+            self.env.maxObsRank = maxObsRank
+            self.env._genStateObs()
+            self.assertEqual(10, len(set(tuple(obs)
+                                         for obs in self.env.stateObs)))
+            assert_array_almost_equal(2 * scipy.ones((10,)),
+                                      scipy.sum(self.env.stateObs, axis=1))
+
+        self.env.numStates = 11
+        self.assertRaises(ValueError, self.env._genStateObs)
+
+    def testUnrankCombinations(self):
+        binom = _getBinomialTable(5, 3)
+        self.assertEqual(10, binom[5][3])
+        vectors = _unrankCombinations(scipy.arange(10), 5, 3, binom)
+        expected = sorted(set(tuple(v) for v in
+                              itertools.permutations([1, 1, 1, 0, 0])),
+                          reverse=True)
+        assert_array_almost_equal(expected, vectors)
+
     def testGenTransitionTable(self):
         branching = 2
         self.env.branching = branching
@@ -73,6 +102,26 @@ class GarnetEnvironmentTestCase(unittest.TestCase):
         assert_array_almost_equal(scipy.ones((self.numActions,
                                               self.numStates)),
                                   scipy.sum(self.env.transitionProb, axis=2))
+        self.assertTrue((self.env.transitionProb >= 0).all())
+        for ts in self.env.transitionStates.reshape(-1, branching):
+            self.assertEqual(branching, len(set(ts)))
+
+        # sparse case
+        samples = self.env._sampleDistinct(1000, 100, 5)
+        self.assertEqual((1000, 5), samples.shape)
+        self.assertTrue(((samples >= 0) & (samples < 100)).all())
+        self.assertTrue(all(len(set(row)) == 5 for row in samples))
+
+    def testGetTransitionMatrices(self):
+        env = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                feaDim=5, feaSum=2, seed=1)
+        matrices = env.getTransitionMatrices()
+        self.assertEqual(2, len(matrices))
+        for u, P in enumerate(matrices):
+            dense = scipy.zeros((10, 10))
+            for i in xrange(10):
+                dense[i, env.transitionStates[u, i]] = env.transitionProb[u, i]
+            assert_array_almost_equal(dense, P.toarray())
 
     def testGetSensors(self):
         self.env.curState = 0
@@ -109,18 +158,178 @@ class GarnetEnvironmentTestCase(unittest.TestCase):
         self.env.performAction([1])
         self.assertEqual(1, self.env.curState)
 
+    def testPerformActionSeed(self):
+        env = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                feaDim=5, feaSum=2)
+        self.assertTrue(env.transitionStates.dtype.kind == 'i')
+
+        def run(seed):
+            env.uniforms = RandomBuffer(scipy.random.RandomState(seed))
+            env.reset()
+            states = []
+            for i in xrange(2 * env.uniformBlockSize):
+                env.performAction([i % 2])
+                states.append(env.curState)
+                self.assertTrue(env.curState in
+                                env.transitionStates[i % 2, env.prevState])
+            return states
+
+        self.assertEqual(run(1), run(1))
+        self.assertNotEqual(run(1), run(2))
+
+    def testPerformActionDistribution(self):
+        self.env.transitionStates = scipy.array([[[1, 2]]])
+        self.env.transitionProb = scipy.array([[[0.25, 0.75]]])
+        self.env._buildSampler()
+        count = 0
+        n = 10000
+        for i in xrange(n):
+            self.env.curState = 0
+            self.env.performAction([0])
+            count += (self.env.curState == 2)
+        self.assertAlmostEqual(0.75, count / n, places=1)
+
+    def testLookForwardObservation(self):
+        task = GarnetLookForwardTask(self.env, sigma=1)
+        self.env.curState = 0
+        obs = task.getObservation()
+        self.assertFalse(obs.flags.writeable)
+        # action 0 moves from 0 to 1 and action 1 moves from 0 to 2.
+        s = scipy.array(self.stateObs, dtype=float)
+        expected = scipy.concatenate((s[1] - s[0], s[2] - s[0]))
+        assert_array_almost_equal(expected, obs)
+
+        task = GarnetLookForwardWithStateObsTask(self.env, sigma=1)
+        expected = scipy.concatenate((expected, s[0]))
+        assert_array_almost_equal(expected, task.getObservation())
+
+    def testExpectedReward(self):
+        self.assertEqual((self.numActions, self.numStates, self.branching),
+                         self.env.expectedReward.shape)
+        path = os.path.join(self.testDir, 'testbed.pkz')
+        env = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                feaDim=5, feaSum=2, seed=1, savePath=path)
+        env2 = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                 feaDim=5, feaSum=2, loadPath=path)
+        assert_array_almost_equal(env.expectedReward, env2.expectedReward)
+        env3 = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                 feaDim=5, feaSum=2, seed=1)
+        assert_array_almost_equal(env.expectedReward, env3.expectedReward)
+        assert_array_almost_equal(env.transitionStates, env3.transitionStates)
+
+        task = GarnetTask(self.env, sigma=0)
+        self.env.curState = 0
+        task.performAction([1])
+        self.assertEqual(self.env.expectedReward[1, 0, 0], task.getReward())
+
+    def testRewardBeforeFirstStep(self):
+        env = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                feaDim=5, feaSum=2, seed=1)
+        task = GarnetTask(env, sigma=0)
+        task.getReward()
+        self.assertEqual(0, env.lastBranch)
+        self.assertEqual(env.curState, env.prevState)
+        self.assertTrue('lastBranch' in getState(env))
+
+    def testArrayTestbed(self):
+        path = os.path.join(self.testDir, 'garnet.testbed')
+        env = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                feaDim=5, feaSum=2, seed=1, savePath=path)
+        env2 = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                 feaDim=5, feaSum=2, loadPath=path)
+        for name in ['transitionStates', 'transitionProb', 'transitionCdf',
+                     'expectedReward']:
+            self.assertTrue(isinstance(getattr(env2, name), scipy.memmap))
+            assert_array_almost_equal(getattr(env, name), getattr(env2, name))
+        for s in xrange(10):
+            assert_array_almost_equal(env.getSensors(s), env2.getSensors(s))
+
+        env.uniforms = RandomBuffer(scipy.random.RandomState(3))
+        env2.uniforms = RandomBuffer(scipy.random.RandomState(3))
+        for i in xrange(50):
+            env.performAction([i % 2])
+            env2.performAction([i % 2])
+            self.assertEqual(env.curState, env2.curState)
+
+        self.assertRaises(ValueError, GarnetEnvironment, numStates=11,
+                          numActions=2, branching=3, feaDim=5, feaSum=2,
+                          loadPath=path)
+
+    def testBatchPerformAction(self):
+        env = GarnetEnvironment(numStates=self.numStates,
+                                numActions=self.numActions,
+                                branching=self.branching,
+                                feaDim=self.feaDim,
+                                feaSum=self.feaSum,
+                                loadPath=self.loadPath,
+                                numChains=3)
+        assert_array_almost_equal([0, 0, 0], env.curState)
+        env.curState = scipy.array([0, 1, 2])
+        env.performAction(scipy.array([[0], [1], [0]]))
+        assert_array_almost_equal([0, 1, 2], env.prevState)
+        assert_array_almost_equal([1, 1, 2], env.curState)
+
+    def testBatchMatchesSingle(self):
+        path = os.path.join(self.testDir, 'testbed.pkz')
+        env = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                feaDim=5, feaSum=2, seed=1, savePath=path)
+        batchEnv = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                     feaDim=5, feaSum=2, seed=1,
+                                     loadPath=path, numChains=1)
+        env.uniforms = RandomBuffer(scipy.random.RandomState(3))
+        batchEnv.uniforms = RandomBuffer(scipy.random.RandomState(3))
+        task = GarnetTask(env, sigma=1, seed=2)
+        batchTask = GarnetTask(batchEnv, sigma=1, seed=2)
+        for i in xrange(100):
+            task.performAction([i % 2])
+            batchTask.performAction(scipy.array([i % 2]))
+            self.assertEqual(env.curState, batchEnv.curState[0])
+            self.assertAlmostEqual(task.getReward(), batchTask.getReward()[0])
+            assert_array_almost_equal(task.getObservation(),
+                                      batchTask.getObservation()[0])
+
+    def testBatchTask(self):
+        env = GarnetEnvironment(numStates=10, numActions=2, branching=3,
+                                feaDim=5, feaSum=2, numChains=4)
+        task = GarnetLookForwardTask(env, sigma=0)
+        actions = scipy.array([0, 1, 1, 0])
+        for i in xrange(10):
+            task.performAction(actions)
+            self.assertEqual((4, task.outdim), task.getObservation().shape)
+            assert_array_almost_equal(task.obsTable[env.curState],
+                                      task.getObservation())
+            expected = env.expectedReward[actions, env.prevState,
+                                          env.lastBranch]
+            assert_array_almost_equal(expected, task.getReward())
+            assert_array_almost_equal(
+                env.transitionStates[actions, env.prevState, env.lastBranch],
+                env.curState)
+
+    def testObservationTablePath(self):
+        path = os.path.join(self.testDir, 'obs_table.pkz')
+        task = GarnetLookForwardTask(self.env, sigma=1, obsTablePath=path)
+        task2 = GarnetLookForwardTask(self.env, sigma=1, obsTablePath=path)
+        assert_array_almost_equal(task.obsTable, task2.obsTable)
+
 
 class MockGarnetEnvironment(object):
     def __init__(self, numStates, numActions, curState, prevState,
-                 lastAction, sensors):
+                 lastAction, sensors, expectedReward=None, lastBranch=0):
         self.numStates = numStates
         self.numActions = numActions
         self.curState = curState
         self.prevState = prevState
         self.lastAction = lastAction
         self.sensors = sensors
+        self.outdim = len(sensors)
+        self.expectedReward = expectedReward
+        self.lastBranch = lastBranch
+        self.numChains = None
+
+    def getActionIndex(self, action):
+        return int(action[0])
 
-    def getSensors(self):
+    def getSensors(self, state=None):
         return self.sensors
 
     def performAction(self, action):
@@ -128,12 +337,18 @@ class MockGarnetEnvironment(object):
 
 class GarnetTaskTestCase(unittest.TestCase):
     def setUp(self):
+        # expectedReward[u, i, j] = 100 * u + 10 * i + j
+        expectedReward = (100 * scipy.arange(2)[:, None, None] +
+                          10 * scipy.arange(3)[None, :, None] +
+                          scipy.arange(2)[None, None, :])
         self.env = MockGarnetEnvironment(3, 2, 0, 1,
                                          scipy.array([0]),
                                          scipy.array([1, 1, 0,
                                                       0, 0],
-                                                     dtype=float))
-        self.task = GarnetTask(self.env, sigma=1)
+                                                     dtype=float),
+                                         expectedReward=expectedReward,
+                                         lastBranch=1)
+        self.task = GarnetTask(self.env, sigma=1, seed=0)
 
     def testGetObservation(self):
         expectedFeature = [[1, 1, 0, 0, 0, 0, 0, 0, 0, 0],
@@ -142,12 +357,11 @@ class GarnetTaskTestCase(unittest.TestCase):
         assert_array_almost_equal(expected, self.task.getObservation())
 
     def testGetReward(self):
-        scipy.random.seed(0)
-        # with seed 0, the first run of randn will return 1.764052345967664,
-        # which is the expected reward. The second run of randn will return
-        # 0.4001572083672233. So the reward is:
-        # reward = 1 * 0.4001572083672233 + 1.764052345967664
-        self.assertAlmostEqual(2.1642095543348874, self.task.getReward())
+        # with seed 0, the noise is 1.764052345967664 and 0.4001572083672233.
+        # The last transition is the branch 1 from state 1 under action 0,
+        # whose expected reward is 11.
+        self.assertAlmostEqual(12.764052345967664, self.task.getReward())
+        self.assertAlmostEqual(11.4001572083672233, self.task.getReward())
 
 if __name__ == '__main__':
     unittest.main()
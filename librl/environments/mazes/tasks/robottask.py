@@ -1,7 +1,9 @@
 import collections
 import scipy
+import scipy.sparse
 
 from pybrain.rl.environments.mazes import MDPMazeTask
+from librl.util import zcache
 
 
 class RobotMotionAvgRewardTask(MDPMazeTask):
@@ -16,11 +18,27 @@ class RobotMotionAvgRewardTask(MDPMazeTask):
     DEFAULT_REWARD = 0
 
     TOLERANCE = 1e-7
+    # methods timed by librl.profiler.PhaseProfiler.
+    profiledPhases = {'getObservation': 'observation',
+                      'performAction': 'environment',
+                      'getReward': 'reward'}
 
-    def __init__(self, environment, senseRange):
+    def __init__(self, environment, senseRange, obsTablePath=None):
         MDPMazeTask.__init__(self, environment)
         self.senseRange = senseRange
         self.cacheTranProbToNextStates = {}
+        self.cacheOneStepKernels = None
+        self.cacheFeatureTable = None
+
+        # Features of all states are calculated at construction. If
+        # obsTablePath is provided, the table is loaded from or saved to this
+        # file.
+        self.cacheFeatureTable = zcache(obsTablePath, self.getFeatureTable)
+        expectedShape = tuple(self.env.mazeSize) + (self.env.numActions,
+                                                    self.env.outdim)
+        assert self.cacheFeatureTable.shape == expectedShape, \
+            'invalid observation table'
+        self.cacheFeatureTable.setflags(write=False)
 
     def reset(self):
         self.env.reset()
@@ -34,8 +52,10 @@ class RobotMotionAvgRewardTask(MDPMazeTask):
         1. featureList for the state and for each possible action in the future.
            now featureList is [safety, progress]
         if there are four possible controls. then agen will receive 8x1 array.
+        The result is a read-only view.
         """
-        return self.getFeature(self.env.perseus).reshape(-1)
+        state = self.env.perseus
+        return self.cacheFeatureTable[state[0], state[1]].reshape(-1)
 
     def performAction(self, action):
         super(RobotMotionAvgRewardTask, self).performAction(action)
@@ -55,26 +75,90 @@ class RobotMotionAvgRewardTask(MDPMazeTask):
     def getFeature(self, state):
         """We can get features for each state. it may be
         distance to goal, safety degree. e.t.c"""
-        # cache the feature result, boost the speed.
-        numActions = self.env.numActions
-        # now we only support two features
-        curSensors = self.env.getSensors(state)
-
-        feature = scipy.zeros((numActions, self.env.outdim))
-        for i in xrange(numActions):
-            # create a action probability arry for only moving to one
-            # direction.
-            tmp = [0] * numActions
-            tmp[i] = 1
-            actionProb = tuple(tmp)
-
-            tranProb = self.getMultiStepTranProb(state, self.senseRange,
-                                                 actionProb)
-            for s, p in tranProb.iteritems():
-                feature[i, :] += (self.env.getSensors(s) * p)
-            feature[i, :] -= curSensors
-
-        return feature
+        # the features of all states are calculated at once and cached.
+        return self.getFeatureTable()[state[0], state[1]].copy()
+
+    def getFeatureTable(self):
+        """Get features of all states. The result is a (rows, cols,
+        numActions, outdim) array, its [i, j] element is the feature of state
+        (i, j).
+
+        For control i, the feature is the expected sensor value after
+        senseRange steps of always applying control i, minus the current
+        sensor value, i.e., P_i^senseRange * F - F where P_i is the one-step
+        transition matrix of control i and F contains sensors of all states.
+        """
+        if self.cacheFeatureTable is not None:
+            return self.cacheFeatureTable
+
+        mazeSize = self.env.mazeSize
+        numStates = mazeSize[0] * mazeSize[1]
+        sensors = self.env.getSensorTable().reshape(numStates, -1)
+        feature = scipy.zeros((numStates, self.env.numActions,
+                               sensors.shape[1]))
+        for i, kernel in enumerate(self.getOneStepKernels()):
+            expected = sensors
+            for _ in xrange(self.senseRange):
+                expected = kernel.dot(expected)
+            feature[:, i, :] = expected - sensors
+
+        self.cacheFeatureTable = feature.reshape(mazeSize[0], mazeSize[1],
+                                                 self.env.numActions, -1)
+        return self.cacheFeatureTable
+
+    def getOneStepKernels(self):
+        """Get the one-step transition matrix of each control.
+
+        States are indexed in row-major order. When the control is applied,
+        the robot moves in each direction according to env.tranProb.
+        Directions that leave the maze are excluded and the probabilities of
+        the remaining directions are normalized to sum to 1.
+
+        Return:
+            a list of numStates x numStates sparse matrices, one for each
+            control.
+        """
+        if self.cacheOneStepKernels is not None:
+            return self.cacheOneStepKernels
+
+        nrow, ncol = self.env.mazeSize
+        numStates = nrow * ncol
+        rows, cols = scipy.indices((nrow, ncol))
+        rows = rows.reshape(-1)
+        cols = cols.reshape(-1)
+        tranProb = scipy.array(self.env.tranProb, dtype=float)
+
+        # the next state of each state for each actual direction.
+        srcStates = []
+        dstStates = []
+        directions = []
+        for aIndex, actual in enumerate(self.env.allActions):
+            nextRows = rows + actual[0]
+            nextCols = cols + actual[1]
+            valid = ((nextRows >= 0) & (nextRows < nrow) &
+                     (nextCols >= 0) & (nextCols < ncol))
+            srcStates.append(scipy.nonzero(valid)[0])
+            dstStates.append(nextRows[valid] * ncol + nextCols[valid])
+            directions.append(scipy.repeat(aIndex, valid.sum()))
+        srcStates = scipy.concatenate(srcStates)
+        dstStates = scipy.concatenate(dstStates)
+        directions = scipy.concatenate(directions)
+
+        kernels = []
+        for cIndex in xrange(len(self.env.allActions)):
+            prob = tranProb[cIndex, directions]
+            # sum probablies of valid next states. If the control cannot
+            # leave a state (e.g., S in the bottom-right corner with
+            # probability only for S and W), the row of this state is zero.
+            sumProb = scipy.bincount(srcStates, weights=prob,
+                                     minlength=numStates)
+            sumProb[sumProb == 0] = 1
+            kernels.append(scipy.sparse.csr_matrix(
+                (prob / sumProb[srcStates], (srcStates, dstStates)),
+                shape=(numStates, numStates)))
+
+        self.cacheOneStepKernels = kernels
+        return kernels
 
     def getMultiStepTranProb(self, state, step, actionProb):
         """Get tranistion probability to allowable next step,
@@ -102,33 +186,27 @@ class RobotMotionAvgRewardTask(MDPMazeTask):
             result[state] = 1
             return result
 
-        for cIndex, control in enumerate(self.env.allActions):
-            if abs(actionProb[cIndex] < self.TOLERANCE):
+        # transition matrix when the control is selected according to
+        # actionProb in every step.
+        kernel = None
+        for p, controlKernel in zip(actionProb, self.getOneStepKernels()):
+            if p < self.TOLERANCE:
                 continue
+            kernel = p * controlKernel if kernel is None else \
+                kernel + p * controlKernel
+
+        ncol = self.env.mazeSize[1]
+        dist = scipy.zeros((kernel.shape[0],))
+        dist[state[0] * ncol + state[1]] = 1
+        kernelT = kernel.T.tocsr()
+        for _ in xrange(step):
+            dist = kernelT.dot(dist)
+
+        errMsg = "transition probability doesn't sum to 1."
+        assert abs(scipy.sum(dist) - 1.0) <= 1e-3, errMsg
 
-            sumProb= 0.0
-            validActions = []
-            for aIndex, actual in enumerate(self.env.allActions):
-                nextState = (state[0] + actual[0], state[1] + actual[1])
-                tranProbToNextPos = self.env.tranProb[cIndex][aIndex]
-                # sum probablies of valid next states
-                if not self.env.isOutBound(nextState):
-                    sumProb += tranProbToNextPos
-                    validActions.append((aIndex, actual, nextState, tranProbToNextPos))
-
-            for aIndex, actual, nextState, tranProbToNextPos in validActions:
-                recursiveStates = self.getMultiStepTranProb(nextState,
-                                                            step - 1,
-                                                            actionProb)
-                sumRecursiveProb = 0
-                for s, p in recursiveStates.iteritems():
-                    sumRecursiveProb += p
-                    # calculate the scale factor so that the final tranistion
-                    # probability sums to 1 for each action.
-                    result[s] += p * (tranProbToNextPos / sumProb) * actionProb[cIndex]
-
-                errMsg = "transition probability doesn't sum to 1."
-                assert abs(sumRecursiveProb - 1.0) <= 1e-3, errMsg
+        for s in scipy.nonzero(dist)[0]:
+            result[divmod(int(s), ncol)] = dist[s]
 
         self.cacheTranProbToNextStates[searchKey] = result
         return result
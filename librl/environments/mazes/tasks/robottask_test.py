@@ -1,3 +1,6 @@
+import os.path
+import shutil
+import tempfile
 import unittest
 import scipy
 from .robottask import RobotMotionAvgRewardTask
@@ -28,6 +31,60 @@ class RobotMotionTaskTestCase(unittest.TestCase):
         expected = [0, 0, 0, -0.777777778, 0, 0.8, 0, 0]
         assert_array_almost_equal(expected, self.task.getObservation())
 
+    def testGetMultiStepTranProb(self):
+        # control N from (0, 0). The first step goes to (0, 1) or (1, 0) with
+        # probability 1/2.
+        result = self.task.getMultiStepTranProb((0, 0), 2, (1, 0, 0, 0))
+        expected = {(0, 2): 1.0 / 6,
+                    (1, 1): 2.0 / 9,
+                    (0, 0): 5.0 / 9,
+                    (2, 0): 1.0 / 18}
+        self.assertEqual(set(expected.keys()), set(result.keys()))
+        for k, v in expected.iteritems():
+            self.assertAlmostEqual(v, result[k])
+
+    def testGetFeatureMultiStep(self):
+        task = RobotMotionAvgRewardTask(self.maze, senseRange=2)
+        feature = task.getFeature((0, 0))
+        assert_array_almost_equal([-2.0 / 9, 1.0 / 9], feature[0])
+
+        # the same as calculating the features from the transition
+        # probabilities of each state.
+        tranProb = [
+            [0.7, 0.1, 0.1, 0.1], # N
+            [0.1, 0.7, 0.1, 0.1], # E
+            [0.1, 0.1, 0.7, 0.1], # S
+            [0.1, 0.1, 0.1, 0.7], # W
+        ]
+        maze = TrapMaze(self.topology, (0, 0), tranProb)
+        task = RobotMotionAvgRewardTask(maze, senseRange=3)
+        for state in [(0, 0), (1, 2), (2, 1)]:
+            feature = task.getFeature(state)
+            for i in xrange(4):
+                actionProb = [0] * 4
+                actionProb[i] = 1
+                dist = task.getMultiStepTranProb(state, 3, actionProb)
+                expected = -1 * maze.getSensors(state)
+                for s, p in dist.iteritems():
+                    expected += maze.getSensors(s) * p
+                assert_array_almost_equal(expected, feature[i])
+
+    def testObservationTable(self):
+        obs = self.task.getObservation()
+        self.assertFalse(obs.flags.writeable)
+
+        # the table is saved and loaded.
+        dirName = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirName)
+        path = os.path.join(dirName, 'obs_table.pkz')
+        task = RobotMotionAvgRewardTask(self.maze, senseRange=2,
+                                        obsTablePath=path)
+        self.assertTrue(os.path.isfile(path))
+        task2 = RobotMotionAvgRewardTask(self.maze, senseRange=2,
+                                         obsTablePath=path)
+        assert_array_almost_equal(task.cacheFeatureTable,
+                                  task2.cacheFeatureTable)
+
     def testGetReward(self):
         self.assertEqual(self.task.DEFAULT_REWARD, self.task.getReward())
 
@@ -105,6 +105,20 @@ class TrapMaze(Maze):
     def outdim(self):
         return 2
 
+    def getSensorTable(self):
+        """Get sensors of all positions at once. The result is a (rows, cols,
+        outdim) array whose [i, j] element equals getSensors((i, j))."""
+        rows, cols = scipy.indices(self.mazeSize)
+        safetyScore = 1.0 - (self.mazeTable == self.TRAP_FLAG)
+        if self.goalStates:
+            goals = scipy.array(self.goalStates)
+            distance = (abs(rows[..., None] - goals[:, 0]) +
+                        abs(cols[..., None] - goals[:, 1])).min(axis=-1)
+        else:
+            distance = scipy.empty(self.mazeSize)
+            distance.fill(float('inf'))
+        return scipy.dstack((safetyScore, -1.0 * distance))
+
     def getMinDistanceToGoal(self, state):
         """Get the minimium distance to any of goal stats."""
         searchKey = tuple(state)
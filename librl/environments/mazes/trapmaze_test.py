@@ -66,6 +66,17 @@ class TrapMazeTestCase(unittest.TestCase):
         self.assertFalse(self.maze.bang)
         assert_array_almost_equal((0, 1), self.maze.perseus)
 
+    def testGetSensorTable(self):
+        maze = TrapMaze([[0, 0, 2],
+                         [0, -1, 0],
+                         [2, 0, 0]], (0, 1), self.tranProb)
+        table = maze.getSensorTable()
+        self.assertEqual((3, 3, 2), table.shape)
+        for i in xrange(3):
+            for j in xrange(3):
+                assert_array_almost_equal(maze.getSensors((i, j)),
+                                          table[i, j])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1 +1,3 @@
 from experiment import *
+from sweep import *
+from checkpoint import *
@@ -0,0 +1,258 @@
+"""Checkpoints of SessionExperiment runs.
+
+A snapshot holds the state of the experiment, agent, learner, policy, task
+and environment, together with the state of the global random number
+generators. The state of an object is taken from its instance attributes by
+getState:
+
+  - None, numbers, strings and arrays are copied, as are lists, tuples and
+    dicts of them,
+  - RandomState objects are stored by their get_state(),
+  - objects whose class defines stateAttributes (a tuple of attribute names)
+    are stored recursively with these attributes only, e.g., the environment
+    only stores its current state and random number generators, not the
+    transition tables,
+  - everything else, e.g., references to other modules, is skipped.
+
+An object that is reachable in several ways, e.g., the history that is shared
+by the agent and the learner, is stored once. The snapshot is restored by
+setState into objects that are built in the same way as the ones it was taken
+from. Arrays are copied into the existing arrays, so views of them, e.g., the
+parameters of the policy, stay valid. A ValueError is raised if the shape or
+dtype of an array differs, except for the first dimension of the attributes
+listed in resizableAttributes, e.g., the buffers of a growing history.
+"""
+from __future__ import print_function, division, absolute_import
+import functools
+import os
+import random
+import threading
+import scipy
+from numpy.random import RandomState
+from librl.util import zdump, zload
+
+checkpointVersion = 2
+
+class _ObjectState(dict):
+    """State of an object with stateAttributes"""
+    pass
+
+_SKIP = object()
+
+def _snapshotValue(value, memo):
+    if value is None or isinstance(value, (bool, int, long, float, basestring,
+                                           scipy.generic)):
+        return value
+    if isinstance(value, scipy.ndarray):
+        return scipy.array(value)
+    if isinstance(value, RandomState) or hasattr(type(value),
+                                                 'stateAttributes'):
+        if id(value) in memo:
+            return _SKIP
+        memo.add(id(value))
+        if isinstance(value, RandomState):
+            return value.get_state()
+        return _ObjectState(getState(value, memo))
+    if isinstance(value, (list, tuple)):
+        items = [_snapshotValue(v, memo) for v in value]
+        if any(v is _SKIP for v in items):
+            return _SKIP
+        return type(value)(items)
+    if isinstance(value, dict):
+        items = [(k, _snapshotValue(v, memo)) for k, v in value.iteritems()]
+        if any(v is _SKIP for _, v in items):
+            return _SKIP
+        return dict(items)
+    return _SKIP
+
+def getState(obj, memo=None):
+    """Return the state of obj as a dict from attribute name to value. *memo*
+    is the set of ids of the objects that have been stored already."""
+    if memo is None:
+        memo = set()
+    names = getattr(obj, 'stateAttributes', None)
+    if names is None:
+        names = sorted(vars(obj))
+    state = dict()
+    for name in names:
+        if not hasattr(obj, name):
+            continue
+        value = _snapshotValue(getattr(obj, name), memo)
+        if value is not _SKIP:
+            state[name] = value
+    return state
+
+def _planState(obj, state, updates, path):
+    """Check state against obj and append the updates that restore it to
+    *updates*, so that nothing is changed if the check fails."""
+    resizable = getattr(obj, 'resizableAttributes', ())
+    for name, value in state.iteritems():
+        current = getattr(obj, name, None)
+        where = '%s.%s' % (path, name)
+        if isinstance(current, RandomState):
+            updates.append(functools.partial(current.set_state, value))
+        elif isinstance(value, _ObjectState):
+            if current is None:
+                raise ValueError('%s is missing' % where)
+            _planState(current, value, updates, where)
+        elif (isinstance(value, scipy.ndarray) and
+              isinstance(current, scipy.ndarray)):
+            if current.dtype != value.dtype or (
+                    current.shape[1:] != value.shape[1:] if name in resizable
+                    else current.shape != value.shape):
+                raise ValueError('%s is a %s array of shape %s, but the '
+                                 'snapshot has a %s array of shape %s' %
+                                 (where, current.dtype, current.shape,
+                                  value.dtype, value.shape))
+            if current.shape == value.shape and current.flags.writeable:
+                updates.append(functools.partial(current.__setitem__,
+                                                 Ellipsis, value))
+            else:
+                updates.append(functools.partial(setattr, obj, name,
+                                                 value.copy()))
+        elif isinstance(value, scipy.ndarray):
+            updates.append(functools.partial(setattr, obj, name, value.copy()))
+        else:
+            updates.append(functools.partial(setattr, obj, name, value))
+
+def setState(obj, state):
+    """Restore the state returned by getState. Raise ValueError if it doesn't
+    fit obj, in which case obj is not changed."""
+    updates = []
+    _planState(obj, state, updates, type(obj).__name__)
+    for update in updates:
+        update()
+
+
+class Checkpointer(object):
+    """Save a snapshot of a SessionExperiment every *interval* sessions to
+    *filename* and restore it.
+
+    The snapshot is taken in the learning thread, which only copies the state,
+    and written to disk by a background thread, so learning continues while
+    the file is written. A snapshot is written to a temporary file first and
+    then renamed, so *filename* always holds a complete snapshot.
+
+    Usage:
+        checkpointer = Checkpointer('run.ckpt', interval=100)
+        experiment.doSessionsAndPrint(sessionNumber, sessionSize,
+                                      checkpointer=checkpointer)
+    Running the same script again resumes the run from the last snapshot.
+
+    The snapshot records the classes of the components and the dimensions of
+    the parameters, and restoring it into a different setup raises a
+    ValueError. Only the learning state is restored: records printed to the
+    standard output before the resumed session are not printed again, e.g.,
+    the shard file of a multirun run that is run again only has the records
+    after the snapshot. A trace file has to be opened with
+    TraceWriter(..., append=True), see SessionExperiment.doSessionsAndPrint.
+    """
+    def __init__(self, filename, interval=100):
+        self.filename = filename
+        self.interval = interval
+        self._writer = None
+        self._error = None
+
+    @staticmethod
+    def _getComponents(experiment):
+        # the agent comes before the learner, so the history is stored with
+        # the agent.
+        agent = experiment.agent
+        return [('experiment', experiment),
+                ('agent', agent),
+                ('learner', getattr(agent, 'learner', None)),
+                ('policy', experiment.policy),
+                ('task', experiment.task),
+                ('environment', experiment.task.env)]
+
+    @classmethod
+    def _getSetup(cls, experiment):
+        """The classes of the components and the dimensions of the
+        parameters"""
+        classes = dict((name, type(component).__name__)
+                       for name, component in cls._getComponents(experiment)
+                       if component is not None)
+        learner = getattr(experiment.agent, 'learner', None)
+        dimensions = dict(theta=len(experiment.policy.theta),
+                          observation=experiment.task.outdim,
+                          critic=getattr(learner, 'criticdim', None))
+        return classes, dimensions
+
+    def getSnapshot(self, experiment, sessions):
+        """The state of the experiment after *sessions* sessions"""
+        memo = set()
+        classes, dimensions = self._getSetup(experiment)
+        snapshot = dict(version=checkpointVersion, sessions=sessions,
+                        classes=classes, dimensions=dimensions,
+                        numpyRandom=scipy.random.get_state(),
+                        pythonRandom=random.getstate())
+        for name, component in self._getComponents(experiment):
+            if component is not None:
+                snapshot[name] = getState(component, memo)
+        return snapshot
+
+    def setSnapshot(self, experiment, snapshot):
+        """Restore the snapshot. Return the number of finished sessions.
+        Raise ValueError if the snapshot was taken from a different setup, in
+        which case the experiment is not changed."""
+        if snapshot['version'] != checkpointVersion:
+            raise ValueError('unsupported checkpoint version %s' %
+                             snapshot['version'])
+        for key, expected in zip(['classes', 'dimensions'],
+                                 self._getSetup(experiment)):
+            if snapshot[key] != expected:
+                raise ValueError('the snapshot was taken with %s %s, but the '
+                                 'experiment has %s' %
+                                 (key, snapshot[key], expected))
+        updates = []
+        for name, component in self._getComponents(experiment):
+            if component is not None and name in snapshot:
+                _planState(component, snapshot[name], updates, name)
+        for update in updates:
+            update()
+        scipy.random.set_state(snapshot['numpyRandom'])
+        random.setstate(snapshot['pythonRandom'])
+        return snapshot['sessions']
+
+    def _write(self, snapshot):
+        try:
+            tmpFilename = self.filename + '.tmp'
+            zdump(snapshot, tmpFilename)
+            os.rename(tmpFilename, self.filename)
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        """Wait until the pending snapshot is written. Raise the error of the
+        writer if it failed."""
+        if self._writer is not None:
+            self._writer.join()
+            self._writer = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def save(self, experiment, sessions):
+        """Take a snapshot and write it in the background"""
+        snapshot = self.getSnapshot(experiment, sessions)
+        self.wait()
+        self._writer = threading.Thread(target=self._write, args=(snapshot,))
+        self._writer.daemon = True
+        self._writer.start()
+
+    def isDue(self, sessions):
+        """Whether a snapshot is saved after *sessions* sessions"""
+        return sessions % self.interval == 0
+
+    def update(self, experiment, sessions):
+        """Called after each session. Save a snapshot every interval
+        sessions."""
+        if self.isDue(sessions):
+            self.save(experiment, sessions)
+
+    def restore(self, experiment):
+        """Restore the last snapshot if there is one. Return the number of
+        finished sessions, which is 0 if there is no snapshot."""
+        if not os.path.isfile(self.filename):
+            return 0
+        return self.setSnapshot(experiment, zload(self.filename))
@@ -0,0 +1,154 @@
+from __future__ import print_function, division, absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import scipy
+from numpy.testing import assert_array_equal
+
+from .checkpoint import Checkpointer, getState, setState
+from librl.learners import TDLearner, LSTDLearner, HessianLSTDLearner
+from librl.testutil import createGarnetExperiment
+from librl.trace import TraceWriter, TraceReader
+from librl.util import RandomBuffer
+
+class MockState(object):
+    stateAttributes = ('random', 'buffer', 'value')
+    def __init__(self, random):
+        self.random = random
+        self.buffer = RandomBuffer(random, blockSize=4)
+        self.value = scipy.zeros((3,))
+
+class MockOwner(object):
+    def __init__(self):
+        random = scipy.random.RandomState(0)
+        self.first = MockState(random)
+        self.second = MockState(random)
+        self.k = 1
+        self.name = 'owner'
+        self.bound = [(0, 1), (2, 3)]
+        self.reference = object()
+
+class StateTestCase(unittest.TestCase):
+    def testGetState(self):
+        owner = MockOwner()
+        state = getState(owner)
+        self.assertEqual(['bound', 'first', 'k', 'name', 'second'],
+                         sorted(state))
+        # the random state shared by first and second is stored once.
+        self.assertTrue('random' in state['first'])
+        self.assertEqual(['buffer', 'value'], sorted(state['second']))
+
+    def testSetState(self):
+        owner = MockOwner()
+        value = owner.first.value
+        state = getState(owner)
+        numbers = [owner.first.buffer.next() for _ in xrange(6)]
+        value[:] = 1
+        owner.k = 2
+
+        setState(owner, state)
+        self.assertEqual(1, owner.k)
+        # arrays are restored in place.
+        self.assertTrue(owner.first.value is value)
+        assert_array_equal(scipy.zeros((3,)), value)
+        self.assertEqual(numbers,
+                         [owner.first.buffer.next() for _ in xrange(6)])
+
+    def testSetStateMismatch(self):
+        state = getState(MockOwner())
+        owner = MockOwner()
+        owner.k = 2
+        owner.second.value = scipy.zeros((4,))
+        self.assertRaises(ValueError, setState, owner, state)
+        owner.second.value = scipy.zeros((3,), dtype=int)
+        self.assertRaises(ValueError, setState, owner, state)
+        # nothing is restored if the state doesn't fit.
+        self.assertEqual(2, owner.k)
+
+
+class CheckpointerTestCase(unittest.TestCase):
+    def setUp(self):
+        dirName = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirName)
+        self.filename = os.path.join(dirName, 'run.ckpt')
+
+    def createExperiment(self, learnerClass, batch, feaDim=5):
+        if learnerClass is not HessianLSTDLearner:
+            return createGarnetExperiment(learnerClass, batch, feaDim=feaDim)
+        experiment = createGarnetExperiment(learnerClass, batch,
+                                            feaDim=feaDim,
+                                            hessianlearningrate=1)
+        experiment.agent.learner.minHessianSampleNumber = 5
+        return experiment
+
+    def runSessions(self, learnerClass, batch, sessions, checkpointer=None,
+                    trace=None):
+        scipy.random.seed(3)
+        experiment = self.createExperiment(learnerClass, batch)
+        experiment.doSessionsAndPrint(
+            sessions, 20, customPrinter=None if trace else lambda: None,
+            trace=trace, checkpointer=checkpointer)
+        return experiment
+
+    def checkResume(self, learnerClass, batch):
+        expected = self.runSessions(learnerClass, batch, 6)
+
+        checkpointer = Checkpointer(self.filename, interval=2)
+        self.runSessions(learnerClass, batch, 5, checkpointer)
+        # resume from the snapshot after 4 sessions.
+        self.assertEqual(4, checkpointer.restore(
+            self.createExperiment(learnerClass, batch)))
+        resumed = self.runSessions(learnerClass, batch, 6, checkpointer)
+
+        self.assertEqual(expected.stepid, resumed.stepid)
+        assert_array_equal(expected.policy.theta, resumed.policy.theta)
+        assert_array_equal(expected.agent.learner.r, resumed.agent.learner.r)
+        self.assertEqual(expected.task.env.curState,
+                         resumed.task.env.curState)
+
+    def testResumeTD(self):
+        self.checkResume(TDLearner, True)
+
+    def testResumeTDIncremental(self):
+        self.checkResume(TDLearner, False)
+
+    def testResumeHessianLSTD(self):
+        self.checkResume(HessianLSTDLearner, True)
+
+    def testResumeTrace(self):
+        traceFilename = self.filename + '.trace'
+        with TraceWriter(traceFilename, chunkSize=3) as trace:
+            self.runSessions(TDLearner, True, 6, trace=trace)
+        expected = TraceReader(traceFilename)['reward']
+
+        checkpointer = Checkpointer(self.filename, interval=2)
+        with TraceWriter(traceFilename, chunkSize=3, append=True) as trace:
+            self.runSessions(TDLearner, True, 5, checkpointer, trace)
+        # the record of session 5 is dropped on resume.
+        with TraceWriter(traceFilename, chunkSize=3, append=True) as trace:
+            self.runSessions(TDLearner, True, 6, checkpointer, trace)
+        reader = TraceReader(traceFilename)
+        assert_array_equal(scipy.arange(6), reader['iteration'])
+        assert_array_equal(expected, reader['reward'])
+
+        with TraceWriter(traceFilename) as trace:
+            self.assertRaises(ValueError, self.runSessions, TDLearner, True,
+                              6, checkpointer, trace)
+
+    def testDifferentSetup(self):
+        checkpointer = Checkpointer(self.filename, interval=2)
+        self.runSessions(TDLearner, True, 2, checkpointer)
+        for experiment in [self.createExperiment(TDLearner, True, feaDim=6),
+                           self.createExperiment(LSTDLearner, True)]:
+            theta = experiment.policy.theta.copy()
+            self.assertRaises(ValueError, checkpointer.restore, experiment)
+            assert_array_equal(theta, experiment.policy.theta)
+
+    def testNoSnapshot(self):
+        checkpointer = Checkpointer(self.filename)
+        experiment = self.createExperiment(TDLearner, True)
+        self.assertEqual(0, checkpointer.restore(experiment))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,6 +3,19 @@ from pybrain.rl.experiments import Experiment
 from librl.util import cPrint
 
 class SessionExperiment(Experiment):
+    """Experiment that runs sessions of interactions and learns after each
+    session in batch mode.
+
+    If fastRollout is True and the agent supports it (see canRolloutFast),
+    the interactions are run by _fastInteractions, which calls the policy and
+    the task directly and records the samples in the history of the agent.
+    Otherwise, each interaction goes through the agent API in
+    Experiment._oneInteraction.
+    """
+    fastRollout = True
+    # methods timed by librl.profiler.PhaseProfiler.
+    profiledPhases = {'doSession': 'session', '_doInteractions': 'rollout'}
+
     def __init__(self, task, agent, policy, batch=False):
         self.policy = policy
         self.batch = batch
@@ -10,32 +23,118 @@ class SessionExperiment(Experiment):
                                       'should be consistent')
         super(SessionExperiment, self).__init__(task, agent)
 
-    def doInteractionsAndLearn(self, number = 1000):
+    def canRolloutFast(self):
+        """The fast rollout only applies to agents that sample actions from
+        self.policy without side effects, which is the case for
+        ActorCriticAgent"""
+        return (self.fastRollout and
+                getattr(self.agent, 'policy', None) is self.policy and
+                hasattr(self.policy, 'sampleAction') and
+                hasattr(self.agent, 'history'))
+
+    def _fastInteractions(self, number):
+        """Same as calling _oneInteraction number times. The policy samples
+        actions directly from the observations and the samples are written to
+        the preallocated arrays of the agent's history. Return the sum of the
+        rewards."""
+        task = self.task
+        sampleAction = self.policy.sampleAction
+        history = self.agent.history if self.agent.logging else None
+        action = scipy.zeros((1,))
+        totalReward = 0
+        for j in xrange(number):
+            obs = task.getObservation()
+            action[0] = sampleAction(obs)
+            task.performAction(action)
+            reward = task.getReward()
+            if history is not None:
+                history.addSample(obs, action, reward)
+            totalReward += reward
+        self.stepid += number
+
+        # leave the agent in the same state as the agent API does.
+        if number > 0:
+            self.agent.lastobs = obs
+            self.agent.lastaction = action.copy()
+            self.agent.lastreward = reward
+        return totalReward
+
+    def _doInteractions(self, number):
+        """Run number interactions and return the sum of the rewards"""
+        if self.canRolloutFast():
+            return self._fastInteractions(number)
         reward = 0
         for j in xrange(number):
             reward += self._oneInteraction()
+        return reward
+
+    def doInteractionsAndLearn(self, number = 1000):
+        reward = self._doInteractions(number)
 
         if self.batch == False:
             self.agent.learn()
         return reward
 
-    def doSessionsAndPrint(self, sessionNumber, sessionSize,
-                           customPrinter=None):
+    def doSession(self, sessionSize):
+        """Run one session, learn and return the total reward"""
+        reward = self.doInteractionsAndLearn(sessionSize)
+        if self.batch:
+            self.agent.learn()
         # periodically reset stepsize to increase learning speed.
-        for i in xrange(sessionNumber):
-            reward = self.doInteractionsAndLearn(sessionSize)
-            if self.batch:
-                self.agent.learn()
-            # reset stepsize after each session.
-            self.agent.learner.resetStepSize()
-
-            if customPrinter:
-                customPrinter()
-            else:
-                cPrint(iteration=i,
-                       th_max=max(self.policy.theta),
-                       th_min=min(self.policy.theta),
-                       th_mean=scipy.mean(self.policy.theta),
-                       #  th_std=scipy.std(policy.theta),
-                       #  obs=sum(agent.lastobs),
-                       reward=reward)
+        self.agent.learner.resetStepSize()
+        return reward
+
+    def doSessionsAndPrint(self, sessionNumber, sessionSize,
+                           customPrinter=None, trace=None,
+                           checkpointer=None, profiler=None):
+        """Run sessionNumber sessions and print a record after each session.
+        If *trace* (a librl.trace.TraceWriter) is provided, the records are
+        written to it instead of being printed by cPrint.
+
+        If *checkpointer* (a Checkpointer) is provided, the run resumes from
+        its last snapshot and snapshots are saved as the sessions finish. The
+        trace has to be opened with append=True then, and the records after
+        the snapshot are dropped from it on resume. Printed records are not
+        repeated, i.e., the output of a resumed run starts at the snapshot.
+
+        If *profiler* (a librl.profiler.PhaseProfiler) is provided, the phases
+        of the run are timed and summarized after each session."""
+        if (checkpointer is not None and trace is not None and
+                not trace.append):
+            raise ValueError('a trace written with a checkpointer has to be '
+                             'opened with append=True')
+        start = 0
+        if profiler is not None:
+            profiler.attachExperiment(self)
+        try:
+            if checkpointer is not None:
+                start = checkpointer.restore(self)
+                if trace is not None and not customPrinter:
+                    # one record per session.
+                    trace.truncate(start)
+            for i in xrange(start, sessionNumber):
+                reward = self.doSession(sessionSize)
+
+                if customPrinter:
+                    customPrinter()
+                else:
+                    printer = cPrint if trace is None else trace.write
+                    printer(iteration=i,
+                            th_max=max(self.policy.theta),
+                            th_min=min(self.policy.theta),
+                            th_mean=scipy.mean(self.policy.theta),
+                            #  th_std=scipy.std(policy.theta),
+                            #  obs=sum(agent.lastobs),
+                            reward=reward)
+                if profiler is not None:
+                    profiler.endSession()
+                if checkpointer is not None:
+                    if trace is not None and checkpointer.isDue(i + 1):
+                        # the trace holds the records of the snapshot.
+                        trace.flush()
+                    checkpointer.update(self, i + 1)
+        finally:
+            if checkpointer is not None:
+                checkpointer.wait()
+            if profiler is not None:
+                profiler.detach()
@@ -0,0 +1,63 @@
+from __future__ import print_function, division, absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import scipy
+from numpy.testing import assert_array_almost_equal
+
+from librl.environments.garnet import GarnetEnvironment
+from librl.testutil import createGarnetExperiment
+from librl.trace import TraceWriter, TraceReader
+
+class SessionExperimentTestCase(unittest.TestCase):
+    def setUp(self):
+        scipy.random.seed(0)
+        self.env = GarnetEnvironment(numStates=10, numActions=3, branching=2,
+                                     feaDim=5, feaSum=2, seed=1)
+
+    def createExperiment(self):
+        return createGarnetExperiment(env=self.env,
+                                      theta=[0.1, -0.2, 0.3, 0.4, 0.5])
+
+    def runExperiment(self, fastRollout):
+        self.env.reset()
+        self.env.uniforms.reset()
+        self.env.random.seed(3)
+        scipy.random.seed(4)
+        experiment = self.createExperiment()
+        experiment.fastRollout = fastRollout
+        self.assertEqual(fastRollout, experiment.canRolloutFast())
+        reward = experiment.doInteractionsAndLearn(50)
+        return experiment, reward
+
+    def testFastRollout(self):
+        slow, slowReward = self.runExperiment(False)
+        fast, fastReward = self.runExperiment(True)
+        self.assertAlmostEqual(slowReward, fastReward)
+        self.assertEqual(slow.stepid, fast.stepid)
+        self.assertEqual(50, fast.agent.history.getLength())
+        for name in ['obs', 'action', 'reward']:
+            assert_array_almost_equal(getattr(slow.agent.history, name),
+                                      getattr(fast.agent.history, name))
+        assert_array_almost_equal(slow.agent.lastobs, fast.agent.lastobs)
+        assert_array_almost_equal(slow.agent.lastaction, fast.agent.lastaction)
+        self.assertAlmostEqual(slow.agent.lastreward, fast.agent.lastreward)
+
+    def testTrace(self):
+        dirName = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirName)
+        filename = os.path.join(dirName, 'run.trace')
+        experiment = self.createExperiment()
+        with TraceWriter(filename) as trace:
+            experiment.doSessionsAndPrint(sessionNumber=3, sessionSize=10,
+                                          trace=trace)
+        reader = TraceReader(filename)
+        self.assertEqual(['iteration', 'reward', 'th_max', 'th_mean',
+                          'th_min'], reader.names)
+        assert_array_almost_equal([0, 1, 2], reader['iteration'])
+        self.assertAlmostEqual(max(experiment.policy.theta),
+                               reader['th_max'][-1])
+
+if __name__ == "__main__":
+    unittest.main()
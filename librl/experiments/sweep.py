@@ -0,0 +1,203 @@
+"""Hyperparameter sweeps over learner arguments.
+
+A sweep runs every configuration of a design with every seed in a pool of
+worker processes and writes one row per run to a csv table. The experiment of
+a run is built by a user function buildExperiment(config, seed), which
+returns a SessionExperiment. The function must be defined at the module level,
+or be a functools.partial of such a function, so that it can be sent to the
+workers. Pass other arguments with functools.partial rather than reading
+globals that are only set in the main process.
+
+Objects created before runSweep is called, e.g., the environment of a
+testbed, are shared with the workers by fork, and memory-mapped testbeds
+(see GarnetEnvironment) share the page cache as well. buildExperiment should
+reset the state it reuses and reseed its random number generators with the
+seed, e.g., call env.reset(), env.random.seed(seed) and env.uniforms.reset()
+for a GarnetEnvironment. Otherwise, the result of a run depends on the runs
+done before it in the same worker. scipy.random is seeded by runSweep.
+
+A design is a list of configurations (dicts). They can be created from a
+space, i.e., a dict from argument name to
+  - a list of values, which are enumerated by gridDesign and sampled by the
+    random designs, or
+  - a tuple (low, high) or (low, high, 'log'), a continuous range sampled
+    uniformly, or uniformly in the log scale, by the random designs.
+"""
+from __future__ import print_function, division, absolute_import
+import csv
+import itertools
+import math
+import multiprocessing
+import time
+import scipy
+
+def gridDesign(space):
+    """All combinations of the values in space"""
+    names = sorted(space)
+    for name in names:
+        assert isinstance(space[name], list), ('grid design needs a list of '
+                                               'values for %s' % name)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[space[n] for n in names])]
+
+def _scaleUnit(spec, u):
+    """Map u in [0, 1) to a value of spec"""
+    if isinstance(spec, list):
+        return spec[min(int(u * len(spec)), len(spec) - 1)]
+    if len(spec) == 3:
+        low, high, scale = spec
+        assert scale == 'log', 'unknown scale %s' % scale
+        return math.exp(math.log(low) + u * (math.log(high) - math.log(low)))
+    low, high = spec
+    return low + u * (high - low)
+
+def randomDesign(space, number, random=scipy.random):
+    """number configurations sampled independently from space"""
+    names = sorted(space)
+    units = random.random_sample((number, len(names)))
+    return [dict((name, _scaleUnit(space[name], units[i, j]))
+                 for j, name in enumerate(names))
+            for i in xrange(number)]
+
+def latinHypercubeDesign(space, number, random=scipy.random):
+    """number configurations from a Latin hypercube, i.e., the range of each
+    argument is divided into number strata and each stratum is sampled once"""
+    names = sorted(space)
+    units = scipy.zeros((number, len(names)))
+    for j in xrange(len(names)):
+        strata = random.permutation(number)
+        units[:, j] = (strata + random.random_sample(number)) / number
+    return [dict((name, _scaleUnit(space[name], units[i, j]))
+                 for j, name in enumerate(names))
+            for i in xrange(number)]
+
+
+class EarlyStopper(object):
+    """Decide whether a run should be stopped after a session.
+
+    A run is stopped if its reward or the policy parameters are not finite.
+    After minSessions sessions, it is also stopped if the mean reward of the
+    last window sessions is below minReward, or below the best final reward
+    of the finished runs by more than margin. The best final reward is shared
+    by the workers.
+    """
+    def __init__(self, minSessions=10, window=10, minReward=None,
+                 margin=None):
+        self.minSessions = minSessions
+        self.window = window
+        self.minReward = minReward
+        self.margin = margin
+        self.bestReward = None
+
+    def share(self):
+        """Keep the best final reward in shared memory. It is called by
+        runSweep before the workers are created."""
+        self.bestReward = multiprocessing.Value('d', float('-inf'))
+
+    def update(self, finalReward):
+        if self.bestReward is None:
+            return
+        with self.bestReward.get_lock():
+            if finalReward > self.bestReward.value:
+                self.bestReward.value = finalReward
+
+    def shouldStop(self, rewards, theta):
+        """Return the reason to stop, or None"""
+        if not (scipy.isfinite(rewards[-1]) and
+                scipy.isfinite(theta).all()):
+            return 'diverged'
+        if len(rewards) < self.minSessions:
+            return None
+        recent = scipy.mean(rewards[-self.window:])
+        if self.minReward is not None and recent < self.minReward:
+            return 'below minReward'
+        if (self.margin is not None and self.bestReward is not None and
+                recent < self.bestReward.value - self.margin):
+            return 'below best'
+        return None
+
+
+# set in the workers by _initWorker.
+_sweep = dict()
+
+def _initWorker(buildExperiment, sessionNumber, sessionSize, stopper,
+                finalWindow):
+    _sweep.update(buildExperiment=buildExperiment,
+                  sessionNumber=sessionNumber, sessionSize=sessionSize,
+                  stopper=stopper, finalWindow=finalWindow)
+
+def _runConfig(job):
+    """Run one configuration with one seed. Return a row of the table."""
+    configId, config, seed = job
+    scipy.random.seed(seed)
+    startTime = time.time()
+    experiment = _sweep['buildExperiment'](config, seed)
+    stopper = _sweep['stopper']
+    rewards = []
+    stopReason = ''
+    for i in xrange(_sweep['sessionNumber']):
+        rewards.append(experiment.doSession(_sweep['sessionSize']))
+        if stopper is not None:
+            reason = stopper.shouldStop(rewards, experiment.policy.theta)
+            if reason is not None:
+                stopReason = reason
+                break
+    finalReward = scipy.mean(rewards[-_sweep['finalWindow']:])
+    if stopper is not None and not stopReason:
+        stopper.update(finalReward)
+
+    row = dict(config)
+    row.update(config_id=configId, seed=seed, sessions=len(rewards),
+               stopped=stopReason, final_reward=finalReward,
+               mean_reward=scipy.mean(rewards),
+               th_max=max(experiment.policy.theta),
+               th_min=min(experiment.policy.theta),
+               elapsed=time.time() - startTime)
+    return row
+
+def runSweep(buildExperiment, design, seeds, sessionNumber, sessionSize,
+             outputFilename, processes=None, stopper=None, finalWindow=10,
+             verbose=True):
+    """Run every configuration in design with every seed and write the
+    results to the csv file outputFilename, one row per run in the order they
+    finish. The final reward is the mean reward of the last finalWindow
+    sessions. Return the rows."""
+    jobs = [(i, config, seed) for i, config in enumerate(design)
+            for seed in seeds]
+    configNames = sorted(set(itertools.chain(*design)))
+    fields = (['config_id', 'seed'] + configNames +
+              ['sessions', 'stopped', 'final_reward', 'mean_reward', 'th_max',
+               'th_min', 'elapsed'])
+    if stopper is not None:
+        stopper.share()
+
+    initArgs = (buildExperiment, sessionNumber, sessionSize, stopper,
+                finalWindow)
+    if processes == 1:
+        _initWorker(*initArgs)
+        pool = None
+        results = (_runConfig(job) for job in jobs)
+    else:
+        pool = multiprocessing.Pool(processes, _initWorker, initArgs)
+        results = pool.imap_unordered(_runConfig, jobs)
+
+    rows = []
+    startTime = time.time()
+    with open(outputFilename, 'wb') as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        for row in results:
+            writer.writerow(row)
+            f.flush()
+            rows.append(row)
+            if verbose:
+                print('[%i/%i] config %i seed %i: final reward %g%s, '
+                      '%.2f runs/min' %
+                      (len(rows), len(jobs), row['config_id'], row['seed'],
+                       row['final_reward'],
+                       ' (%s)' % row['stopped'] if row['stopped'] else '',
+                       len(rows) / (time.time() - startTime) * 60))
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return rows
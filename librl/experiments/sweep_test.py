@@ -0,0 +1,110 @@
+from __future__ import print_function, division, absolute_import
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import scipy
+
+from .sweep import gridDesign, randomDesign, latinHypercubeDesign, \
+    EarlyStopper, runSweep
+from .experiment import SessionExperiment
+from librl.agents.actorcriticagent import ActorCriticAgent
+from librl.environments.garnet import GarnetEnvironment, GarnetLookForwardTask
+from librl.learners import TDLearner
+from librl.policies.boltzmann import BoltzmanPolicy, PolicyFeatureModule
+
+env = GarnetEnvironment(numStates=10, numActions=2, branching=2, feaDim=5,
+                        feaSum=2, seed=1)
+
+def buildExperiment(config, seed):
+    env.reset()
+    env.random.seed(seed)
+    env.uniforms.reset()
+    task = GarnetLookForwardTask(env, sigma=0.1, seed=seed)
+    policy = BoltzmanPolicy(2, T=1, theta=scipy.zeros((5,)))
+    module = PolicyFeatureModule(policy, 'policywrapper')
+    learner = TDLearner(module=module, cssinitial=config['cssinitial'],
+                        cssdecay=1000, assinitial=config['assinitial'],
+                        assdecay=1000, rdecay=0.95, maxcriticnorm=1000,
+                        tracestepsize=0.5)
+    agent = ActorCriticAgent(learner, sdim=task.outdim, adim=1, batch=True)
+    return SessionExperiment(task, agent, policy=policy, batch=True)
+
+class SweepTestCase(unittest.TestCase):
+    def setUp(self):
+        dirName = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirName)
+        self.filename = os.path.join(dirName, 'sweep.csv')
+
+    def testGridDesign(self):
+        design = gridDesign({'a': [1, 2, 3], 'b': [0.1, 0.2]})
+        self.assertEqual(6, len(design))
+        self.assertEqual({'a': 1, 'b': 0.1}, design[0])
+        self.assertEqual(6, len(set(tuple(sorted(c.items()))
+                                    for c in design)))
+
+    def testRandomDesigns(self):
+        space = {'a': (0.0, 1.0), 'b': (1e-3, 1.0, 'log'), 'c': ['x', 'y']}
+        random = scipy.random.RandomState(0)
+        for design in [randomDesign(space, 20, random),
+                       latinHypercubeDesign(space, 20, random)]:
+            self.assertEqual(20, len(design))
+            for config in design:
+                self.assertTrue(0 <= config['a'] < 1)
+                self.assertTrue(1e-3 <= config['b'] < 1)
+                self.assertTrue(config['c'] in ['x', 'y'])
+
+        # every stratum is sampled once.
+        design = latinHypercubeDesign({'a': (0.0, 1.0)}, 10, random)
+        strata = sorted(int(config['a'] * 10) for config in design)
+        self.assertEqual(range(10), strata)
+
+    def testEarlyStopper(self):
+        stopper = EarlyStopper(minSessions=2, window=2, minReward=0)
+        self.assertEqual(None, stopper.shouldStop([-1], scipy.zeros(2)))
+        self.assertEqual('below minReward',
+                         stopper.shouldStop([-1, -1], scipy.zeros(2)))
+        self.assertEqual('diverged',
+                         stopper.shouldStop([1], scipy.array([scipy.nan])))
+
+        stopper = EarlyStopper(minSessions=1, window=1, margin=1)
+        stopper.share()
+        stopper.update(5)
+        self.assertEqual(None, stopper.shouldStop([4.5], scipy.zeros(2)))
+        self.assertEqual('below best', stopper.shouldStop([3], scipy.zeros(2)))
+
+    def testRunSweep(self):
+        design = gridDesign({'cssinitial': [0.1], 'assinitial': [0.01, 0.1]})
+        for processes in [1, 2]:
+            rows = runSweep(buildExperiment, design, seeds=[1, 2],
+                            sessionNumber=3, sessionSize=20,
+                            outputFilename=self.filename,
+                            processes=processes, verbose=False)
+            self.assertEqual(4, len(rows))
+            with open(self.filename) as f:
+                table = list(csv.DictReader(f))
+            self.assertEqual(4, len(table))
+            self.assertEqual(set([('0', '1'), ('0', '2'), ('1', '1'),
+                                  ('1', '2')]),
+                             set((r['config_id'], r['seed']) for r in table))
+            for row in table:
+                self.assertEqual('3', row['sessions'])
+            if processes == 1:
+                sequentialRows = sorted(rows, key=lambda r: (r['config_id'],
+                                                             r['seed']))
+        # the runs are reproducible in the workers.
+        rows = sorted(rows, key=lambda r: (r['config_id'], r['seed']))
+        for a, b in zip(sequentialRows, rows):
+            self.assertAlmostEqual(a['final_reward'], b['final_reward'])
+
+        stopper = EarlyStopper(minSessions=1, window=1, minReward=1e10)
+        rows = runSweep(buildExperiment, design, seeds=[1], sessionNumber=3,
+                        sessionSize=20, outputFilename=self.filename,
+                        processes=1, stopper=stopper, verbose=False)
+        for row in rows:
+            self.assertEqual(1, row['sessions'])
+            self.assertEqual('below minReward', row['stopped'])
+
+if __name__ == "__main__":
+    unittest.main()
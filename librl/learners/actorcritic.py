@@ -3,7 +3,27 @@ import scipy
 from ..policies.boltzmann import PolicyFeatureModule
 
 class ActorCriticLearner(object):
-    """This is the basis class for all actor-critic method"""
+    """This is the basis class for all actor-critic method
+
+    If reuseFeature is True, the feature of the current (obs, action) pair is
+    kept and used as the feature of the last pair in the next step, which
+    halves the work of the feature module. Note that the reused feature was
+    computed before the last actor update, i.e., with the previous policy
+    parameters.
+    """
+    reuseFeature = False
+    # If batchFeature is True, learnOnDataSet precomputes the parts of the
+    # features of all samples that don't depend on the policy parameters with
+    # module.prepareBatch. The rest is computed step by step with the current
+    # parameters, so the result is the same as the step-wise path.
+    batchFeature = False
+    # feature of (lastobs, lastaction) if reuseFeature is True.
+    lastfeature = None
+    # methods timed by librl.profiler.PhaseProfiler.
+    profiledPhases = {'learnOnDataSet': 'learn',
+                      '_getFeature': 'feature',
+                      'critic': 'critic',
+                      'actor': 'actor'}
     def __init__(self, module,
                  enableOnlyEssentialFeatureInCritic=False,
                  essentialFeature='first_order'):
@@ -27,14 +47,66 @@ class ActorCriticLearner(object):
     def resetStepSize(self):
         self.k = 0
 
+    def _getFeature(self, obs, action):
+        """Activate the module on (obs, action). obs and action are written to
+        the input buffer of the module directly instead of being
+        concatenated."""
+        module = self.module
+        inbuf = module.inputbuffer[module.offset]
+        obsdim = len(obs)
+        inbuf[:obsdim] = obs
+        inbuf[obsdim:] = action
+        module.forward()
+        return module.outputbuffer[module.offset].copy()
+
     def _updateWeights(self, lastobs, lastaction, lastreward, obs, action,
-                       reward):
+                       reward, lastfeature=None):
         """Update weights of Critic and Actor based on the (state, action, reward) pair for
-        current time and last time"""
-        lastfeature = self.module.activate(scipy.concatenate((lastobs, lastaction)))
-        feature = self.module.activate(scipy.concatenate((obs, action)))
+        current time and last time. Return the feature of current time.
+
+        lastfeature is computed if it is not provided."""
+        if lastfeature is None:
+            lastfeature = self._getFeature(lastobs, lastaction)
+        feature = self._getFeature(obs, action)
         self.critic(lastreward, lastfeature, reward, feature)
         self.actor(lastobs, lastaction, lastfeature)
+        return feature
+
+    @staticmethod
+    def _getDataArrays(dataset, startIndex, endIndex):
+        """obs, actions and rewards of the samples in [startIndex, endIndex)
+        as arrays"""
+        if hasattr(dataset, 'getArrays'):
+            obs, actions, rewards = dataset.getArrays()
+        else:
+            obs, actions, rewards = (dataset['state'], dataset['action'],
+                                     dataset['reward'])
+        return (obs[startIndex:endIndex], actions[startIndex:endIndex],
+                rewards[startIndex:endIndex])
+
+    def _learnOnArrays(self, obs, actions, rewards):
+        """Batch version of the loop in learnOnDataSet, see batchFeature"""
+        module = self.module
+        prepared = module.prepareBatch(obs, actions)
+        for n in xrange(len(rewards)):
+            feature = None
+            if self.lastobs is not None:
+                lastfeature = self.lastfeature if self.reuseFeature else None
+                if lastfeature is None and n == 0:
+                    # the last sample of the previous call.
+                    lastfeature = self._getFeature(self.lastobs,
+                                                   self.lastaction)
+                elif lastfeature is None:
+                    lastfeature = module.activatePrepared(prepared, n - 1)
+                feature = module.activatePrepared(prepared, n)
+                self.critic(self.lastreward, lastfeature, rewards[n], feature)
+                self.actor(self.lastobs, self.lastaction, lastfeature)
+            self.lastfeature = feature
+            self.k += 1
+
+            self.lastobs = obs[n]
+            self.lastaction = actions[n]
+            self.lastreward = rewards[n]
 
     def learnOnDataSet(self, dataset, startIndex=0, endIndex=None):
         """dataset is a sequence of (state, action, reward). update weights based on
@@ -44,11 +116,29 @@ class ActorCriticLearner(object):
             endIndex = dataset.getLength()
         assert endIndex <= dataset.getLength(), ('end index is larger '
                                                  'than dataset length')
+        if self.batchFeature:
+            self._learnOnArrays(*self._getDataArrays(dataset, startIndex,
+                                                     endIndex))
+        else:
+            self._learnOnSamples(startIndex, endIndex)
+
+        # the dataset may return views of buffers that are reused later, so
+        # the last sample is copied.
+        if endIndex > startIndex:
+            self.lastobs = scipy.array(self.lastobs)
+            self.lastaction = scipy.array(self.lastaction)
+            self.lastreward = scipy.array(self.lastreward)
+
+    def _learnOnSamples(self, startIndex, endIndex):
         for n in range(startIndex, endIndex):
             obs, action, reward = self.dataset.getLinked(n)
+            feature = None
             if self.lastobs is not None:
-                self._updateWeights(self.lastobs, self.lastaction, self.lastreward,
-                        obs, action, reward)
+                lastfeature = self.lastfeature if self.reuseFeature else None
+                feature = self._updateWeights(self.lastobs, self.lastaction,
+                                              self.lastreward, obs, action,
+                                              reward, lastfeature)
+            self.lastfeature = feature
             self.k += 1
 
             self.lastobs = obs
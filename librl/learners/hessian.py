@@ -3,7 +3,7 @@ from __future__ import print_function, division, absolute_import
 
 import scipy
 from scipy import dot, zeros, inner, outer, concatenate, sqrt, log
-from scipy.linalg import norm, pinv, inv, LinAlgError
+from scipy.linalg import norm, pinv, inv, LinAlgError, cho_factor, cho_solve, eigh
 from .lstd import LSTDLearner
 from .td import TDLearner
 
@@ -18,6 +18,17 @@ class HessianBase(object):
     # Check whether the scaling matrix is positive definiteness, which will
     # have some addition cost
     checkPosDef = False
+    # How the scaling matrix is applied to the gradient in actor.
+    #   'inverse': invert the damped Hessian in every actor step.
+    #   'factor': solve with a Cholesky factor of the damped Hessian. If the
+    #             matrix is not positive definite, its eigenvalues are clamped
+    #             to minScalingEigenvalue. The positive definiteness check
+    #             comes from the Cholesky factorization for free.
+    scalingSolver = 'inverse'
+    # With the 'factor' solver, the factorization is refreshed every
+    # scalingFactorRefreshInterval actor steps and reused in between.
+    scalingFactorRefreshInterval = 1
+    minScalingEigenvalue = 1e-3
     def __init__(self, hessianlearningrate):
         self.hessianlearningrate = hessianlearningrate
         self.hessiansamplenumber = 0
@@ -42,33 +53,65 @@ class HessianBase(object):
 
         return self.tao(weight) * inner(feature, weight)
 
-    def getHessianEstimate(self, feature):
-        # Estimate gradient of state action value function w.r.t. parameters.
+    def resetHessianBuffers(self):
+        """Allocate the buffers used by getHessianEstimate"""
         n = self.paramdim
-        # state-action value
-        #  self.qvalue  = self.stateActionValue(feature, self.r)
+        self.qgradient = zeros((n,))
+        # decoded second order feature.
+        self.loglhhessian = zeros((n, n))
+        self.hessianestimate = zeros((n, n))
+        self.outerbuf = zeros((n, n))
+        # cached factorization of the damped Hessian.
+        self.scalingfactor = None
+        self.scalingfactorage = 0
+
+    def getQGradient(self, feature):
+        """Gradient of the state action value function w.r.t. the parameters.
+
+        Column i of T is the critic weight for the derivative w.r.t. the i-th
+        parameter, so the gradient is the product of feature and T, with the
+        same bound on the norm of each column as stateActionValue.
+        """
+        T = self.T
+        norms = sqrt(scipy.einsum('ij,ij->j', T, T))
+        # the same as self.tao(T[:, i]) for every column.
+        scale = self.maxcriticnorm / scipy.maximum(norms, self.maxcriticnorm)
+        dot(feature, T, out=self.qgradient)
+        self.qgradient *= scale
+        return self.qgradient
+
+    def getHessianEstimate(self, feature):
+        """Estimate the Hessian of the average reward. The result is written to
+        a buffer that is reused in the next call."""
         # gradient of the state-action value function w.r.t. the parameters
-        qgradient = zeros((n,))
-        for i in xrange(n):
-            qgradient[i] = self.stateActionValue(feature, self.T[:, i])
+        qgradient = self.getQGradient(feature)
 
         # The first n elements in the first-order basis (i.e., \nabla
         # \log(\mu)), the following n^2 elements are the second-order basis
         # (i.e., \nabla^2 \log(\mu)).
-        #  self.loglhgrad = self.module.decodeFeature(feature, 'first_order')
-        #  self.loglhgrad = self.cacheFeature
-        loglhhessian = self.module.decodeFeature(feature, 'second_order')
-
-        term1 = self.qvalue * (loglhhessian - outer(self.loglhgrad, self.loglhgrad))
-        term2 = outer(qgradient, self.loglhgrad)
+        loglhhessian = self.module.decodeFeature(feature, 'second_order',
+                                                 out=self.loglhhessian)
+
+        # term1 = qvalue * (loglhhessian - outer(loglhgrad, loglhgrad))
+        # term2 = outer(qgradient, loglhgrad)
+        res = self.hessianestimate
+        term2 = self.outerbuf
+        scipy.multiply(self.loglhgrad[:, None], self.loglhgrad[None, :],
+                       out=res)
+        scipy.subtract(loglhhessian, res, out=res)
+        res *= self.qvalue
+        scipy.multiply(qgradient[:, None], self.loglhgrad[None, :], out=term2)
+        res += term2
+        res += term2.T
 
         # ATTENTION! This algorighm is designed only for maximization problems
         # in which the Hessian matrix is negative semidefinite in the optimal
         # point. As a result, the scaling matrix should be -1 * inverse of the
         # Hessian to move in the right direction
-        return - 1 * (term1 + term2 + term2.T)
+        res *= -1
+        return res
 
-    def getScalingMatrix(self):
+    def getDampedHessian(self):
         # Here we add one to avoid division by zero.
         #  rho = 1.0 / (self.hessiansamplenumber + 1)
         if self.hessiansamplenumber < self.minHessianSampleNumber:
@@ -86,24 +129,66 @@ class HessianBase(object):
 
 
         I = scipy.eye(self.paramdim)
-        mat = rho *  self.H + (1 - rho) * I
+        return rho *  self.H + (1 - rho) * I
+
+    def getScalingMatrix(self):
+        mat = self.getDampedHessian()
         try:
           scaleMatrix = inv(mat)
         except:
-          scaleMatrix = I
+          scaleMatrix = scipy.eye(self.paramdim)
         return scaleMatrix
 
+    def getScalingFactor(self):
+        """Get the factorization of the damped Hessian and whether it is
+        positive definite. The factorization is cached for
+        scalingFactorRefreshInterval calls."""
+        self.scalingfactorage += 1
+        if (self.scalingfactor is not None and
+                self.scalingfactorage < self.scalingFactorRefreshInterval):
+            return self.scalingfactor
+
+        mat = self.getDampedHessian()
+        try:
+            self.scalingfactor = (('cholesky', cho_factor(mat)), True)
+        except LinAlgError:
+            w, v = eigh(mat)
+            w = scipy.maximum(w, self.minScalingEigenvalue)
+            self.scalingfactor = (('eigen', (w, v)), False)
+        self.scalingfactorage = 0
+        return self.scalingfactor
+
+    @staticmethod
+    def solveScaling(factor, gradient):
+        """Solve mat * x = gradient with the factorization of mat"""
+        kind, data = factor
+        if kind == 'cholesky':
+            return cho_solve(data, gradient)
+        w, v = data
+        return dot(v, dot(gradient, v) / w)
+
+    def getScaledGradient(self, gradient):
+        """Scale the gradient with the inverse of the damped Hessian. Return
+        None if checkPosDef is enabled and the scaling matrix is not positive
+        definite."""
+        if self.scalingSolver == 'factor':
+            factor, posdef = self.getScalingFactor()
+            if self.checkPosDef and not posdef:
+                return None
+            return self.solveScaling(factor, gradient)
+
+        scaleMatrix = self.getScalingMatrix()
+        if self.checkPosDef and not isPosDef(scaleMatrix):
+            return None
+        return dot(scaleMatrix, gradient)
+
     # It is intended that obs, action, and feature are not used.
     # scaledfeature has been calculated in critic and reused here.
     def actor(self, obs, action, feature):
-        scaleMatrix = self.getScalingMatrix()
-        if self.checkPosDef and not isPosDef(scaleMatrix):
-            #  print('not PD')
+        scaledgradient = self.getScaledGradient(self.scaledfeature)
+        if (scaledgradient is None or
+                norm(scaledgradient) > self.actorUpdateThreshold):
             scaledgradient = self.scaledfeature
-        else:
-            scaledgradient = dot(scaleMatrix, self.scaledfeature)
-            if norm(scaledgradient) > self.actorUpdateThreshold:
-                scaledgradient = self.scaledfeature
         self.module.theta = self.ensureBound(self.module.theta + self.beta() *
                                              scaledgradient)
 
@@ -115,6 +200,7 @@ class HessianLSTDLearner(HessianBase, LSTDLearner):
 
     def reset(self):
         LSTDLearner.reset(self)
+        self.resetHessianBuffers()
         self.eta = zeros((self.paramdim,))
         self.V = zeros((self.module.outdim, self.paramdim))
         self.T = zeros((self.module.outdim, self.paramdim))
@@ -157,6 +243,7 @@ class HessianTDLearner(HessianBase, TDLearner):
 
     def reset(self):
         TDLearner.reset(self)
+        self.resetHessianBuffers()
         self.eta = zeros((self.paramdim,))
         self.T = zeros((self.module.outdim, self.paramdim))
         self.H = zeros((self.paramdim, self.paramdim))
@@ -170,6 +257,7 @@ class HessianTDLearner(HessianBase, TDLearner):
         ff = self.module.decodeFeature(feature, 'first_order')
         # Cache q value to boost speed
         self.qvalue = self.stateActionValue(feature)
+        self.loglhgrad = ff
         preward = self.qvalue * ff
 
         # cache the first order feature to boost speed
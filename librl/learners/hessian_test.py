@@ -28,6 +28,66 @@ class TDLearnerTestCase(unittest.TestCase):
                                           )
 
 
+    def testGetHessianEstimate(self):
+        # features have 2 first-order and 2x2 second-order elements.
+        self.module.outdim = 2
+        scipy.random.seed(0)
+        self.learner.maxcriticnorm = 1.5
+        self.learner.T = scipy.random.randn(6, 2)
+        self.learner.qvalue = 2.0
+        self.learner.loglhgrad = scipy.array([0.5, -1.0])
+        feature = scipy.random.randn(6)
+
+        # compute the gradient column by column.
+        qgradient = [self.learner.stateActionValue(feature,
+                                                   self.learner.T[:, i])
+                     for i in xrange(2)]
+        assert_array_almost_equal(qgradient,
+                                  self.learner.getQGradient(feature))
+
+        g = self.learner.loglhgrad
+        loglhhessian = feature[2:].reshape((2, 2))
+        term1 = 2.0 * (loglhhessian - scipy.outer(g, g))
+        term2 = scipy.outer(qgradient, g)
+        expected = -1 * (term1 + term2 + term2.T)
+        assert_array_almost_equal(expected,
+                                  self.learner.getHessianEstimate(feature))
+
+    def testFactorScalingSolver(self):
+        self.learner.hessiansamplenumber = self.learner.minHessianSampleNumber
+        self.learner.actorUpdateThreshold = 100
+        gradient = scipy.array([4.0, 5.0])
+
+        # positive definite Hessian, the same result as the inverse.
+        self.learner.H = scipy.array([[2.0, 0.5], [0.5, 3.0]])
+        expected = self.learner.getScaledGradient(gradient)
+        assert_array_almost_equal(scipy.linalg.solve(self.learner.H, gradient),
+                                  expected)
+        self.learner.scalingSolver = 'factor'
+        self.learner.checkPosDef = True
+        assert_array_almost_equal(expected,
+                                  self.learner.getScaledGradient(gradient))
+
+        # indefinite Hessian
+        self.learner.H = scipy.array([[2.0, 0.0], [0.0, -3.0]])
+        self.learner.scalingfactor = None
+        self.assertTrue(self.learner.getScaledGradient(gradient) is None)
+        self.learner.checkPosDef = False
+        self.learner.minScalingEigenvalue = 0.5
+        self.learner.scalingfactor = None
+        assert_array_almost_equal([2.0, 10.0],
+                                  self.learner.getScaledGradient(gradient))
+
+        # the cached factor is used until it is refreshed.
+        self.learner.scalingFactorRefreshInterval = 2
+        self.learner.scalingfactor = None
+        self.learner.getScaledGradient(gradient)
+        self.learner.H = scipy.eye(2)
+        assert_array_almost_equal([2.0, 10.0],
+                                  self.learner.getScaledGradient(gradient))
+        assert_array_almost_equal(gradient,
+                                  self.learner.getScaledGradient(gradient))
+
     @unittest.skip('ignore the test before td algorithm is finalized')
     def testActor(self):
         self.learner.H = scipy.array([[2, 0], [0, 3]])
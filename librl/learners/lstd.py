@@ -5,18 +5,27 @@ import scipy
 from scipy import dot, ravel, zeros, array, log, inner, outer, concatenate, sqrt
 from scipy.linalg import norm, pinv, inv, LinAlgError
 from .td import TDLearner
-from ..util import shermanMorrisonUpdate
+from ..util import shermanMorrisonUpdate, shermanMorrisonRankOneUpdate
 
 class LSTDLearner(TDLearner):
     # By default, do critic update for every actor update
     actorUpdateInterval = 1
     criticResetInterval = 200
+    # Keep invA up to date with Sherman-Morrison rank-1 updates in critic,
+    # which costs O(n^2) per step instead of the O(n^3) inversion in
+    # updateCriticPara.
+    incrementalInverse = False
+    # When incrementalInverse is enabled, invA is recomputed exactly every
+    # inverseRefreshInterval updates to control numerical drift. None means
+    # no periodic refresh.
+    inverseRefreshInterval = None
     def reset(self):
         super(LSTDLearner, self).reset()
         self.b = zeros((self.criticdim,))
         self.invA = scipy.eye(self.criticdim)
         self.A = scipy.eye(self.criticdim)
         self.alpha = 0
+        self.inverseUpdateNumber = 0
 
     def critic(self, lastreward, lastfeature, reward, feature):
         if self.k % self.criticResetInterval == 0:
@@ -32,17 +41,38 @@ class LSTDLearner(TDLearner):
         # Update critic estimate
         self.b += rd * self.z
         self.A += outer(self.z, fd)
+        if self.incrementalInverse:
+            self.updateInverse(self.z, fd)
 
         # Update eligiblity trace
         self.z = self.tracestepsize * self.z + feature
 
-    def updateCriticPara(self):
-        # get inverse of A.
+    def refreshInverse(self):
         try:
           self.invA = inv(self.A)
         except LinAlgError:
             pass
 
+    def updateInverse(self, z, fd):
+        """Update invA after A += outer(z, fd)"""
+        self.inverseUpdateNumber += 1
+        interval = self.inverseRefreshInterval
+        if interval is not None and self.inverseUpdateNumber % interval == 0:
+            self.refreshInverse()
+            return
+
+        try:
+            shermanMorrisonRankOneUpdate(self.invA, z, fd)
+        except LinAlgError:
+            # the rank-1 update is ill-conditioned, fall back to exact
+            # inversion.
+            self.refreshInverse()
+
+    def updateCriticPara(self):
+        # get inverse of A.
+        if not self.incrementalInverse:
+            self.refreshInverse()
+
         self.r = dot(self.invA, self.b)
 
     def actor(self, lastobs, lastaction, lastfeature):
@@ -51,3 +81,48 @@ class LSTDLearner(TDLearner):
 
         self.updateCriticPara()
         super(LSTDLearner, self).actor(lastobs, lastaction, lastfeature)
+
+
+class RLSTDLearner(LSTDLearner):
+    """Recursive least-squares version of LSTD(lambda)
+
+    Instead of resetting all statistics every criticResetInterval steps, A
+    and b are discounted by an exponential forgetting factor:
+        A = forgettingFactor * A + outer(z, fd)
+        b = forgettingFactor * b + rd * z
+    and only inv(A) is kept, which is updated with the Sherman-Morrison
+    formula in O(n^2) per step. Old samples fade out smoothly, so the critic
+    can follow the non-stationarity caused by the actor update.
+    """
+    forgettingFactor = 0.995
+    # invA is always maintained incrementally, updateCriticPara never
+    # inverts A.
+    incrementalInverse = True
+
+    def reset(self):
+        super(RLSTDLearner, self).reset()
+        assert 0 < self.forgettingFactor < 1, 'invalid forgetting factor'
+        # A is scaled by (1 - forgettingFactor) internally, which doesn't
+        # change r = inv(A) * b. Start with A = I like LSTDLearner.
+        self.invA = scipy.eye(self.criticdim) / (1 - self.forgettingFactor)
+        # A is not kept.
+        self.A = None
+        self.sampleNumber = 0
+
+    def critic(self, lastreward, lastfeature, reward, feature):
+        self.sampleNumber += 1
+        stepsize = 1 - self.forgettingFactor
+
+        # Estimate of avg reward. Use the sample average until there are
+        # enough samples for the forgetting factor to take over.
+        rweight = max(1.0 / self.sampleNumber, stepsize)
+        self.alpha = (1 - rweight) * self.alpha + rweight * reward
+        fd = lastfeature - feature
+        rd = lastreward - self.alpha
+
+        # Update critic estimate
+        self.b = self.forgettingFactor * self.b + stepsize * rd * self.z
+        self.invA = shermanMorrisonUpdate(self.invA, stepsize, self.z, fd)
+
+        # Update eligiblity trace
+        self.z = self.tracestepsize * self.z + feature
@@ -1,5 +1,5 @@
 from __future__ import print_function, division, absolute_import
-from .lstd import LSTDLearner
+from .lstd import LSTDLearner, RLSTDLearner
 from ..testutil import MockPolicy, MockPolicyFeatureModule
 
 import unittest
@@ -43,3 +43,74 @@ class LSTDLearnerTestCase(unittest.TestCase):
         assert_array_almost_equal(0.5, self.learner.gamma())
         assert_array_almost_equal([[-0.5, -0.5],
                                    [1.5, 2.5]], self.learner.A)
+
+    def testIncrementalInverse(self):
+        learner = LSTDLearner(module=self.module,
+                              cssinitial=1,
+                              cssdecay=1, # css means critic step size
+                              assinitial=1,
+                              assdecay=1, # ass means actor steps size
+                              rdecay=1, # reward decay weight
+                              maxcriticnorm=100, # maximum critic norm
+                              tracestepsize=0.9, # trace stepsize
+                              parambound = None # bound for the parameters
+                              )
+        learner.incrementalInverse = True
+        scipy.random.seed(0)
+        lastfeature = scipy.random.rand(2)
+        for k in xrange(1, 20):
+            learner.k = k
+            feature = scipy.random.rand(2)
+            learner.critic(1, lastfeature, 2, feature)
+            lastfeature = feature
+        learner.updateCriticPara()
+
+        assert_array_almost_equal(scipy.linalg.inv(learner.A), learner.invA)
+        assert_array_almost_equal(scipy.linalg.solve(learner.A, learner.b),
+                                  learner.r)
+
+
+class RLSTDLearnerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.policy = MockPolicy({}, [0, 0])
+        self.module = MockPolicyFeatureModule(self.policy)
+        self.learner = RLSTDLearner(module=self.module,
+                                    cssinitial=1,
+                                    cssdecay=1, # css means critic step size
+                                    assinitial=1,
+                                    assdecay=1, # ass means actor steps size
+                                    rdecay=1, # reward decay weight
+                                    maxcriticnorm=100, # maximum critic norm
+                                    tracestepsize=0.9, # trace stepsize
+                                    parambound = None # bound for the parameters
+                                    )
+
+    def testCritic(self):
+        # compare with the direct calculation of the discounted statistics.
+        ff = self.learner.forgettingFactor = 0.9
+        self.learner.reset()
+        A = scipy.eye(2)
+        b = scipy.zeros((2,))
+        z = scipy.zeros((2,))
+        alpha = 0
+
+        scipy.random.seed(0)
+        lastfeature = scipy.random.rand(2)
+        lastreward = 0
+        # run longer than criticResetInterval to make sure there is no reset.
+        for n in xrange(1, 300):
+            self.learner.k = n
+            feature = scipy.random.rand(2)
+            reward = scipy.random.rand()
+            self.learner.critic(lastreward, lastfeature, reward, feature)
+
+            rweight = max(1.0 / n, 1 - ff)
+            alpha = (1 - rweight) * alpha + rweight * reward
+            A = ff * A + scipy.outer(z, lastfeature - feature)
+            b = ff * b + (lastreward - alpha) * z
+            z = 0.9 * z + feature
+            lastfeature, lastreward = feature, reward
+
+        self.learner.updateCriticPara()
+        assert_almost_equal(alpha, self.learner.alpha)
+        assert_array_almost_equal(scipy.linalg.solve(A, b), self.learner.r)
@@ -1,5 +1,6 @@
 from __future__ import print_function, division, absolute_import
 from .td import TDLearner
+from .lstd import LSTDLearner
 
 import unittest
 import scipy
@@ -7,6 +8,7 @@ from numpy.testing import assert_array_almost_equal
 
 from pybrain.datasets import ReinforcementDataSet
 from librl.policies.boltzmann import BoltzmanPolicy, PolicyFeatureModule
+from librl.agents.history import RingBufferHistory
 
 class MockTDLearnerForTest(TDLearner):
     def actor(self, lastobs, lastaction, lastfeature):
@@ -70,6 +72,84 @@ class TDLearnerTestCase(unittest.TestCase):
                                    -0.0374024173,
                                    0.0552522117,
                                    -0.2442805382], learner.z)
+    def testReuseFeature(self):
+        # The actor is disabled, so the reused features are the same as the
+        # recomputed ones.
+        learners = []
+        for reuseFeature in [False, True]:
+            learner = MockTDLearnerForTest(module=self.module,
+                                           cssinitial=1, cssdecay=1,
+                                           assinitial=1, assdecay=1,
+                                           rdecay=1, maxcriticnorm=100,
+                                           tracestepsize=0.9, parambound=None)
+            learner.reuseFeature = reuseFeature
+            calls = []
+            forward = self.module.forward
+            def countingForward():
+                calls.append(1)
+                forward()
+            self.module.forward = countingForward
+            learner.learnOnDataSet(self.dataset)
+            del self.module.forward
+            learners.append((learner, len(calls)))
+
+        (learner, calls), (reuseLearner, reuseCalls) = learners
+        self.assertEqual(6, calls)
+        self.assertEqual(4, reuseCalls)
+        assert_array_almost_equal(learner.alpha, reuseLearner.alpha)
+        assert_array_almost_equal(learner.r, reuseLearner.r)
+        assert_array_almost_equal(learner.z, reuseLearner.z)
+
+    def testBatchFeature(self):
+        history = RingBufferHistory(8, 1, capacity=2, grow=True)
+        for i in xrange(self.dataset.getLength()):
+            history.addSample(*self.dataset.getLinked(i))
+
+        learners = []
+        for batchFeature, dataset in [(False, self.dataset), (True, history),
+                                      (True, self.dataset)]:
+            learner = MockTDLearnerForTest(module=self.module,
+                                           cssinitial=1, cssdecay=1,
+                                           assinitial=1, assdecay=1,
+                                           rdecay=1, maxcriticnorm=100,
+                                           tracestepsize=0.9, parambound=None)
+            learner.batchFeature = batchFeature
+            # learn in two calls to check the sample carried between calls.
+            learner.learnOnDataSet(dataset, 0, 2)
+            learner.learnOnDataSet(dataset, 2, 4)
+            learners.append(learner)
+
+        for learner in learners[1:]:
+            self.assertEqual(learners[0].k, learner.k)
+            assert_array_almost_equal([0.7610084396], learner.alpha)
+            assert_array_almost_equal(learners[0].r, learner.r)
+            assert_array_almost_equal(learners[0].z, learner.z)
+
+    def testBatchFeatureWithActor(self):
+        # the actor changes the parameters at every step, the features of the
+        # batch path have to follow them.
+        random = scipy.random.RandomState(0)
+        history = RingBufferHistory(8, 1, capacity=100)
+        for i in xrange(100):
+            history.addSample(random.standard_normal(8), random.randint(4),
+                              random.standard_normal())
+
+        for learnerClass in [TDLearner, LSTDLearner]:
+            thetas = []
+            for batchFeature in [False, True]:
+                policy = BoltzmanPolicy(4, 2, [0.4, 1.1])
+                module = PolicyFeatureModule(policy, 'policywrapper')
+                learner = learnerClass(module=module, cssinitial=0.1,
+                                       cssdecay=1000, assinitial=0.1,
+                                       assdecay=1000, rdecay=0.95,
+                                       maxcriticnorm=100, tracestepsize=0.5)
+                learner.batchFeature = batchFeature
+                learner.learnOnDataSet(history, 0, 60)
+                learner.learnOnDataSet(history, 60, 100)
+                thetas.append(policy.theta.copy())
+            self.assertTrue(abs(thetas[0] - [0.4, 1.1]).max() > 1e-3)
+            assert_array_almost_equal(thetas[0], thetas[1], decimal=10)
+
     def testActor(self):
         learner = TDLearner(module=self.module,
                             cssinitial=1,
@@ -1,8 +1,12 @@
 import copy
 import scipy
-from scipy import array, exp, zeros, arange, dot, eye
+from scipy import array, exp, zeros, arange, dot, eye, ravel
+# scipy.log is the scimath version, which checks every input for negative
+# values. The inputs here are sums of exponentials.
+from numpy import log
 
-from librl.util import encodeTriuAs1DArray,decode1DArrayAsSymMat
+from librl.util import encodeTriuAs1DArray,decode1DArrayAsSymMat, \
+    getTriuIndexTables
 from pybrain.structure.modules.module import Module
 from pybrain.structure.parametercontainer import ParameterContainer
 from pybrain.utilities import abstractMethod
@@ -30,6 +34,8 @@ class BoltzmanPolicy(Module, ParameterContainer, PolicyInterface):
                 theta_1 * E{safety( f(x,u_i) )} +
                 theta_2 * E{progress( f(x,u_i) )} )
     """
+    # methods timed by librl.profiler.PhaseProfiler.
+    profiledPhases = {'sampleAction': 'policy'}
 
     def __init__(self, actionnum, T, theta, **args):
         self.feadim = len(theta)
@@ -43,7 +49,8 @@ class BoltzmanPolicy(Module, ParameterContainer, PolicyInterface):
         self.theta = theta
         self.actionnum = actionnum
 
-        self.cachedActionProb = None
+        # (features, theta, stats) of the last call to getActionStats.
+        self._actionStatsCache = None
 
     def get_theta(self): return self._params
     def set_theta(self, val): self._setParameters(val)
@@ -53,34 +60,72 @@ class BoltzmanPolicy(Module, ParameterContainer, PolicyInterface):
     def _forwardImplementation(self, inbuf, outbuf):
         """ take observation as input, the output is the action
         """
-        action_prob = self._getActionProb(self.obs2fea(inbuf), self.theta)
+        outbuf[0] = self.sampleAction(inbuf)
+
+    def sampleAction(self, obs):
+        """Sample an action for the observation. It is the same as
+        activate(obs)[0], but doesn't go through the buffers of Module. The
+        action probability comes from getActionStats, so the learner reuses
+        it for the same features."""
+        action_prob = self.getActionStats(self.obs2fea(obs))[0]
         assert self.actionnum == len(action_prob), ('wrong number of ',
                                                      'action in policy')
-        action = scipy.random.choice(range(self.actionnum), p=action_prob)
-        outbuf[0] = action
+        # Same draw as scipy.random.choice(range(n), p=action_prob), without
+        # re-validating the probability vector on every step.
+        cdf = scipy.cumsum(action_prob)
+        cdf /= cdf[-1]
+        return cdf.searchsorted(scipy.random.random_sample(), side='right')
 
     @staticmethod
     def getActionScore(score, theta, T):
         """Calculate the total score for a control. It is the exp of the
         weighted sum of different features.
         """
-        perfer = sum( s * t for s, t in zip(score, theta) )
-        return float(exp(perfer/T))
+        return float(exp(dot(score, ravel(theta)) / T))
+
+    def _getActionLogProb(self, feaList, theta):
+        """Calculate the log of the Action Probability for each control.
+        The normalization uses the log-sum-exp trick, so large |theta| / T
+        doesn't overflow.
+        """
+        scores = dot(scipy.asarray(feaList, dtype=float), ravel(theta)) / self.T
+        scores -= scores.max()
+        return scores - log(scipy.sum(exp(scores)))
 
     def _getActionProb(self, feaList, theta):
         """Calculate the Action Probability for each control.
         *feaList* is a list container different feature
         *theta* is the weight for each feature
         """
-        scores = scipy.zeros(len(feaList))
-        for i, feature in enumerate(feaList):
-            scores[i] = self.getActionScore(feature, theta, self.T)
+        return exp(self._getActionLogProb(feaList, theta))
 
-        return scores / scipy.sum(scores)
+    def getActionStats(self, feaList):
+        """Calculate (action_prob, log_action_prob, g) in one pass, where g is
+        the expected feature under the current policy.
+
+        The result of the last call is reused as long as the features and
+        theta don't change, so _forwardImplementation, calBasisFuncVal and
+        calSecondBasisFuncVal share a single evaluation. The returned arrays
+        must not be modified.
+        """
+        feaMat = scipy.asarray(feaList, dtype=float)
+        theta = self.theta
+        cache = self._actionStatsCache
+        if (cache is not None and scipy.array_equal(cache[0], feaMat) and
+                scipy.array_equal(cache[1], theta)):
+            return cache[2]
+
+        log_action_prob = self._getActionLogProb(feaMat, theta)
+        action_prob = exp(log_action_prob)
+        g = dot(action_prob, feaMat)
+        stats = (action_prob, log_action_prob, g)
+        self._actionStatsCache = (feaMat.copy(), array(theta, dtype=float),
+                                  stats)
+        return stats
 
     def getActionValues(self, obs):
         """extract features from observation and call _getActionProb"""
-        return array(self._getActionProb(self.obs2fea(obs), self.theta))
+        return array(self.getActionStats(self.obs2fea(obs))[0])
 
     def obs2fea(self, obs):
         """observation to feature list"""
@@ -108,10 +153,8 @@ class BoltzmanPolicy(Module, ParameterContainer, PolicyInterface):
 
             Basis Function Value: is the first order derivative of the log of the policy.
         """
-        feaMat = scipy.array(feaList)
-        action_prob = self._getActionProb(feaList, self.theta)
-        self.cachedActionProb = action_prob
-        self.g = scipy.dot(action_prob, feaMat)
+        feaMat = scipy.asarray(feaList, dtype=float)
+        self.g = self.getActionStats(feaMat)[2]
         self.bf = feaMat - self.g
         return self.bf
 
@@ -119,19 +162,71 @@ class BoltzmanPolicy(Module, ParameterContainer, PolicyInterface):
         """ calculate \nab^2 log(\mu)
         Please see https://goo.gl/PRnu58 for mathematical deduction.
         """
-        feaMat = scipy.array(feaList)
-        # We assume second order basis calculation followe first order basis
-        # calculation, so we just use the cachedActionProb.
-        if self.cachedActionProb is not None:
-            action_prob = self.cachedActionProb
-            self.cachedActionProb = None
-        else:
-            action_prob = self._getActionProb(feaList, self.theta)
+        feaMat = scipy.asarray(feaList, dtype=float)
+        # When called after calBasisFuncVal with the same features, the action
+        # probability and g are reused from getActionStats.
+        action_prob, _, g = self.getActionStats(feaMat)
         mat1 = scipy.dot(feaMat.T * action_prob, feaMat)
-        tmp = scipy.dot(feaMat.T, action_prob)
-        log_likelihood_hessian = -1 * mat1 + scipy.outer(tmp, tmp.T)
+        log_likelihood_hessian = -1 * mat1 + scipy.outer(g, g)
         return log_likelihood_hessian
 
+    ## Batch API. These functions evaluate the policy on N observations at
+    ## once without going through the buffers of Module.activate. *feaTensor*
+    ## is an (N, actionnum, feadim) array, or an (N, actionnum * feadim)
+    ## array of observations.
+    def batchObs2fea(self, obs):
+        """observations to an (N, actionnum, feadim) feature tensor. It is the
+        batch version of obs2fea, subclasses with other observations must
+        override it."""
+        obs = scipy.asarray(obs, dtype=float)
+        assert obs.shape[1:] in [(self.actionnum * self.feadim,),
+                                 (self.actionnum, self.feadim)], \
+            'invalid observations of shape %s' % (obs.shape,)
+        return obs.reshape(-1, self.actionnum, self.feadim)
+
+    def getBatchActionStats(self, feaTensor):
+        """Batch version of getActionStats. Return (action_prob,
+        log_action_prob, g) whose shapes are (N, actionnum), (N, actionnum)
+        and (N, feadim).
+        """
+        feaTensor = self.batchObs2fea(feaTensor)
+        scores = dot(feaTensor, ravel(self.theta)) / self.T
+        scores -= scores.max(axis=1)[:, None]
+        log_action_prob = scores - log(scipy.sum(exp(scores), axis=1))[:, None]
+        action_prob = exp(log_action_prob)
+        g = scipy.einsum('na,naf->nf', action_prob, feaTensor)
+        return action_prob, log_action_prob, g
+
+    def getBatchActionProb(self, feaTensor):
+        """action probabilities of all N observations, an (N, actionnum)
+        array"""
+        return self.getBatchActionStats(feaTensor)[0]
+
+    def sampleBatchActions(self, feaTensor):
+        """sample one action for each of the N observations"""
+        action_prob = self.getBatchActionProb(feaTensor)
+        cdf = scipy.cumsum(action_prob, axis=1)
+        cdf /= cdf[:, -1:]
+        u = scipy.random.random_sample((len(cdf), 1))
+        actions = scipy.sum(cdf <= u, axis=1)
+        return scipy.minimum(actions, self.actionnum - 1)
+
+    def calBatchBasisFuncVal(self, feaTensor):
+        """Batch version of calBasisFuncVal, the output is an (N, actionnum,
+        feadim) array"""
+        feaTensor = self.batchObs2fea(feaTensor)
+        g = self.getBatchActionStats(feaTensor)[2]
+        return feaTensor - g[:, None, :]
+
+    def calBatchSecondBasisFuncVal(self, feaTensor):
+        """Batch version of calSecondBasisFuncVal, the output is an (N, feadim,
+        feadim) array"""
+        feaTensor = self.batchObs2fea(feaTensor)
+        action_prob, _, g = self.getBatchActionStats(feaTensor)
+        mat1 = scipy.einsum('na,naf,nag->nfg', action_prob, feaTensor,
+                            feaTensor)
+        return -1 * mat1 + g[:, :, None] * g[:, None, :]
+
 
 class PolicyFeatureModule(Module):
     """Module to calculate features for state-action value function approximiation.
@@ -140,6 +235,16 @@ class PolicyFeatureModule(Module):
     Output: a vector of features which is used for approximate state-action
     value function.
     """
+    # Compute the first and second order features with the fused kernel in
+    # _fusedForward instead of calling the constructors in the feature
+    # descriptor one by one. None means that it is used unless a subclass
+    # overrides getFeatureDescriptor or _forwardImplementation.
+    fusedKernel = None
+    # methods timed by librl.profiler.PhaseProfiler. The features computed
+    # by activate are timed by the learner.
+    profiledPhases = {'prepareBatch': 'feature',
+                      'activatePrepared': 'feature'}
+
     def __init__(self, policy, name=None):
         self.policy = policy
         self.paramdim = policy.feadim
@@ -154,6 +259,22 @@ class PolicyFeatureModule(Module):
             name = name
         )
 
+        if self.fusedKernel is None:
+            self.fusedKernel = self._hasDefaultFeatures()
+        if self.fusedKernel:
+            n = self.paramdim
+            self._weightedFeaBuf = zeros((n, self.actionnum))
+            self._hessianBuf = zeros((n, n))
+            self._outerBuf = zeros((n, n))
+
+    def _hasDefaultFeatures(self):
+        """Whether the features are the ones of PolicyFeatureModule"""
+        cls = type(self)
+        return all(getattr(cls, name).im_func is
+                   getattr(PolicyFeatureModule, name).im_func
+                   for name in ['getFeatureDescriptor',
+                                '_forwardImplementation'])
+
     def _transformFeatureDescriptor(self, feadesc):
         # parse feature descriptor.
         bd = [0] # boundary
@@ -172,16 +293,23 @@ class PolicyFeatureModule(Module):
             newfeadesc[name] = desc
         return newfeadesc, outdim
 
-    def decodeFeature(self, feature, name):
+    def decodeFeature(self, feature, name, out=None):
+        """Decode the feature called *name*. If *out* is provided, the decoded
+        feature is written to it."""
         decoder = self.feadesc[name].get('decoder', self._identityDecoder)
         r = self.feadesc[name]['fea_range']
         feature = feature[r[0]:r[1]]
-        return decoder(feature)
+        if out is None:
+            return decoder(feature)
+        return decoder(feature, out=out)
 
     # the default decoder.
     @staticmethod
-    def _identityDecoder(feature):
-        return feature
+    def _identityDecoder(feature, out=None):
+        if out is None:
+            return feature
+        out[:] = feature
+        return out
 
     def getFeatureDescriptor(self):
         # first order feature
@@ -197,10 +325,10 @@ class PolicyFeatureModule(Module):
             hessian = policy.calSecondBasisFuncVal(feature)
             return encodeTriuAs1DArray(hessian)
 
-        def _secondOrderFeatureDecoder(feature):
+        def _secondOrderFeatureDecoder(feature, out=None):
             assert sofl == len(feature), ('invalid feature'
                                           'to decode')
-            return decode1DArrayAsSymMat(feature, self.paramdim)
+            return decode1DArrayAsSymMat(feature, self.paramdim, out=out)
 
         return [
             {
@@ -225,12 +353,78 @@ class PolicyFeatureModule(Module):
     def _forwardImplementation(self, inbuf, outbuf):
         fea = self.policy.obs2fea(inbuf[:-1])
         action = inbuf[-1]
+        if self.fusedKernel:
+            self._fusedForward(fea, action, outbuf)
+            return
+
         offset = 0
         for name, desc in self.feadesc.iteritems():
             fearange = desc ['fea_range']
             outbuf[fearange[0]:fearange[1]] = desc['constructor'](self.policy,
                                                            fea, action)
 
+    def _fusedForward(self, fea, action, outbuf):
+        """Compute the first order feature and the packed upper-triangular
+        part of the second order feature in one pass. The action probability
+        is evaluated once and intermediate results are kept in preallocated
+        buffers."""
+        action_prob, _, g = self.policy.getActionStats(fea)
+
+        r = self.feadesc['first_order']['fea_range']
+        scipy.subtract(fea[int(action)], g, out=outbuf[r[0]:r[1]])
+
+        # hessian = outer(g, g) - fea' * diag(action_prob) * fea
+        hessian = self._hessianBuf
+        scipy.multiply(fea.T, action_prob, out=self._weightedFeaBuf)
+        dot(self._weightedFeaBuf, fea, out=hessian)
+        scipy.multiply(g[:, None], g[None, :], out=self._outerBuf)
+        scipy.subtract(self._outerBuf, hessian, out=hessian)
+
+        r = self.feadesc['second_order']['fea_range']
+        encodeTriuAs1DArray(hessian, out=outbuf[r[0]:r[1]])
+
+    def prepareBatch(self, obs, actions):
+        """Precompute the parts of the features of N (obs, action) pairs that
+        don't depend on the policy parameters, i.e., the feature tensor, the
+        rows of the chosen actions and the packed outer products of the rows.
+        activatePrepared then computes the features one by one with the
+        current parameters."""
+        obs = scipy.asarray(obs, dtype=float)
+        actions = scipy.asarray(actions).reshape(-1)
+        if not self.fusedKernel:
+            return obs, actions
+
+        fea = self.policy.batchObs2fea(obs)
+        chosen = fea[arange(len(actions)), actions.astype(int)]
+        iu = getTriuIndexTables(self.paramdim)[0]
+        outer = fea[:, :, iu[0]] * fea[:, :, iu[1]]
+        return fea, chosen, outer
+
+    def activatePrepared(self, prepared, n):
+        """Feature of the n-th pair of prepareBatch with the current
+        parameters. It is the same as activate on the n-th pair, up to
+        rounding."""
+        if not self.fusedKernel:
+            obs, actions = prepared
+            inpt = zeros((self.indim,))
+            inpt[:-1] = obs[n]
+            inpt[-1] = actions[n]
+            return self.activate(inpt).copy()
+
+        fea, chosen, outer = prepared
+        feature = zeros((self.outdim,))
+        action_prob, _, g = self.policy.getActionStats(fea[n])
+        r = self.feadesc['first_order']['fea_range']
+        scipy.subtract(chosen[n], g, out=feature[r[0]:r[1]])
+
+        # packed outer(g, g) - fea' * diag(action_prob) * fea
+        iu = getTriuIndexTables(self.paramdim)[0]
+        r = self.feadesc['second_order']['fea_range']
+        second = feature[r[0]:r[1]]
+        scipy.multiply(g[iu[0]], g[iu[1]], out=second)
+        second -= dot(action_prob, outer[n])
+        return feature
+
     def get_theta(self): return self.policy.theta.reshape(-1)
     def set_theta(self, val): self.policy._setParameters(val.reshape(-1))
     theta = property(fget = get_theta, fset = set_theta)
@@ -246,6 +440,7 @@ class PolicyValueFeatureModule(PolicyFeatureModule):
     created by padding state feature with zeros. See pg. 29 of
     https://webdocs.cs.ualberta.ca/~sutton/papers/BSGL-TR.pdf
     """
+
     def getFeatureDescriptor(self):
         assert self.paramdim % self.actionnum == 0, 'wrong module is used!'
         self.statefeadim = int(self.paramdim / self.actionnum)
@@ -278,16 +473,24 @@ class GLFWSBoltzmanPolicy(BoltzmanPolicy):
         Module.__init__(self, self.feadim * (self.actionnum + 1), 1, *args,
                         **kwargs)
 
-    def _forwardImplementation(self, inbuf, outbuf):
+    def sampleAction(self, obs):
         """ take observation as input, the output is the action
         """
-        obs = inbuf[:(self.feadim * self.actionnum)]
-        super(GLFWSBoltzmanPolicy, self)._forwardImplementation(obs, outbuf)
+        obs = obs[:(self.feadim * self.actionnum)]
+        return super(GLFWSBoltzmanPolicy, self).sampleAction(obs)
+
+    def batchObs2fea(self, obs):
+        """the state feature at the end of the observations is dropped"""
+        obs = scipy.asarray(obs, dtype=float)
+        if obs.ndim == 2:
+            obs = obs[:, :(self.feadim * self.actionnum)]
+        return super(GLFWSBoltzmanPolicy, self).batchObs2fea(obs)
 
 
 class GLFWSPolicyFeatureModule(PolicyFeatureModule):
     """Feature module for GarnetLookForwardWithStateObsTask
     """
+
     def __init__(self, policy, name=None):
         self.policy = policy
         self.paramdim = policy.feadim
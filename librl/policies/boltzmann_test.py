@@ -1,5 +1,6 @@
 from __future__ import print_function, division, absolute_import
-from .boltzmann import BoltzmanPolicy
+from .boltzmann import BoltzmanPolicy, PolicyFeatureModule, \
+    PolicyValueFeatureModule, GLFWSBoltzmanPolicy
 
 import unittest
 import scipy
@@ -60,6 +61,137 @@ class BoltzmanPolicyTestCase(unittest.TestCase):
             self.assertTrue(ap[1] > ap[3])
             self.assertEqual(ap[0], ap[2])
 
+    def testGetActionProbLargeTheta(self):
+        # exp(1e4) overflows without the log-sum-exp normalization.
+        theta = scipy.array([1e4, 1e4])
+        ap = self.policy._getActionProb(self.features, theta)
+        self.assertFalse(scipy.any(scipy.isnan(ap)))
+        assert_array_almost_equal([0, 0, 0, 1], ap)
+
+    def testGetActionStats(self):
+        prob, logprob, g = self.policy.getActionStats(self.features)
+        assert_array_almost_equal([0.3001868638, 0.352272548, 0.2597981959,
+                                   0.08774239221], prob)
+        assert_array_almost_equal(scipy.log(prob), logprob)
+        assert_array_almost_equal(scipy.dot(prob, self.features), g)
+
+        # the cached result must not be reused once theta changes.
+        self.policy.theta = scipy.array([0.0, 0.0])
+        prob, _, _ = self.policy.getActionStats(self.features)
+        assert_array_almost_equal([0.25] * 4, prob)
+
+    def testBatchObs2fea(self):
+        obs = scipy.array([self.policy.fea2obs(self.features)] * 2)
+        assert_array_almost_equal([self.features] * 2,
+                                  self.policy.batchObs2fea(obs))
+        self.assertRaises(AssertionError, self.policy.batchObs2fea,
+                          scipy.zeros((2, 10)))
+
+        # the observations of GLFWSBoltzmanPolicy end with the state feature.
+        policy = GLFWSBoltzmanPolicy(4, T=2, theta=self.theta)
+        obs = scipy.hstack((obs, [[1, 2], [3, 4]]))
+        assert_array_almost_equal(
+            [self.policy.getActionStats(self.features)[0]] * 2,
+            policy.getBatchActionProb(obs))
+
+    def testSampleActionSharesStats(self):
+        self.policy.sampleAction(self.policy.fea2obs(self.features))
+        stats = self.policy._actionStatsCache[2]
+        # the learner reuses the evaluation of the forward pass.
+        self.assertTrue(stats is self.policy.getActionStats(self.features))
+        self.policy.calBasisFuncVal(self.features)
+        self.assertTrue(stats is self.policy.getActionStats(self.features))
+
+    def testBatchAPI(self):
+        features2 = scipy.array([
+            (0.1, 0.1),
+            (0.2, 0.2),
+            (0.3, -0.3),
+            (0.4, 0.4)
+        ])
+        feaTensor = scipy.array([self.features, features2])
+        prob = self.policy.getBatchActionProb(feaTensor)
+        bf = self.policy.calBatchBasisFuncVal(feaTensor)
+        hessian = self.policy.calBatchSecondBasisFuncVal(feaTensor)
+        for i, fea in enumerate(feaTensor):
+            assert_array_almost_equal(
+                self.policy._getActionProb(fea, self.theta), prob[i])
+            assert_array_almost_equal(self.policy.calBasisFuncVal(fea),
+                                      bf[i])
+            assert_array_almost_equal(self.policy.calSecondBasisFuncVal(fea),
+                                      hessian[i])
+
+        # observations can also be given as flat vectors.
+        obs = feaTensor.reshape(2, -1)
+        assert_array_almost_equal(prob, self.policy.getBatchActionProb(obs))
+
+    def testSampleBatchActions(self):
+        # the single observation version draws the same action with the same
+        # seed.
+        scipy.random.seed(0)
+        feaTensor = scipy.array([self.features] * 3)
+        actions = self.policy.sampleBatchActions(feaTensor)
+        self.assertEqual((3,), actions.shape)
+        self.assertTrue(scipy.all((actions >= 0) & (actions < 4)))
+
+        scipy.random.seed(0)
+        action = self.policy.sampleAction(self.policy.fea2obs(self.features))
+        self.assertEqual(action, actions[0])
+
+
+class PolicyFeatureModuleTestCase(unittest.TestCase):
+    def setUp(self):
+        self.policy = BoltzmanPolicy(actionnum=4, T=2, theta=[0.4, 1.1])
+        self.module = PolicyFeatureModule(self.policy, 'policywrapper')
+        self.features = scipy.array([
+            (0.6, 0.2),
+            (0.3, 0.6),
+            (0.4, 0.01),
+            (50, -20)
+        ])
+
+    def testFusedKernel(self):
+        for action in xrange(4):
+            inpt = scipy.concatenate((self.features.reshape(-1), [action]))
+            self.module.fusedKernel = True
+            fused = self.module.activate(inpt)
+            self.module.fusedKernel = False
+            expected = self.module.activate(inpt)
+            assert_array_almost_equal(expected, fused)
+
+        assert_array_almost_equal(
+            [45.22316723, -18.51915104],
+            self.module.decodeFeature(fused, 'first_order'))
+        assert_array_almost_equal(
+            [[-196.7191887, 80.56815369],
+             [80.56815369, -33.04289481]],
+            self.module.decodeFeature(fused, 'second_order'))
+
+    def testFusedKernelOnlyForDefaultFeatures(self):
+        class ScaledFeatureModule(PolicyFeatureModule):
+            def _forwardImplementation(self, inbuf, outbuf):
+                PolicyFeatureModule._forwardImplementation(self, inbuf, outbuf)
+                outbuf *= 2
+
+        self.assertTrue(self.module.fusedKernel)
+        self.assertFalse(ScaledFeatureModule(self.policy).fusedKernel)
+        policy = BoltzmanPolicy(actionnum=2, T=2, theta=[0.4, 1.1])
+        self.assertFalse(PolicyValueFeatureModule(policy).fusedKernel)
+
+    def testPrepareBatch(self):
+        obs = scipy.array([self.features.reshape(-1),
+                           self.features[::-1].reshape(-1),
+                           self.features.reshape(-1)])
+        actions = scipy.array([[0], [3], [2]])
+        for fusedKernel in [True, False]:
+            self.module.fusedKernel = fusedKernel
+            prepared = self.module.prepareBatch(obs, actions)
+            for n, (o, a) in enumerate(zip(obs, actions)):
+                # the parameters may change between the pairs.
+                self.policy.theta = [0.4 + 0.1 * n, 1.1]
+                assert_array_almost_equal(
+                    self.module.activate(scipy.concatenate((o, a))),
+                    self.module.activatePrepared(prepared, n))
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,121 @@
+"""Wall time and call counts of the phases of an actor-critic run.
+
+Classes list the methods to time in profiledPhases, a dict from method name to
+phase name, e.g., the tasks map getObservation to 'observation' and the
+learners map critic to 'critic'. PhaseProfiler.attach replaces these methods
+of an instance by timed wrappers, so objects that are not attached run without
+any overhead.
+
+Some phases contain others: 'session' contains everything, 'rollout' is the
+interaction loop of a session and contains 'observation', 'policy',
+'environment' and 'reward', and 'learn' contains 'feature', 'critic' and
+'actor'.
+"""
+from __future__ import print_function, division, absolute_import
+import collections
+import csv
+import sys
+import timeit
+
+class PhaseProfiler(object):
+    """Accumulate wall time and call counts per phase and summarize them per
+    session.
+
+    If *output* is not None, the summary table of every *interval*-th session
+    is printed to it.
+
+    Usage:
+        profiler = PhaseProfiler()
+        experiment.doSessionsAndPrint(sessionNumber, sessionSize,
+                                      profiler=profiler)
+        profiler.saveCsv('phases.csv')
+    """
+    def __init__(self, output=sys.stderr, interval=1):
+        self.output = output
+        self.interval = interval
+        self.times = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        # (phase, calls, seconds) of each finished session.
+        self.sessions = []
+        self.attached = []
+
+    def _wrap(self, method, phase):
+        times, calls = self.times, self.calls
+        timer = timeit.default_timer
+        def wrapper(*args, **kwargs):
+            start = timer()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                times[phase] += timer() - start
+                calls[phase] += 1
+        return wrapper
+
+    def attach(self, obj):
+        """Time the methods of obj listed in its profiledPhases"""
+        phases = getattr(obj, 'profiledPhases', None)
+        if (obj is None or phases is None or
+                any(o is obj for o in self.attached)):
+            return
+        for name, phase in phases.iteritems():
+            setattr(obj, name, self._wrap(getattr(obj, name), phase))
+        self.attached.append(obj)
+
+    def attachExperiment(self, experiment):
+        """Attach the experiment, its task, policy, learner and the feature
+        module of the learner"""
+        learner = getattr(experiment.agent, 'learner', None)
+        for obj in [experiment, experiment.task, experiment.policy, learner,
+                    getattr(learner, 'module', None)]:
+            self.attach(obj)
+
+    def detach(self):
+        """Restore the original methods"""
+        for obj in self.attached:
+            for name in obj.profiledPhases:
+                delattr(obj, name)
+        self.attached = []
+
+    def reset(self):
+        self.times.clear()
+        self.calls.clear()
+
+    def getSummary(self):
+        """(phase, calls, seconds) of the phases since the last reset, sorted
+        by time"""
+        return sorted([(phase, self.calls[phase], seconds)
+                       for phase, seconds in self.times.iteritems()],
+                      key=lambda row: -row[2])
+
+    def formatSummary(self, summary, title=''):
+        total = dict((phase, seconds)
+                     for phase, _, seconds in summary).get('session')
+        lines = ['%s%-12s %10s %12s %12s %8s' % (title, 'phase', 'calls',
+                                                 'total(ms)', 'per call(us)',
+                                                 'session')]
+        for phase, calls, seconds in summary:
+            share = '%7.1f%%' % (100 * seconds / total) if total else ''
+            lines.append('%s%-12s %10d %12.3f %12.3f %8s' %
+                         (' ' * len(title), phase, calls, seconds * 1e3,
+                          seconds / max(calls, 1) * 1e6, share))
+        return '\n'.join(lines)
+
+    def endSession(self):
+        """Store the summary of the finished session and start a new one"""
+        summary = self.getSummary()
+        self.sessions.append(summary)
+        index = len(self.sessions) - 1
+        if self.output is not None and index % self.interval == 0:
+            print(self.formatSummary(summary, 'session %d: ' % index),
+                  file=self.output)
+        self.reset()
+
+    def saveCsv(self, filename):
+        """Write the summaries of the sessions to a csv file with the columns
+        session, phase, calls and seconds"""
+        with open(filename, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(['session', 'phase', 'calls', 'seconds'])
+            for i, summary in enumerate(self.sessions):
+                for phase, calls, seconds in summary:
+                    writer.writerow([i, phase, calls, repr(seconds)])
@@ -0,0 +1,89 @@
+from __future__ import print_function, division, absolute_import
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import scipy
+from numpy.testing import assert_array_equal
+
+from .profiler import PhaseProfiler
+from .testutil import createGarnetExperiment
+
+class MockPhases(object):
+    profiledPhases = {'step': 'step', 'twice': 'step'}
+    def step(self, x):
+        return x + 1
+
+    def twice(self, x):
+        return self.step(self.step(x))
+
+class PhaseProfilerTestCase(unittest.TestCase):
+    def createExperiment(self):
+        scipy.random.seed(0)
+        return createGarnetExperiment()
+
+    def testAttach(self):
+        profiler = PhaseProfiler(output=None)
+        obj = MockPhases()
+        profiler.attach(obj)
+        profiler.attach(obj)
+        self.assertEqual(3, obj.twice(1))
+        self.assertEqual(3, profiler.calls['step'])
+
+        profiler.detach()
+        self.assertEqual([], vars(obj).keys())
+        obj.step(1)
+        self.assertEqual(3, profiler.calls['step'])
+
+    def testExperiment(self):
+        experiment = self.createExperiment()
+        experiment.doSessionsAndPrint(3, 20, customPrinter=lambda: None)
+        expected = experiment.policy.theta.copy()
+
+        experiment = self.createExperiment()
+        profiler = PhaseProfiler(output=None)
+        experiment.doSessionsAndPrint(3, 20, customPrinter=lambda: None,
+                                      profiler=profiler)
+        assert_array_equal(expected, experiment.policy.theta)
+        # the methods are restored after the run.
+        self.assertEqual([], profiler.attached)
+        self.assertFalse('critic' in vars(experiment.agent.learner))
+
+        self.assertEqual(3, len(profiler.sessions))
+        summary = dict((phase, (calls, seconds))
+                       for phase, calls, seconds in profiler.sessions[-1])
+        self.assertEqual(1, summary['session'][0])
+        self.assertEqual(1, summary['rollout'][0])
+        self.assertEqual(1, summary['learn'][0])
+        for phase in ['observation', 'policy', 'environment', 'reward']:
+            self.assertEqual(20, summary[phase][0])
+        for phase in ['critic', 'actor']:
+            self.assertEqual(20, summary[phase][0])
+        self.assertTrue(summary['session'][1] >= summary['rollout'][1])
+
+        dirName = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirName)
+        filename = os.path.join(dirName, 'phases.csv')
+        profiler.saveCsv(filename)
+        with open(filename) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(sum(len(s) for s in profiler.sessions), len(rows))
+        self.assertEqual('0', rows[0]['session'])
+        self.assertEqual('session', rows[0]['phase'])
+
+    def testSlowRollout(self):
+        experiment = self.createExperiment()
+        experiment.fastRollout = False
+        profiler = PhaseProfiler(output=None)
+        experiment.doSessionsAndPrint(2, 20, customPrinter=lambda: None,
+                                      profiler=profiler)
+        summary = dict((phase, (calls, seconds))
+                       for phase, calls, seconds in profiler.sessions[-1])
+        # the interactions of a session are timed as one phase.
+        self.assertEqual(1, summary['rollout'][0])
+        self.assertEqual(20, summary['environment'][0])
+        self.assertTrue(summary['rollout'][1] >= summary['environment'][1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,10 @@
 from __future__ import print_function, division, absolute_import
+import scipy
+from librl.agents.actorcriticagent import ActorCriticAgent
+from librl.environments.garnet import GarnetEnvironment, GarnetLookForwardTask
+from librl.experiments import SessionExperiment
+from librl.learners import TDLearner
+from librl.policies.boltzmann import BoltzmanPolicy, PolicyFeatureModule
 
 class MockPolicyFeatureModule(object):
     def __init__(self, policy):
@@ -9,13 +15,17 @@ class MockPolicyFeatureModule(object):
     def set_theta(self, val): self.policy.theta = val
     theta = property(fget = get_theta, fset = set_theta)
 
-    def decodeFeature(self, feature, name):
+    def decodeFeature(self, feature, name, out=None):
         el = self.outdim * self.outdim + self.outdim
         assert len(feature) == el, 'invalid feature for MockPolicyFeatureModule'
         if name == 'first_order':
-            return feature[:self.outdim]
+            res = feature[:self.outdim]
         else:
-            return feature[self.outdim:].reshape((self.outdim, self.outdim))
+            res = feature[self.outdim:].reshape((self.outdim, self.outdim))
+        if out is None:
+            return res
+        out[...] = res
+        return out
 
 class MockLearner(object):
     def __init__(self, policy):
@@ -31,3 +41,24 @@ class MockPolicy(object):
 
     def activate(self, obs):
         return self.data[obs]
+
+def createGarnetExperiment(learnerClass=TDLearner, batch=True, env=None,
+                           theta=None, feaDim=5, **learnerArgs):
+    """A SessionExperiment on a Garnet problem with 10 states and 3 actions,
+    and a Boltzmann policy that learns with learnerClass. *learnerArgs*
+    overrides the arguments of the learner."""
+    if env is None:
+        env = GarnetEnvironment(numStates=10, numActions=3, branching=2,
+                                feaDim=feaDim, feaSum=2, seed=1)
+    task = GarnetLookForwardTask(env, sigma=0.1, seed=2)
+    if theta is None:
+        theta = scipy.zeros((env.feaDim,))
+    policy = BoltzmanPolicy(3, T=1, theta=theta)
+    module = PolicyFeatureModule(policy, 'policywrapper')
+    kwargs = dict(module=module, cssinitial=0.1, cssdecay=1000,
+                  assinitial=0.1, assdecay=1000, rdecay=0.95,
+                  maxcriticnorm=1000, tracestepsize=0.5)
+    kwargs.update(learnerArgs)
+    learner = learnerClass(**kwargs)
+    agent = ActorCriticAgent(learner, sdim=task.outdim, adim=1, batch=batch)
+    return SessionExperiment(task, agent, policy=policy, batch=batch)
@@ -0,0 +1,224 @@
+"""Binary trace files with typed columns.
+
+A trace file starts with a header, followed by chunks of rows:
+
+    header: MAGIC, version (uint32), length of the schema (uint32), schema
+            as json, i.e., a list of [column name, dtype string]
+    chunk:  # of rows (uint64), then the values of each column stored
+            contiguously in the order of the schema
+
+The header and every column are padded to a multiple of 8 bytes. A chunk
+that is cut short, e.g., because the writer is killed, is ignored by the
+reader, and dropped by a writer that appends to the file.
+"""
+from __future__ import print_function, division, absolute_import
+import json
+import os
+import struct
+import scipy
+from .util import cPrint
+
+MAGIC = b'LIBRLTRC'
+VERSION = 1
+ALIGNMENT = 8
+
+def _padding(size):
+    return (-size) % ALIGNMENT
+
+def isTraceFile(filename):
+    """Whether filename is a binary trace file"""
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+class TraceWriter(object):
+    """Write records with the same fields to a binary trace file.
+
+    The values are kept in preallocated column buffers and written as one
+    chunk every chunkSize records. *columns* is a list of (name, dtype). If it
+    is None, the columns are the sorted fields of the first record, stored as
+    float64. Integers are not inferred from the first record, because a field
+    that starts as an int, e.g., a reward sum that starts at 0, may hold
+    fractions later; declare integer columns in *columns* instead. If *echo*
+    is True, every record is printed with cPrint as well.
+
+    If *append* is True and filename is a trace file, the records are added
+    after the ones in the file, and truncate can drop the records after a
+    given one, e.g., the ones written after the snapshot a run resumes from.
+
+    Usage:
+        with TraceWriter('run.trace') as trace:
+            trace.write(iteration=i, reward=reward)
+    """
+    def __init__(self, filename, columns=None, chunkSize=4096, echo=False,
+                 append=False):
+        self.filename = filename
+        self.chunkSize = chunkSize
+        self.echo = echo
+        self.append = append
+        self.columns = None
+        if append and os.path.isfile(filename) and os.path.getsize(filename):
+            reader = TraceReader(filename)
+            if columns is not None and ([(str(name), scipy.dtype(dtype))
+                                         for name, dtype in columns] !=
+                                        reader.columns):
+                raise ValueError('the columns of %s are %s' %
+                                 (filename, reader.columns))
+            columns, end = reader.columns, reader.end
+            del reader
+            self.file = open(filename, 'r+b')
+            # drop a chunk that is cut short.
+            self.file.truncate(end)
+            self.file.seek(end)
+            self._setColumns(columns, writeHeader=False)
+        else:
+            self.file = open(filename, 'wb')
+            if columns is not None:
+                self._setColumns(columns)
+
+    def _setColumns(self, columns, writeHeader=True):
+        self.columns = [(str(name), scipy.dtype(dtype))
+                        for name, dtype in columns]
+        self.buffers = [scipy.zeros((self.chunkSize,), dtype=dtype)
+                        for _, dtype in self.columns]
+        self.size = 0
+        if not writeHeader:
+            return
+
+        schema = json.dumps([[name, dtype.str]
+                             for name, dtype in self.columns]).encode('utf-8')
+        schema += b' ' * _padding(len(MAGIC) + 8 + len(schema))
+        self.file.write(MAGIC)
+        self.file.write(struct.pack('<II', VERSION, len(schema)))
+        self.file.write(schema)
+
+    def write(self, **kwargs):
+        if self.columns is None:
+            self._setColumns([(name, scipy.float64)
+                              for name in sorted(kwargs)])
+        assert len(kwargs) == len(self.columns), ('the fields should be %s'
+                                                  % [c[0] for c in
+                                                     self.columns])
+        for (name, _), buf in zip(self.columns, self.buffers):
+            buf[self.size] = kwargs[name]
+        self.size += 1
+        if self.size == self.chunkSize:
+            self.flush()
+        if self.echo:
+            cPrint(**kwargs)
+
+    def flush(self):
+        """Write the buffered records as a chunk"""
+        if self.columns is None or self.size == 0:
+            return
+        self.file.write(struct.pack('<Q', self.size))
+        for buf in self.buffers:
+            data = buf[:self.size].tostring()
+            self.file.write(data)
+            self.file.write(b'\0' * _padding(len(data)))
+        self.file.flush()
+        self.size = 0
+
+    def truncate(self, rows):
+        """Keep the first *rows* records and drop the others"""
+        self.flush()
+        if self.columns is None:
+            if rows > 0:
+                raise ValueError('%s has no records' % self.filename)
+            return
+        reader = TraceReader(self.filename)
+        if rows > len(reader):
+            raise ValueError('%s has only %d records' % (self.filename,
+                                                         len(reader)))
+        # the chunk that holds record *rows* is moved back to the buffers.
+        first = 0
+        offset = reader.end
+        for i, start in enumerate(reader.offsets):
+            size = len(reader.chunks[i][self.columns[0][0]])
+            if first + size > rows:
+                for (name, _), buf in zip(self.columns, self.buffers):
+                    buf[:(rows - first)] = reader.chunks[i][name][:(rows -
+                                                                    first)]
+                self.size = rows - first
+                offset = start
+                break
+            first += size
+        # release the memory map before the file is cut.
+        del reader
+        self.file.truncate(offset)
+        self.file.seek(offset)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TraceReader(object):
+    """Read a trace file written by TraceWriter. The file is memory-mapped,
+    so the chunks are not copied until they are concatenated by getColumn.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.data = scipy.memmap(filename, dtype=scipy.uint8, mode='r')
+        if self.data[:len(MAGIC)].tostring() != MAGIC:
+            raise ValueError('%s is not a trace file' % filename)
+        version, schemaLength = struct.unpack(
+            '<II', self.data[len(MAGIC):(len(MAGIC) + 8)].tostring())
+        if version != VERSION:
+            raise ValueError('unsupported trace version %s in %s' %
+                             (version, filename))
+        offset = len(MAGIC) + 8
+        schema = json.loads(
+            self.data[offset:(offset + schemaLength)].tostring().decode('utf-8'))
+        self.columns = [(str(name), scipy.dtype(str(dtype)))
+                        for name, dtype in schema]
+        self.names = [name for name, _ in self.columns]
+        self.chunks = self._scanChunks(offset + schemaLength)
+
+    def _scanChunks(self, offset):
+        """Locate the chunks. Each chunk is a dict from column name to a view
+        of the file. The chunks start at the positions in self.offsets and
+        the last one ends at self.end."""
+        chunks = []
+        self.offsets = []
+        self.end = offset
+        end = len(self.data)
+        while offset + 8 <= end:
+            rows, = struct.unpack('<Q',
+                                  self.data[offset:(offset + 8)].tostring())
+            position = offset + 8
+            chunk = dict()
+            for name, dtype in self.columns:
+                size = rows * dtype.itemsize
+                if position + size > end:
+                    return chunks
+                chunk[name] = self.data[position:(position + size)].view(dtype)
+                position += size + _padding(size)
+            chunks.append(chunk)
+            self.offsets.append(offset)
+            offset = self.end = position
+        return chunks
+
+    def __len__(self):
+        return sum(len(chunk[self.names[0]]) for chunk in self.chunks)
+
+    def getChunks(self, name):
+        """memory-mapped views of the column in every chunk"""
+        return [chunk[name] for chunk in self.chunks]
+
+    def getColumn(self, name):
+        """all the values of the column as one array"""
+        chunks = self.getChunks(name)
+        if not chunks:
+            return scipy.zeros((0,), dtype=dict(self.columns)[name])
+        if len(chunks) == 1:
+            return chunks[0]
+        return scipy.concatenate(chunks)
+
+    def __getitem__(self, name):
+        return self.getColumn(name)
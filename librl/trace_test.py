@@ -0,0 +1,103 @@
+from __future__ import print_function, division, absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import scipy
+from numpy.testing import assert_array_almost_equal
+
+from .trace import TraceWriter, TraceReader, isTraceFile
+
+class TraceTestCase(unittest.TestCase):
+    def setUp(self):
+        dirName = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirName)
+        self.filename = os.path.join(dirName, 'run.trace')
+
+    def testWriteAndRead(self):
+        with TraceWriter(self.filename, chunkSize=3) as trace:
+            for i in xrange(8):
+                trace.write(iteration=i, reward=i / 2, th_max=scipy.float64(i))
+        self.assertTrue(isTraceFile(self.filename))
+
+        reader = TraceReader(self.filename)
+        self.assertEqual(['iteration', 'reward', 'th_max'], reader.names)
+        self.assertEqual(8, len(reader))
+        self.assertEqual(3, len(reader.chunks))
+        self.assertEqual(scipy.float64, reader['iteration'].dtype)
+        assert_array_almost_equal(scipy.arange(8), reader['iteration'])
+        assert_array_almost_equal(scipy.arange(8) / 2, reader['reward'])
+        assert_array_almost_equal(scipy.arange(8), reader['th_max'])
+        self.assertTrue(isinstance(reader.getChunks('reward')[0],
+                                   scipy.memmap))
+
+    def testMixedIntAndFloat(self):
+        # the first value of a field doesn't fix an integer type.
+        with TraceWriter(self.filename) as trace:
+            trace.write(iteration=0, reward=0)
+            trace.write(iteration=1, reward=0.75)
+        reader = TraceReader(self.filename)
+        assert_array_almost_equal([0, 0.75], reader['reward'])
+        assert_array_almost_equal([0, 1], reader['iteration'])
+
+    def testColumns(self):
+        trace = TraceWriter(self.filename, columns=[('a', scipy.int32),
+                                                    ('b', scipy.float32)])
+        trace.write(a=1, b=0.5)
+        trace.close()
+        reader = TraceReader(self.filename)
+        self.assertEqual(scipy.int32, reader['a'].dtype)
+        assert_array_almost_equal([0.5], reader['b'])
+
+    def testTruncatedChunk(self):
+        with TraceWriter(self.filename, chunkSize=2) as trace:
+            for i in xrange(4):
+                trace.write(reward=float(i))
+        size = os.path.getsize(self.filename)
+        with open(self.filename, 'r+b') as f:
+            f.truncate(size - 4)
+        reader = TraceReader(self.filename)
+        assert_array_almost_equal([0, 1], reader['reward'])
+
+    def testAppend(self):
+        with TraceWriter(self.filename, chunkSize=2) as trace:
+            for i in xrange(5):
+                trace.write(reward=float(i))
+        # the last chunk is cut short and dropped.
+        size = os.path.getsize(self.filename)
+        with open(self.filename, 'r+b') as f:
+            f.truncate(size - 4)
+        with TraceWriter(self.filename, chunkSize=2, append=True) as trace:
+            trace.write(reward=5.0)
+        assert_array_almost_equal([0, 1, 2, 3, 5],
+                                  TraceReader(self.filename)['reward'])
+        self.assertRaises(ValueError, TraceWriter, self.filename,
+                          columns=[('reward', scipy.int32)], append=True)
+
+    def testTruncate(self):
+        trace = TraceWriter(self.filename, chunkSize=3, append=True)
+        for i in xrange(8):
+            trace.write(reward=float(i))
+        # record 4 is in the middle of the second chunk.
+        trace.truncate(4)
+        trace.write(reward=10.0)
+        trace.truncate(5)
+        trace.close()
+        assert_array_almost_equal([0, 1, 2, 3, 10],
+                                  TraceReader(self.filename)['reward'])
+
+        trace = TraceWriter(self.filename, chunkSize=3, append=True)
+        self.assertRaises(ValueError, trace.truncate, 6)
+        trace.truncate(3)
+        trace.close()
+        assert_array_almost_equal([0, 1, 2],
+                                  TraceReader(self.filename)['reward'])
+
+    def testNotTraceFile(self):
+        with open(self.filename, 'w') as f:
+            f.write('iteration:0,reward:1.0\n')
+        self.assertFalse(isTraceFile(self.filename))
+        self.assertRaises(ValueError, TraceReader, self.filename)
+
+if __name__ == '__main__':
+    unittest.main()
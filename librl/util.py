@@ -102,27 +102,195 @@ def zload(f_name):
     f.close()
     return obj
 
+import os.path
+import scipy
+def zcache(f_name, func):
+    """Load the object stored in f_name if the file exists. Otherwise, call
+    func() and store its result in f_name. func() is always called if f_name
+    is None. The caller is responsible for using a different f_name when the
+    inputs of func change."""
+    if f_name is None:
+        return func()
+    if os.path.isfile(f_name):
+        return zload(f_name)
+    obj = func()
+    zdump(obj, f_name)
+    return obj
+
+import json
+import os
+arrayStoreVersion = 1
+def adump(arrays, dir_name, header=None):
+    """Store a dict of arrays as uncompressed .npy files in directory dir_name.
+    A small json header with the names of the arrays and the optional *header*
+    dict is stored in dir_name/header.json.
+
+    Unlike zdump, the arrays can be memory-mapped by aload, so processes that
+    load the same arrays share one copy in the page cache."""
+    if not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+    for name, arr in arrays.iteritems():
+        scipy.save(os.path.join(dir_name, name + '.npy'),
+                   scipy.asarray(arr))
+    meta = {'version': arrayStoreVersion,
+            'arrays': sorted(arrays.keys()),
+            'header': header if header is not None else dict()}
+    with open(os.path.join(dir_name, 'header.json'), 'w') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+
+def aload(dir_name, mmap_mode='r'):
+    """Load arrays stored by adump. Return a tuple (header, arrays). The arrays
+    are memory-mapped with *mmap_mode* ('r' by default, use None to read them
+    into memory)."""
+    with open(os.path.join(dir_name, 'header.json')) as f:
+        meta = json.load(f)
+    if meta['version'] != arrayStoreVersion:
+        raise ValueError('unsupported array store version %s in %s' %
+                         (meta['version'], dir_name))
+    arrays = dict()
+    for name in meta['arrays']:
+        arrays[str(name)] = scipy.load(os.path.join(dir_name, name + '.npy'),
+                                       mmap_mode=mmap_mode)
+    return meta['header'], arrays
+
+
+## Random numbers
+def createRandomState(seed=None):
+    """Create a RandomState. If seed is None, the seed is drawn from
+    scipy.random, so seeding scipy.random still makes runs reproducible."""
+    if seed is None:
+        seed = scipy.random.randint(2**31 - 1)
+    return scipy.random.RandomState(seed)
+
+class RandomBuffer(object):
+    """Draw random numbers from a RandomState in blocks and hand them out one
+    by one, which avoids the overhead of calling the RandomState for every
+    number.
+
+    *method* is the name of a RandomState method that takes a size argument,
+    e.g., 'random_sample' or 'standard_normal'.
+    """
+    # attributes stored in checkpoints, see librl.experiments.checkpoint.
+    stateAttributes = ('random', 'block', 'index')
+    # the block is empty before the first number is drawn.
+    resizableAttributes = ('block',)
+    def __init__(self, random, method='random_sample', blockSize=4096):
+        self.random = random
+        self.method = method
+        self.blockSize = blockSize
+        self.reset()
+
+    def reset(self):
+        """Discard the numbers that have been drawn"""
+        self.block = scipy.zeros((0,))
+        self.index = 0
+
+    def _refill(self):
+        self.block = getattr(self.random, self.method)(self.blockSize)
+        self.index = 0
+
+    def next(self):
+        if self.index >= len(self.block):
+            self._refill()
+        value = self.block[self.index]
+        self.index += 1
+        return value
+
+    def take(self, n):
+        """Return the next n numbers as an array. The numbers are the same as
+        the ones returned by calling next() n times."""
+        values = scipy.empty((n,))
+        filled = 0
+        while filled < n:
+            if self.index >= len(self.block):
+                self._refill()
+            count = min(n - filled, len(self.block) - self.index)
+            values[filled:(filled+count)] = \
+                self.block[self.index:(self.index+count)]
+            self.index += count
+            filled += count
+        return values
+
 
 ## Feature encoding and decoding.
-import scipy
-def encodeTriuAs1DArray(mat):
-    """Encode the upper-triangular matrix as 1D array."""
+
+# Index tables of packed symmetric matrices. They only depend on the
+# dimension, so they are computed once per dimension.
+_triuIndexTables = dict()
+
+def getTriuIndexTables(n):
+    """Get the cached index tables for a nxn matrix whose upper-triangular part
+    is packed as an 1D array.
+
+    Returns a tuple (iu, flat, sym, offdiag) where
+      iu   -- row and column indices of the upper-triangular part, same as
+              scipy.triu_indices(n).
+      flat -- the flat indices of iu in a nxn matrix.
+      sym  -- a nxn table. sym[i, j] is the position of element (i, j) of the
+              symmetric matrix in the packed array.
+      offdiag -- positions of the strictly upper-triangular elements in the
+              packed array.
+    The tables are read-only.
+    """
+    tables = _triuIndexTables.get(n)
+    if tables is not None:
+        return tables
+
+    iu = scipy.triu_indices(n)
+    flat = scipy.ravel_multi_index(iu, (n, n))
+    sym = scipy.zeros((n, n), dtype=int)
+    sym[iu] = scipy.arange(len(flat))
+    sym[iu[1], iu[0]] = scipy.arange(len(flat))
+    offdiag = scipy.nonzero(iu[0] != iu[1])[0]
+    for arr in iu + (flat, sym, offdiag):
+        arr.setflags(write=False)
+
+    tables = (iu, flat, sym, offdiag)
+    _triuIndexTables[n] = tables
+    return tables
+
+def encodeTriuAs1DArray(mat, out=None):
+    """Encode the upper-triangular matrix as 1D array. If *out* is provided,
+    the result is written to it."""
     assert mat.shape[0] == mat.shape[1], 'only square matrix is supported!'
-    iu = scipy.triu_indices(n=mat.shape[0], k=0)
-    return mat[iu]
+    flat = getTriuIndexTables(mat.shape[0])[1]
+    if out is None:
+        return mat.take(flat)
+    return mat.take(flat, out=out, mode='clip')
 
-def decode1DArrayAsTriu(arr, n):
+def decode1DArrayAsTriu(arr, n, out=None):
     "Decode 1D array as upper-triangular matrix"
     expectedLength = (n * n - n) / 2 + n
     assert expectedLength == len(arr), 'invalid input array.'
-    iu = scipy.triu_indices(n)
-    res = scipy.zeros((n, n))
-    res[iu] = arr
-    return res
+    iu = getTriuIndexTables(n)[0]
+    if out is None:
+        out = scipy.zeros((n, n))
+    else:
+        out[...] = 0
+    out[iu] = arr
+    return out
 
-def decode1DArrayAsSymMat(arr, n):
-    res = decode1DArrayAsTriu(arr, n)
-    return res + res.T - scipy.diag(scipy.diag(res))
+def decode1DArrayAsSymMat(arr, n, out=None):
+    """Decode 1D array as symmetric matrix. If *out* is provided, the result is
+    written to it and no new matrix is allocated."""
+    expectedLength = (n * n - n) / 2 + n
+    assert expectedLength == len(arr), 'invalid input array.'
+    sym = getTriuIndexTables(n)[2]
+    if out is None:
+        return scipy.take(arr, sym)
+    return scipy.take(arr, sym, out=out, mode='clip')
+
+def packedSymMatVec(arr, n, v):
+    """Calculate S * v where S is the nxn symmetric matrix encoded in *arr*
+    without decoding S."""
+    (rows, cols), _, _, offdiag = getTriuIndexTables(n)
+    v = scipy.asarray(v)
+    # the upper-triangular part, including the diagonal.
+    res = scipy.bincount(rows, weights=arr * v[cols], minlength=n)
+    # the strictly lower-triangular part.
+    res += scipy.bincount(cols[offdiag], weights=arr[offdiag] * v[rows[offdiag]],
+                          minlength=n)
+    return res
 
 
 # sherman-morrison update for inverse of A where A is updated according to
@@ -131,7 +299,23 @@ def decode1DArrayAsSymMat(arr, n):
 def shermanMorrisonUpdate(invA, stepsize, z, v):
     if stepsize >= 1:
         return invA
-    nom= invA.dot(scipy.outer(z, v)).dot(invA)
+    # outer(invA z, v' invA) equals invA z v' invA, but only needs O(n^2)
+    # operations.
+    nom = scipy.outer(scipy.dot(invA, z), scipy.dot(v, invA))
     denom = (1.0 - stepsize) + stepsize * scipy.dot(v, scipy.dot(invA, z))
     return 1.0 / (1.0 - stepsize) * (invA - stepsize * nom / denom)
 
+# sherman-morrison update for inverse of A where A is updated according to
+# the following rule.
+# A = A + uv'
+# invA is updated in place. LinAlgError is raised if the updated matrix is
+# (numerically) singular.
+from scipy.linalg import LinAlgError
+def shermanMorrisonRankOneUpdate(invA, u, v, tol=1e-12):
+    invAu = scipy.dot(invA, u)
+    vinvA = scipy.dot(v, invA)
+    denom = 1.0 + scipy.dot(v, invAu)
+    if abs(denom) < tol:
+        raise LinAlgError('singular matrix after rank-1 update')
+    invA -= scipy.outer(invAu, vinvA / denom)
+    return invA
@@ -1,8 +1,11 @@
 from __future__ import print_function, division, absolute_import
 from . import util
+import os
+import shutil
+import tempfile
 import unittest
 import scipy
-from scipy.linalg import inv
+from scipy.linalg import inv, LinAlgError
 from numpy.testing import assert_array_almost_equal, assert_almost_equal
 
 class UtilTestCase(unittest.TestCase):
@@ -28,6 +31,35 @@ class UtilTestCase(unittest.TestCase):
         result = util.decode1DArrayAsSymMat(scipy.array([1, 2, 3, 5, 6, 9]), 3)
         assert_array_almost_equal(expected, result)
 
+    def testDecodeInPlace(self):
+        arr = scipy.array([1, 2, 3, 5, 6, 9], dtype=float)
+        out = scipy.ones((3, 3))
+        result = util.decode1DArrayAsSymMat(arr, 3, out=out)
+        self.assertTrue(result is out)
+        assert_array_almost_equal(util.decode1DArrayAsSymMat(arr, 3), out)
+        result = util.decode1DArrayAsTriu(arr, 3, out=out)
+        self.assertTrue(result is out)
+        assert_array_almost_equal(util.decode1DArrayAsTriu(arr, 3), out)
+
+        packed = scipy.zeros((6,))
+        util.encodeTriuAs1DArray(out, out=packed)
+        assert_array_almost_equal(arr, packed)
+
+    def testGetTriuIndexTables(self):
+        tables = util.getTriuIndexTables(4)
+        self.assertTrue(tables is util.getTriuIndexTables(4))
+        iu, flat, sym, offdiag = tables
+        expected = scipy.triu_indices(4)
+        assert_array_almost_equal(expected[0], iu[0])
+        assert_array_almost_equal(expected[1], iu[1])
+        assert_array_almost_equal(sym, sym.T)
+        self.assertEqual(6, len(offdiag))
+
+    def testPackedSymMatVec(self):
+        arr = scipy.array([1, 2, 3, 5, 6, 9], dtype=float)
+        v = scipy.array([1, -2, 0.5])
+        expected = scipy.dot(util.decode1DArrayAsSymMat(arr, 3), v)
+        assert_array_almost_equal(expected, util.packedSymMatVec(arr, 3, v))
 
     def testShermanMorrisonUpdate(self):
         A = scipy.array([[1, 2],
@@ -41,3 +73,52 @@ class UtilTestCase(unittest.TestCase):
         assert_array_almost_equal(expected, util.shermanMorrisonUpdate(invA,
                                                                        stepsize,
                                                                        z, v))
+
+    def testShermanMorrisonRankOneUpdate(self):
+        A = scipy.array([[1, 2],
+                         [3, 4]], dtype=float)
+        u = scipy.array([4, 1], dtype=float)
+        v = scipy.array([-2, 0], dtype=float)
+        expected = inv(A + scipy.outer(u, v))
+
+        invA = inv(A)
+        result = util.shermanMorrisonRankOneUpdate(invA, u, v)
+        self.assertTrue(result is invA)
+        assert_array_almost_equal(expected, invA)
+
+        # A + uv' is singular.
+        A = scipy.eye(2)
+        u = scipy.array([1, 0], dtype=float)
+        v = scipy.array([-1, 0], dtype=float)
+        self.assertRaises(LinAlgError,
+                          util.shermanMorrisonRankOneUpdate, inv(A), u, v)
+
+    def testArrayStore(self):
+        tmpDir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpDir)
+        dirName = os.path.join(tmpDir, 'store')
+        arrays = {'a': scipy.arange(6).reshape(2, 3),
+                  'b': scipy.random.rand(4)}
+        util.adump(arrays, dirName, header={'n': 2})
+        header, loaded = util.aload(dirName)
+        self.assertEqual({'n': 2}, header)
+        self.assertEqual(set(['a', 'b']), set(loaded.keys()))
+        self.assertTrue(isinstance(loaded['a'], scipy.memmap))
+        self.assertFalse(loaded['a'].flags.writeable)
+        assert_array_almost_equal(arrays['a'], loaded['a'])
+        assert_array_almost_equal(arrays['b'], loaded['b'])
+        header, loaded = util.aload(dirName, mmap_mode=None)
+        self.assertFalse(isinstance(loaded['b'], scipy.memmap))
+        assert_array_almost_equal(arrays['b'], loaded['b'])
+
+    def testRandomBuffer(self):
+        buf = util.RandomBuffer(scipy.random.RandomState(0), 'standard_normal',
+                                blockSize=3)
+        result = [buf.next() for _ in range(7)]
+        expected = scipy.random.RandomState(0).standard_normal(9)[:7]
+        assert_array_almost_equal(expected, result)
+
+        buf.reset()
+        result = scipy.concatenate([buf.take(2), [buf.next()], buf.take(5)])
+        expected = scipy.random.RandomState(0).standard_normal(18)[9:17]
+        assert_array_almost_equal(expected, result)
@@ -0,0 +1,86 @@
+"""Statistics of a field over rolling windows of several runs.
+
+A run is reduced to the count, mean and sum of squared deviations (m2) of the
+windows values[i:i+windowSize] for i in range(0, len(values), interval). The
+windows at the end of a run are cut short by its length. The values of a run
+are read as a sequence of chunks, e.g., the chunks of a binary trace (see
+librl.trace.TraceReader.getChunks), and only the cumulative sums at the window
+boundaries are kept, so the memory does not grow with the length of the run.
+
+The statistics of runs are merged pairwise, so runs can be reduced in any
+order by any number of processes.
+"""
+from __future__ import print_function, division, absolute_import
+import scipy
+
+def _positionsIn(first, last, offset, step):
+    """The positions offset + k * step (k >= 0) in [first, last]"""
+    k0 = max(0, -(-(first - offset) // step))
+    k1 = (last - offset) // step
+    if k1 < k0:
+        return scipy.zeros((0,), dtype=int)
+    return offset + step * scipy.arange(k0, k1 + 1)
+
+def runWindowStats(chunks, windowSize, interval):
+    """Window statistics of one run whose values are given by the iterable
+    *chunks* of 1D arrays. Return (count, mean, m2) arrays."""
+    # prefix sums of the deviations from shift at the window starts and ends.
+    # Position j is the sum of the first j values.
+    startSums, endSums = [], []
+    shift = None
+    length = 0
+    s1 = s2 = 0.0
+    for chunk in chunks:
+        chunk = scipy.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            continue
+        if shift is None:
+            # shift by the first value to reduce the cancellation in m2.
+            shift = chunk[0]
+            startSums.append((0.0, 0.0))
+        deviation = chunk - shift
+        c1 = s1 + scipy.cumsum(deviation)
+        c2 = s2 + scipy.cumsum(deviation * deviation)
+        first, last = length + 1, length + len(chunk)
+        for sums, offset in [(startSums, 0), (endSums, windowSize)]:
+            index = _positionsIn(first, last, offset, interval) - first
+            sums.extend(zip(c1[index], c2[index]))
+        s1, s2 = c1[-1], c2[-1]
+        length = last
+
+    if length == 0:
+        empty = scipy.zeros((0,))
+        return empty, empty, empty
+
+    start = scipy.arange(0, length, interval)
+    end = scipy.minimum(start + windowSize, length)
+    count = (end - start).astype(float)
+    startSums = scipy.array(startSums[:len(start)]).reshape(-1, 2)
+    # the windows that are cut short end at the end of the run.
+    endSums = scipy.array(endSums[:len(start)] +
+                          [(s1, s2)] * (len(start) - len(endSums)))
+    windowSum = endSums[:, 0] - startSums[:, 0]
+    mean = windowSum / count
+    m2 = scipy.maximum(endSums[:, 1] - startSums[:, 1] - windowSum * mean, 0)
+    return count, mean + shift, m2
+
+def mergeWindowStats(a, b):
+    """Merge the window statistics of two sets of runs. Only the windows that
+    exist in both are kept, like the shortest run limits the windows."""
+    n = min(len(a[0]), len(b[0]))
+    (countA, meanA, m2A), (countB, meanB, m2B) = [[x[:n] for x in stats]
+                                                  for stats in (a, b)]
+    count = countA + countB
+    delta = meanB - meanA
+    mean = meanA + delta * countB / count
+    m2 = m2A + m2B + delta * delta * countA * countB / count
+    return count, mean, m2
+
+def summarizeWindowStats(stats):
+    """A dict with the mean, std and count of every window"""
+    count, mean, m2 = stats
+    return {
+        'mean': mean,
+        'std': scipy.sqrt(m2 / count),
+        'count': count,
+    }
@@ -0,0 +1,83 @@
+from __future__ import print_function, division, absolute_import
+import os
+import shutil
+import tempfile
+import unittest
+import scipy
+from numpy.testing import assert_array_almost_equal
+
+from .windowstats import runWindowStats, mergeWindowStats, \
+    summarizeWindowStats
+from .trace import TraceWriter, TraceReader
+
+def splitChunks(values, sizes):
+    chunks, start = [], 0
+    for size in sizes:
+        chunks.append(values[start:(start + size)])
+        start += size
+    chunks.append(values[start:])
+    return chunks
+
+def directWindowStats(runs, windowSize, interval):
+    """mean, std and count of the values of all runs in each window"""
+    windowNumber = min(len(range(0, len(values), interval))
+                       for values in runs)
+    mean, std, count = [], [], []
+    for i in xrange(windowNumber):
+        start = i * interval
+        window = scipy.concatenate([values[start:(start + windowSize)]
+                                    for values in runs])
+        mean.append(window.mean())
+        std.append(window.std())
+        count.append(len(window))
+    return mean, std, count
+
+class WindowStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        random = scipy.random.RandomState(0)
+        # runs of unequal length, whose last windows are cut short.
+        self.runs = [100 + random.standard_normal(50),
+                     100 + random.standard_normal(41),
+                     100 + random.standard_normal(47)]
+
+    def check(self, windowSize, interval, chunkSizes):
+        stats = [runWindowStats(splitChunks(values, chunkSizes), windowSize,
+                                interval) for values in self.runs]
+        result = summarizeWindowStats(reduce(mergeWindowStats, stats))
+        mean, std, count = directWindowStats(self.runs, windowSize, interval)
+        assert_array_almost_equal(mean, result['mean'])
+        assert_array_almost_equal(std, result['std'])
+        assert_array_almost_equal(count, result['count'])
+
+    def testWindows(self):
+        for windowSize, interval in [(1, 1), (7, 3), (5, 5), (3, 7),
+                                     (60, 10)]:
+            # one chunk, chunks that split windows and empty chunks.
+            for chunkSizes in [[], [4, 0, 9, 1], [2] * 30]:
+                self.check(windowSize, interval, chunkSizes)
+
+    def testSingleRun(self):
+        count, mean, m2 = runWindowStats([self.runs[1]], 7, 3)
+        self.assertEqual(14, len(count))
+        # the last window only has values[39:41].
+        self.assertEqual(2, count[-1])
+        self.assertAlmostEqual(self.runs[1][39:].mean(), mean[-1])
+
+    def testEmptyRun(self):
+        count, mean, m2 = runWindowStats([], 5, 1)
+        self.assertEqual(0, len(count))
+
+    def testTraceChunks(self):
+        dirName = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dirName)
+        filename = os.path.join(dirName, 'run.trace')
+        with TraceWriter(filename, chunkSize=8) as trace:
+            for value in self.runs[0]:
+                trace.write(reward=value)
+        chunks = TraceReader(filename).getChunks('reward')
+        self.assertTrue(len(chunks) > 1)
+        assert_array_almost_equal(runWindowStats([self.runs[0]], 7, 3),
+                                  runWindowStats(chunks, 7, 3))
+
+if __name__ == '__main__':
+    unittest.main()
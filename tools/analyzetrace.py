@@ -4,10 +4,17 @@
 It takes output of the multirun.py and plot the reward mean with 95%
 confidence interval.
 
+The runs are aggregated one at a time by a pool of processes: each process
+reads a run chunk by chunk and reduces it to the count, mean and sum of
+squared deviations of every window (see librl.windowstats), and the per-run
+statistics are merged as they arrive. A run is never loaded whole, the memory
+per run is a chunk of values plus a few numbers per window.
+
 Sample Command:
 ./blaze run ./tools/analyzetrace.py ./sample_results/lstd_new_test@50
 """
 import argparse
+import multiprocessing
 import os.path
 import fileinput
 import librl
@@ -18,6 +25,9 @@ import pylab as P
 import scipy.stats as ss
 from collections import defaultdict
 from librl.util import createShardFilenames
+from librl.trace import TraceReader, isTraceFile
+from librl.windowstats import runWindowStats, mergeWindowStats, \
+    summarizeWindowStats
 
 #########################
 # Parameters
@@ -29,6 +39,7 @@ VARS = dict(
     plotInterval = 1, # limit # of pts in the output
     exportFigPath = None,
     showFig = True,
+    processes = multiprocessing.cpu_count(), # processes to read the runs
 )
 
 #########################
@@ -62,28 +73,6 @@ def addRecord(data, record):
     for k, v in record:
         data[k].append(v)
 
-def loadTrace(filename, fields=None):
-    print 'load file: ', filename
-    data = defaultdict(list)
-    i = 0
-    with open(filename, 'r') as fObj:
-        for line in fObj:
-            if not line or line[0] == '-':
-                continue
-            i += 1
-            if i == ARGS.sampleInterval:
-                i = 0
-                # parse the line and extract values
-                tokens = line.split(',')
-                for t in tokens:
-                    subtokens = t.split(':')
-                    if fields is not None and subtokens[0] in fields:
-                        data[subtokens[0]].append(float(subtokens[1]))
-                        break
-
-                    data[subtokens[0]].append(float(subtokens[1]))
-    return data
-
 def rollingMean(data, windowSize, interval):
     N = len(data)
     result = []
@@ -91,16 +80,62 @@ def rollingMean(data, windowSize, interval):
         result.append(np.mean(data[i:i+windowSize]))
     return result
 
-def multipleRunRollingMean(mData, field, windowSize, interval):
-    minLen = min([len(data[field]) for data in mData])
-    windowStats = defaultdict(list)
-    for i in xrange(0, minLen, interval):
-        windowData = []
-        for data in mData:
-            windowData.extend(data[field][i:i+windowSize])
-        windowStats['mean'].append(np.mean(windowData))
-        windowStats['std'].append(np.std(windowData))
-    return windowStats
+def iterTraceChunks(filename, field, chunkSize=4096):
+    """Yield the values of field in filename chunk by chunk. Only every
+    sampleInterval-th row is kept, i.e., rows sampleInterval - 1,
+    2 * sampleInterval - 1, ..."""
+    print 'load file: ', filename
+    step = ARGS.sampleInterval
+    if isTraceFile(filename):
+        row = 0
+        for chunk in TraceReader(filename).getChunks(field):
+            # rows step - 1, 2 * step - 1, ... of the whole trace.
+            yield chunk[((step - 1 - row) % step)::step]
+            row += len(chunk)
+        return
+
+    values = []
+    i = 0
+    with open(filename, 'r') as fObj:
+        for line in fObj:
+            if not line or line[0] == '-':
+                continue
+            i += 1
+            if i < step:
+                continue
+            i = 0
+            for t in line.split(','):
+                subtokens = t.split(':')
+                if subtokens[0] == field:
+                    values.append(float(subtokens[1]))
+                    break
+            if len(values) == chunkSize:
+                yield values
+                values = []
+    if values:
+        yield values
+
+def loadWindowStats(job):
+    filename, field, windowSize, interval = job
+    return runWindowStats(iterTraceChunks(filename, field), windowSize,
+                          interval)
+
+def multipleRunRollingStats(filenames, field, windowSize, interval,
+                            processes=1):
+    """Rolling mean, std and count of field over the runs in filenames. Runs
+    are read and reduced in parallel by *processes* processes."""
+    jobs = [(filename, field, windowSize, interval) for filename in filenames]
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(loadWindowStats, jobs)
+    else:
+        pool = None
+        results = (loadWindowStats(job) for job in jobs)
+    stats = reduce(mergeWindowStats, results)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    return summarizeWindowStats(stats)
 
 def plotWithCI(x, y, yerr):
     P.plot(x, y, '-')
@@ -115,16 +150,17 @@ def main():
     else:
         filenames = [ARGS.filename]
 
-    mData = [loadTrace(filename, ('reward')) for filename in filenames if
-             os.path.isfile(filename)]
-    windowStats = multipleRunRollingMean(mData, 'reward', ARGS.windowSize,
-                                         ARGS.plotInterval)
+    filenames = [filename for filename in filenames
+                 if os.path.isfile(filename)]
+    windowStats = multipleRunRollingStats(filenames, 'reward',
+                                          ARGS.windowSize, ARGS.plotInterval,
+                                          ARGS.processes)
     ptNumber = len(windowStats['mean'])
 
-    runNumber = len(filenames)
     rewardMean = windowStats['mean']
     rewardStd= windowStats['std']
-    sampleNumber = runNumber * ARGS.windowSize
+    # number of samples in each window over all runs.
+    sampleNumber = windowStats['count']
     rewardSem = rewardStd / (P.sqrt(sampleNumber))
     confidenceLevel = 0.95
     yerr = ss.t.ppf((confidenceLevel + 1) / 2.0, sampleNumber-1) * rewardSem
@@ -135,7 +171,7 @@ def main():
     import json
     data = {
         'x': range(ptNumber),
-        'y': rewardMean,
+        'y': rewardMean.tolist(),
     }
     json.dump(data, open(ARGS.exportFigPath, 'w'))
 
@@ -1,26 +1,34 @@
 #!/usr/bin/env python
-""" A utility program to run a command multiple times and save std output.
+""" A utility program to run a script multiple times and save std output.
 
 It save the std output to shareded file where each file has the format of
-<prefix>_<shard_number>_of_<total_shard_number>. Each run is done by a
-separate process, and a done file will be written when the process finishes.
+<prefix>_<shard_number>_of_<total_shard_number>. The runs are done by a pool
+of worker processes. scipy, pybrain and librl are imported once by the main
+process, and every shard runs the script in-process in a new worker forked
+from it, with scipy.random and random seeded by <seed> + <shard_number> and
+sys.argv set to [<script>]. A worker is not reused, so the changes a script
+makes to modules, e.g., to SessionExperiment.fastRollout, don't leak into the
+other shards. The std output of a run is streamed to its shard file line by
+line, and a done file is written when the run finishes, either normally or by
+sys.exit(0).
 
-Here is a handy shell function to check the progress. To use it, please add it
-to your ~/.bashrc and run source ~/.bashrc in shell command
-
-function check_process() {
-  echo `ls $1 | grep ".done" | wc -l` out of \
-       `ls $1 | grep -v ".done" | wc -l` runs has finished
-}
+Shards that already have a done file are skipped, so an interrupted job can
+be resumed by running the same command again. The progress and throughput are
+printed to stderr as runs finish.
 
 Sample Commands: (in top folder)
 ./blaze run ./tools/multirun.py examples/maze/lstdexample.py
 ./sample_results/lstd_new_test@100
 """
 import multiprocessing
-from subprocess import check_call
-from librl.util import createShardFilenames
 import datetime
+import os
+import random
+import runpy
+import sys
+import time
+import traceback
+from librl.util import createShardFilenames
 
 import argparse
 parser = argparse.ArgumentParser(description='run script multiple times')
@@ -29,28 +37,98 @@ parser.add_argument('script_filename',
 parser.add_argument('output_filename',
                     help='output sharded filename. It has format of prefix@N, '
                          'where N is the # of runs')
+parser.add_argument('--processes', type=int, default=None,
+                    help='# of worker processes, default is the # of CPUs')
+parser.add_argument('--seed', type=int, default=0,
+                    help='shard i is run with seed + i')
 
-args = parser.parse_args()
+def runShard(job):
+    """Run the script once with stdout redirected to filename. Return
+    (filename, elapsed seconds, error message or None)"""
+    scriptFilename, filename, seed = job
+    import scipy
+    scriptDir = os.path.dirname(os.path.abspath(scriptFilename))
+    if scriptDir not in sys.path:
+        sys.path.insert(0, scriptDir)
+    scipy.random.seed(seed)
+    random.seed(seed)
 
-def myExecute(filename):
     startTime = datetime.datetime.now()
-    check_call('./blaze run %s > %s' % (args.script_filename, filename),
-               shell=True)
+    error = None
+    stdout = sys.stdout
+    argv = sys.argv
+    with open(filename, 'w', 1) as output:
+        sys.stdout = output
+        # the script sees the same arguments as with ./blaze run.
+        sys.argv = [scriptFilename]
+        try:
+            runpy.run_path(scriptFilename, run_name='__main__')
+        except SystemExit as e:
+            # sys.exit(0) and sys.exit() finish the run normally.
+            if e.code not in (0, None):
+                error = traceback.format_exc()
+        except Exception:
+            error = traceback.format_exc()
+        finally:
+            sys.stdout = stdout
+            sys.argv = argv
     endTime = datetime.datetime.now()
     timeDelta = endTime - startTime
-    fmt = "%Y-%m-%d %H:%M:%S"
-    message = ("start time: %s \n"
-              "end time: %s \n"
-              "elapsed time: %i seconds\n") % (startTime.strftime(fmt),
-                                              endTime.strftime(fmt),
-                                              timeDelta.total_seconds())
-    check_call('echo "%s" > %s.done' % (message, filename), shell=True)
-
-tokens = args.output_filename.split('@')
-assert len(tokens) == 2, 'wrong format of output file'
-outputPrefix = tokens[0]
-shardNumber = int(tokens[1])
-
-p = multiprocessing.Pool()
-outputFilenames = createShardFilenames(outputPrefix, shardNumber)
-p.map(myExecute, outputFilenames)
+    if error is None:
+        fmt = "%Y-%m-%d %H:%M:%S"
+        message = ("start time: %s \n"
+                  "end time: %s \n"
+                  "elapsed time: %i seconds\n"
+                  "seed: %i\n") % (startTime.strftime(fmt),
+                                   endTime.strftime(fmt),
+                                   timeDelta.total_seconds(), seed)
+        with open(filename + '.done', 'w') as done:
+            done.write(message)
+    return filename, timeDelta.total_seconds(), error
+
+def main():
+    args = parser.parse_args()
+    tokens = args.output_filename.split('@')
+    assert len(tokens) == 2, 'wrong format of output file'
+    outputPrefix = tokens[0]
+    shardNumber = int(tokens[1])
+
+    outputFilenames = createShardFilenames(outputPrefix, shardNumber)
+    jobs = [(args.script_filename, filename, args.seed + i)
+            for i, filename in enumerate(outputFilenames)
+            if not os.path.isfile(filename + '.done')]
+    skipped = shardNumber - len(jobs)
+    sys.stderr.write('%i out of %i runs have finished, %i runs to go\n' %
+                     (skipped, shardNumber, len(jobs)))
+    if not jobs:
+        return
+
+    # the heavy modules are imported once here and inherited by the workers.
+    import scipy
+    import pybrain.rl.experiments
+    import librl.experiments
+    # one run per worker, so that the runs don't share module state.
+    p = multiprocessing.Pool(args.processes, maxtasksperchild=1)
+    startTime = time.time()
+    failures = 0
+    for i, (filename, elapsed, error) in enumerate(
+            p.imap_unordered(runShard, jobs)):
+        if error is not None:
+            failures += 1
+            sys.stderr.write('%s failed:\n%s' % (filename, error))
+        totalTime = time.time() - startTime
+        throughput = (i + 1) / totalTime * 60
+        eta = (len(jobs) - i - 1) / throughput * 60
+        sys.stderr.write('[%i/%i] %s finished in %i seconds, '
+                         '%.2f runs/min, ETA %i seconds\n' %
+                         (skipped + i + 1, shardNumber, filename, elapsed,
+                          throughput, eta))
+    p.close()
+    p.join()
+    if failures:
+        sys.stderr.write('%i runs failed, run the command again to retry '
+                         'them\n' % failures)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()